@@ -26,6 +26,35 @@ def create_config_file(cfg, path):
     cfg['Preferences'] = dict(timeout='10',
                               daemon_refresh_rate='0.1',
                               number_of_threads='4',
+                              worker_budget='',
+                              propagate_threads='yes',
+                              cpu_affinity='no',
+                              memory_watchdog='no',
+                              memory_ceiling='90',
+                              watchdog_interval='1',
+                              max_requeue='1',
+                              job_order='lpt',
+                              working_format='nii.gz',
+                              intermediate_cache='no',
+                              cache_budget='4G',
+                              cache_writers='2',
+                              speculative='no',
+                              speculation_multiplier='2',
+                              speculation_min_finished='3',
+                              autotune='no',
+                              log_tail_lines='100',
+                              cancel_grace_period='10',
+                              fuse_commands='no',
+                              worker_pool='no',
+                              preload_modules='',
+                              backend='local',
+                              batch_submit='',
+                              batch_poll='',
+                              batch_cancel='',
+                              batch_poll_codes='0',
+                              batch_poll_interval='5',
+                              work_queue='no',
+                              queue_heartbeat='30',
                               verbose='yes',
                               logging='yes',
                               )
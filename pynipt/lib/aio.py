@@ -0,0 +1,198 @@
+import os
+import time
+import asyncio
+import threading
+import subprocess as sp
+from .scheduler import Worker, Scheduler
+
+# the buffer limit of the pipe readers, the longer line is read in chunks
+STREAM_LIMIT = 2 ** 20
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """ return the event loop running on the daemon thread, which is shared by all AsyncSchedulers
+    in the process, so single thread supervises the children of all steps """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            thread = threading.Thread(target=_run_loop, args=(loop, ready))
+            thread.daemon = True
+            thread.start()
+            ready.wait()
+            _loop = loop
+    return _loop
+
+
+def _pidfd_supported():
+    """ True if the exit of the child can be watched with pidfd on the event loop (linux 5.3+) """
+    if not hasattr(os, 'pidfd_open'):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return False
+    return True
+
+
+_use_pidfd = _pidfd_supported()
+
+
+def _run_loop(loop, ready):
+    # the child watcher of the policy is left as it is, as it is shared by the whole process.
+    # the workers watch their own children with pidfd if available, see AsyncWorker
+    asyncio.set_event_loop(loop)
+    loop.call_soon(ready.set)
+    loop.run_forever()
+
+
+class AsyncWorker(Worker):
+    """ Worker to execute single shell command as the coroutine on the event loop.
+
+    The pipes of the command are read without blocking, so no thread is needed to read the messages of each
+    worker. Where pidfd is available, the exit of the command is also watched on the event loop with its pidfd,
+    otherwise the command is launched with asyncio.create_subprocess_exec, whose child watcher before python 3.12
+    waits each child on its own thread. The error terms, log spools and signals are handled as the Worker does.
+    """
+    async def run_async(self):
+        """ coroutine version of run """
+        if self._cancelled:
+            return self._status
+        self._status = 'running'
+        self._started = time.time()
+        self._open_spools()
+        try:
+            await self._execute_async()
+        finally:
+            self._finished = time.time()
+            self._stdout.close()
+            self._stderr.close()
+        if self._cancelled:
+            self._status = 'cancelled'
+        else:
+            self._status = 'failed' if self._inspect() else 'succeeded'
+        return self._status
+
+    async def _stream_async(self, stream, spool):
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # the line exceeds the buffer limit, take the buffered part
+                line = await stream.read(STREAM_LIMIT)
+            if not line:
+                break
+            self._feed(line, spool)
+
+    async def _execute_async(self):
+        if not _use_pidfd:
+            return await self._execute_watched()
+        loop = asyncio.get_running_loop()
+        # new session makes the command the leader of its own process group
+        proc = sp.Popen(['/bin/sh', '-c', self._cmd], stdout=sp.PIPE, stderr=sp.PIPE, start_new_session=True,
+                        env=self._environ(), preexec_fn=self._preexec())
+        self._pid = proc.pid
+        if self._cancelled:
+            # cancelled while launching
+            self._terminate()
+        exited = loop.create_future()
+        pidfd = os.pidfd_open(proc.pid)
+        # the pidfd is readable once the child exits
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        transports = []
+        try:
+            readers = []
+            for pipe in [proc.stdout, proc.stderr]:
+                reader = asyncio.StreamReader(limit=STREAM_LIMIT, loop=loop)
+                transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop),
+                                                            pipe)
+                transports.append(transport)
+                readers.append(reader)
+            await asyncio.gather(self._stream_async(readers[0], self._stdout),
+                                 self._stream_async(readers[1], self._stderr))
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+            for transport in transports:
+                transport.close()
+        # the child is already exited, so it is reaped without blocking
+        self._returncode = proc.wait()
+
+    async def _execute_watched(self):
+        """ launch the command with the child watcher of the event loop policy """
+        # new session makes the command the leader of its own process group
+        proc = await asyncio.create_subprocess_exec('/bin/sh', '-c', self._cmd,
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE,
+                                                    start_new_session=True, limit=STREAM_LIMIT,
+                                                    env=self._environ(), preexec_fn=self._preexec())
+        self._pid = proc.pid
+        if self._cancelled:
+            # cancelled while launching
+            self._terminate()
+        await asyncio.gather(self._stream_async(proc.stdout, self._stdout),
+                             self._stream_async(proc.stderr, self._stderr))
+        self._returncode = await proc.wait()
+
+
+class AsyncScheduler(Scheduler):
+    """ Scheduler to execute the queued workers as the coroutines on the shared event loop.
+
+    All workers of the sub-step are supervised by single event loop thread, and the concurrency is capped by
+    the semaphore. The admission by resources, fail-fast policy, cancellation and log spooling work as
+    the Scheduler does, which suits the steps with thousands of short commands.
+    The workers must be AsyncWorker.
+    """
+    def _run_step(self, step_idx, workers):
+        key = self._get_key(step_idx)
+        self._stdout.setdefault(key, dict())
+        self._stderr.setdefault(key, dict())
+        future = asyncio.run_coroutine_threadsafe(self._run_step_async(step_idx, workers), get_event_loop())
+        future.result()
+
+    async def _run_step_async(self, step_idx, workers):
+        # the autotune adjusts the concurrency under its maximum, the admission keeps the current one
+        limit = self._n_threads if self._tuner is None else max(self._n_threads, self._tuner.maximum)
+        semaphore = asyncio.Semaphore(limit)
+        # the tasks acquire the semaphore in the order they are started
+        workers = self._ordered(workers)
+        worker_ids = set(workers.keys())
+        while len(workers):
+            await asyncio.gather(*[self._execute_async(step_idx, worker, semaphore)
+                                   for worker in workers.values()])
+            workers = self._pop_requeued(step_idx, worker_ids)
+
+    async def _execute_async(self, step_idx, worker, semaphore):
+        async with semaphore:
+            if not await self._admit_async(step_idx, worker):
+                # cancelled or aborted before the launch
+                worker.cancel()
+                return
+            self._prepare_worker(step_idx, worker)
+            try:
+                status = await worker.run_async()
+            except Exception:
+                status = 'failed'
+            finally:
+                self._release(step_idx, worker)
+            if (step_idx, worker.id) in self._speculations:
+                # waits for the duplicate, so it runs off the event loop
+                status = await asyncio.get_event_loop().run_in_executor(None, self._settle, step_idx, worker, status)
+            self._collect(step_idx, worker, status)
+
+    async def _admit_async(self, step_idx, worker):
+        """ coroutine version of _admit """
+        while True:
+            with self._lock:
+                if step_idx in self._aborted_steps or self._cancelled:
+                    return False
+                if self._is_admissible(step_idx, worker):
+                    self._running[(step_idx, worker.id)] = worker
+                    self._track_saturation((step_idx, worker.id))
+                    return True
+            await asyncio.sleep(self._refresh_rate)
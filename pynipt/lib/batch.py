@@ -0,0 +1,306 @@
+import os
+import time
+import shlex
+import shutil
+import tempfile
+import subprocess as sp
+from collections import OrderedDict
+from .scheduler import Spool, Worker, Scheduler, WorkerBudget, THREAD_ENV_VARS
+from ..config import config
+
+# the stand-in of the batch scheduler which runs the job scripts on the local machine,
+# each job runs on its own session, so the job id (pid) is also the process group to cancel.
+LOCAL_SUBMITTER = dict(submit='setsid sh {script} > {stdout} 2> {stderr} < /dev/null & echo $!',
+                       poll="for p in $(echo {job_ids} | tr ',' ' '); do kill -0 $p 2>/dev/null && echo $p; done; true",
+                       cancel='pkill -TERM -g {job_id}')
+
+
+def get_submitter():
+    """ return the submit, poll and cancel command templates in the config.
+    The local submitter is used for the template not specified.
+
+    Notes:
+        The templates are read as raw string, so '%' does not need to be escaped.
+        submit:     {script}, {stdout}, {stderr}, {name}, {cpus} and {mem_mb} are available,
+                    the last line of the output is regarded as the job id (e.g. 'sbatch --parsable')
+        poll:       {job_ids} is available (comma separated), the output must list the job ids still alive.
+                    The output is taken only if the exit status is in 'batch_poll_codes' (0 by default),
+                    otherwise it is regarded as unknown, e.g. the transient error of the controller.
+                    The status meaning no job is alive (e.g. 1 of 'squeue -j' for the finished jobs)
+                    can be added there.
+        cancel:     {job_id} is available
+    """
+    cfg = config['Preferences']
+    submitter = dict()
+    for key, default in LOCAL_SUBMITTER.items():
+        value = cfg.get(f'batch_{key}', fallback='', raw=True)
+        submitter[key] = value if len(value.strip()) else default
+    return submitter
+
+
+class BatchWorker(Worker):
+    """ Worker to submit single shell command to the batch scheduler as a job script.
+
+    The script writes the exit status of the command into the file next to the log files, which is used to
+    track the completion. The log files written by the job are followed while polling, so the error terms
+    are checked and the last lines are kept in memory as the local Worker does.
+    """
+    def __init__(self, id=None, cmd=None, errterm=None, submitter=None, poll_interval=None, **kwargs):
+        super(BatchWorker, self).__init__(id=id, cmd=cmd, errterm=errterm, **kwargs)
+        self._submitter = get_submitter() if submitter is None else submitter
+        if poll_interval is None:
+            poll_interval = config['Preferences'].getfloat('batch_poll_interval', fallback=5)
+        self._poll_interval = poll_interval
+        self._job_id = None
+        self._offsets = dict(stdout=0, stderr=0)
+        self._partial = dict(stdout=b'', stderr=b'')
+        self._missing = 0
+        # the temporary folder of the job submitted without the log folder, removed when it is finished
+        self._temp_dir = None
+
+    @property
+    def job_id(self):
+        return self._job_id
+
+    @property
+    def script_path(self):
+        return f'{self._log_prefix}.sh'
+
+    @property
+    def exit_path(self):
+        return f'{self._log_prefix}.exit'
+
+    def _open_spools(self):
+        # the log files are written by the job, so the messages are kept only in memory
+        self._stdout = Spool(maxlen=self._tail)
+        self._stderr = Spool(maxlen=self._tail)
+
+    def _format(self, template, **kwargs):
+        mem, cpus = self._resources['mem'], self._resources['cpus']
+        values = dict(script=shlex.quote(self.script_path),
+                      stdout=shlex.quote(self.log_path('stdout')),
+                      stderr=shlex.quote(self.log_path('stderr')),
+                      name=shlex.quote(os.path.basename(self._log_prefix)),
+                      cpus=1 if cpus is None else cpus,
+                      mem_mb='' if mem is None else int(mem / 1024 ** 2),
+                      job_id=self._job_id)
+        values.update(kwargs)
+        return template.format(**values)
+
+    def _write_script(self):
+        if os.path.exists(self.exit_path):
+            os.unlink(self.exit_path)
+        # the command runs on the subshell, so the exit status is written even if the command uses 'set -e'
+        exports = ''.join([f'export {var}={shlex.quote(value)}\n' for var, value in self._env.items()])
+        exit_path, exit_temp = shlex.quote(self.exit_path), shlex.quote(f'{self.exit_path}.tmp')
+        with open(self.script_path, 'w') as f:
+            f.write('#!/bin/sh\n'
+                    f'{exports}'
+                    f'(\n{self._cmd}\n)\n'
+                    f'echo $? > {exit_temp} && mv {exit_temp} {exit_path}\n')
+
+    def submit(self):
+        """ write the job script and submit it, return the status of the worker """
+        if self._cancelled:
+            return self._status
+        if self._log_prefix is None:
+            # submitted without the scheduler
+            self._temp_dir = tempfile.mkdtemp(prefix='pynipt-')
+            self._log_prefix = os.path.join(self._temp_dir, f'worker{self._id}')
+        self._status = 'running'
+        self._started = time.time()
+        self._open_spools()
+        self._write_script()
+        proc = sp.run(self._format(self._submitter['submit']), shell=True, stdout=sp.PIPE, stderr=sp.PIPE)
+        lines = [line.strip() for line in proc.stdout.decode('utf-8', errors='replace').split('\n')
+                 if len(line.strip())]
+        if proc.returncode != 0 or not len(lines):
+            self._stderr.write(proc.stderr)
+            self._returncode = proc.returncode or 1
+            self._finish()
+        else:
+            # e.g. 'sbatch --parsable' prints 'jobid;cluster'
+            self._job_id = lines[-1].split(';')[0]
+        return self._status
+
+    def poll(self, alive=None):
+        """ check the completion of the job
+        Args:
+            alive:      set of job ids known to the batch scheduler, the job disappeared without exit status
+                        is regarded as failed. The check is skipped if None.
+        Returns:
+            True if the job is finished
+        """
+        if self._status != 'running':
+            return True
+        self._follow()
+        if self._errterm_found is not None:
+            self._returncode = self._returncode or 1
+            self._finish()
+        elif os.path.exists(self.exit_path):
+            with open(self.exit_path, 'r') as f:
+                status = f.read().strip()
+            self._returncode = int(status) if status.lstrip('-').isdigit() else 1
+            self._follow()
+            self._finish()
+        elif alive is not None and self._job_id not in alive:
+            # the exit status can be written right after the job is gone, so check once more
+            self._missing += 1
+            if self._missing > 1:
+                self._stderr.write('The job disappeared from the batch scheduler without exit status.\n')
+                self._returncode = -1
+                self._finish()
+        else:
+            self._missing = 0
+        return self._status != 'running'
+
+    def _follow(self):
+        """ read the lines newly written on the log files """
+        for stream, spool in [('stdout', self._stdout), ('stderr', self._stderr)]:
+            try:
+                with open(self.log_path(stream), 'rb') as f:
+                    f.seek(self._offsets[stream])
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            self._offsets[stream] += len(data)
+            lines = (self._partial[stream] + data).split(b'\n')
+            self._partial[stream] = lines.pop()
+            for line in lines:
+                self._feed(line + b'\n', spool)
+
+    def _finish(self):
+        if self._status != 'running':
+            return
+        self._finished = time.time()
+        for stream, spool in [('stdout', self._stdout), ('stderr', self._stderr)]:
+            if len(self._partial[stream]):
+                self._feed(self._partial[stream], spool)
+                self._partial[stream] = b''
+            spool.close()
+        if self._cancelled:
+            self._status = 'cancelled'
+        else:
+            self._status = 'failed' if self._inspect() else 'succeeded'
+        if self._temp_dir is not None:
+            # the messages are kept in memory
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+            self._log_prefix = None
+
+    def _cancel_job(self):
+        if self._job_id is not None:
+            sp.run(self._format(self._submitter['cancel']), shell=True, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+
+    def _terminate(self):
+        self._cancel_job()
+
+    def _kill(self):
+        self._cancel_job()
+
+    def cancel(self):
+        super(BatchWorker, self).cancel()
+        if self._status == 'running':
+            self._returncode = -1 if self._returncode is None else self._returncode
+            self._finish()
+
+    def run(self):
+        """ submit the job and wait until it is finished """
+        self.submit()
+        while not self.poll():
+            time.sleep(self._poll_interval)
+        return self._status
+
+
+class BatchScheduler(Scheduler):
+    """ Scheduler to submit the workers to the batch scheduler (e.g. SLURM) instead of running them
+    on the local threads.
+
+    All workers of the sub-step are submitted at once, as the batch scheduler takes care of the resources,
+    and the jobs are polled together with single poll command at every poll interval.
+    Each worker is submitted as its own job rather than the task of an array job, as the submit, poll and cancel
+    templates are not specific to any batch scheduler, and each job keeps its own resources, exit status
+    and cancellation. The workers must be BatchWorker, see get_submitter for the command templates.
+    """
+    def __init__(self, n_threads: int = None, refresh_rate: float = None, poll_interval: float = None):
+        super(BatchScheduler, self).__init__(n_threads=n_threads, refresh_rate=refresh_rate)
+        if poll_interval is None:
+            poll_interval = config['Preferences'].getfloat('batch_poll_interval', fallback=5)
+        self._poll_interval = poll_interval
+        self._submitter = get_submitter()
+        codes = config['Preferences'].get('batch_poll_codes', fallback='0')
+        self._poll_codes = [int(c) for c in codes.split(',') if len(c.strip())]
+        # the jobs run on the cluster, so they do not take the worker budget and memory of this node
+        self._budget = WorkerBudget()
+        self._watchdog = False
+        # the folder of the job scripts and logs if the log folder is not set, removed after the run
+        self._script_dir = None
+
+    def set_autotune(self, initial: int = 2, maximum: int = None):
+        """ the concurrency is controlled by the batch scheduler, so the autotune is not available """
+        pass
+
+    def _thread_env(self, step_idx, worker):
+        """ the job runs with the cpus submitted for it, not with the cores of this node """
+        n_threads = self._threads_per_worker
+        if n_threads is None:
+            if not self._propagate_threads:
+                return dict()
+            n_threads = worker.resources['cpus'] or 1
+        return dict([(var, str(max(int(n_threads), 1))) for var in THREAD_ENV_VARS])
+
+    def _set_worker_log(self, step_idx, worker, suffix=''):
+        """ the job script and the exit status are written next to the log files, so the folder is always set """
+        if self._log_dir is not None:
+            super(BatchScheduler, self)._set_worker_log(step_idx, worker, suffix=suffix)
+            return
+        if self._script_dir is None:
+            self._script_dir = tempfile.mkdtemp(prefix='pynipt-batch-')
+        worker.set_log(os.path.join(self._script_dir, f'{self._get_key(step_idx)}-worker{worker.id}{suffix}'),
+                       tail=self._tail)
+
+    def _run_steps(self):
+        try:
+            super(BatchScheduler, self)._run_steps()
+        finally:
+            if self._script_dir is not None:
+                shutil.rmtree(self._script_dir, ignore_errors=True)
+                self._script_dir = None
+
+    def _poll_jobs(self, workers):
+        """ return the set of alive job ids, None if the poll command is failed, so the jobs are not regarded
+        as disappeared by the transient error """
+        job_ids = [w.job_id for w in workers if w.job_id is not None]
+        if not len(job_ids):
+            return None
+        proc = sp.run(self._submitter['poll'].format(job_ids=','.join(job_ids)), shell=True,
+                      stdout=sp.PIPE, stderr=sp.DEVNULL)
+        if proc.returncode not in self._poll_codes:
+            return None
+        return set(proc.stdout.decode('utf-8', errors='replace').split())
+
+    def _run_step(self, step_idx, workers):
+        key = self._get_key(step_idx)
+        self._stdout.setdefault(key, dict())
+        self._stderr.setdefault(key, dict())
+        pending = OrderedDict()
+        for worker_id, worker in self._ordered(workers).items():
+            if self._cancelled or step_idx in self._aborted_steps:
+                worker.cancel()
+                continue
+            self._prepare_worker(step_idx, worker)
+            with self._lock:
+                self._running[(step_idx, worker_id)] = worker
+            if worker.submit() == 'running':
+                pending[worker_id] = worker
+            else:
+                self._release(step_idx, worker)
+                self._collect(step_idx, worker, worker.status)
+        while len(pending):
+            time.sleep(self._poll_interval)
+            alive = self._poll_jobs(pending.values())
+            for worker_id, worker in list(pending.items()):
+                if worker.poll(alive):
+                    del pending[worker_id]
+                    self._release(step_idx, worker)
+                    self._collect(step_idx, worker, worker.status)
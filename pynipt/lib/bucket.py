@@ -4,6 +4,7 @@ import os
 import re
 from collections import namedtuple
 from ..config import config
+from .compress import PARTIAL_SUFFIX
 import warnings
 import pandas as pd
 
@@ -31,6 +32,7 @@ class BucketBase(object):
         self._param_keys = dict()
         self._params = dict()
         self._multi_session = False
+        self._planned = dict()
         self.msi = None
 
     @property
@@ -56,6 +58,33 @@ class BucketBase(object):
     def set_path(self, path):
         self._path = self._abspath(path)
 
+    def add_planned(self, abspaths: list):
+        """Add the files planned on the dry-run, which are listed in the dataset until they are created,
+        so the following steps resolve them as their inputs.
+        Args:
+            abspaths: the paths of the planned files
+        """
+        for abspath in abspaths:
+            abspath = self._abspath(abspath)
+            for idx, dc in enumerate(__dc__):
+                if abspath.startswith(self.msi.path.join(self._path, dc) + self.msi.sep):
+                    self._planned.setdefault(idx, []).append(abspath)
+
+    def clear_planned(self):
+        """Forget the files planned on the dry-run"""
+        self._planned = dict()
+
+    def _get_planned(self, idx: int, path: str) -> list:
+        """Return the planned files of the dataclass not created yet, as (abspath, path components)"""
+        planned = []
+        if idx == 2:
+            # the report does not keep the file structure
+            return planned
+        for abspath in self._planned.get(idx, []):
+            if not self.msi.path.exists(abspath):
+                planned.append((abspath, abspath[len(path) + 1:].split(self.msi.sep)))
+        return planned
+
     def _walk(self, path):
         return tuple((None, None, None))
 
@@ -194,6 +223,9 @@ class BucketBase(object):
         """
         path = self.msi.path.join(self._path, __dc__[idx])
         container, max_depth = self.parser(path)
+        planned = self._get_planned(idx, path)
+        for _, components in planned:
+            max_depth = max(max_depth, len(components) - 1)
         columns = self.compose_columns(idx, max_depth)
 
         # if the folder does not contain any data
@@ -228,7 +260,7 @@ class BucketBase(object):
 
             # processing cases
             else:
-                container = container[max_depth]
+                container = container.get(max_depth, dict())
                 iter_obj = []
                 for comp in container.values():
                     iter_obj.extend(comp['sub_files'])
@@ -251,11 +283,27 @@ class BucketBase(object):
                             for f in iter_obj[i]:
                                 if f in [fn.strip() for fn in config['Dataset structure']['ignore'].split(',')]:
                                     pass
+                                elif f.endswith(PARTIAL_SUFFIX):
+                                    # being compressed
+                                    pass
                                 else:
                                     abspath = self.msi.path.join(base_path, f)
                                     list_finfo.append(finfo(**dict(zip(columns, components + [f, abspath]))))
                         i += 1
 
+            existing = set([finfo_.Abspath for finfo_ in list_finfo])
+            for abspath, components in planned:
+                if len(components) - 1 != max_depth or abspath in existing:
+                    continue
+                for p, comp in enumerate(components[:-1]):
+                    param_dict[param_keys[p]] = sorted(list(set(param_dict[param_keys[p]] + [comp])))
+                list_finfo.append(finfo(**dict(zip(columns, components + [abspath]))))
+
+            # the uncompressed NIfTI file is the same logical file as the compressed one next to it,
+            # which is removed right after the compression
+            abspaths = set([finfo_.Abspath for finfo_ in list_finfo])
+            list_finfo = [finfo_ for finfo_ in list_finfo
+                          if not (finfo_.Abspath.endswith('.nii') and nifti_counterpart(finfo_.Abspath) in abspaths)]
             self._dataset[idx] = list_finfo
             self._column_info[idx] = columns
             self._param_keys[idx] = param_keys
@@ -459,9 +507,10 @@ class BucketHandler(BucketBase):
                 result = []
                 if regex is False:
                     if keyword == 'ext':
+                        # '.nii' and '.nii.gz' are matched with each other
                         for flt in filters:
                             result.append([finfo for finfo in dataset \
-                                           if finfo._asdict()[attributes].endswith(flt)])
+                                           if logical_name(finfo._asdict()[attributes]).endswith(logical_name(flt))])
                     elif keyword == 'regex':
                         for flt in filters:
                             pattern = re.compile(flt)
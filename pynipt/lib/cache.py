@@ -0,0 +1,207 @@
+import os
+import sys
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from ..config import config
+from ..errors import *
+from ..utils import parse_size
+
+
+def _default_loader(path):
+    try:
+        import nibabel
+    except ImportError:
+        raise InvalidApproach('nibabel is required to load the image, or the loader must be given.')
+    return nibabel.load(path)
+
+
+def _default_writer(obj, path):
+    if not hasattr(obj, 'to_filename'):
+        raise InvalidApproach(f'{type(obj).__name__} can not be written without the writer.')
+    obj.to_filename(path)
+
+
+def _sizeof(obj):
+    """ the bytes of the array or the image kept in memory """
+    if hasattr(obj, 'nbytes'):
+        return obj.nbytes
+    dataobj = getattr(obj, 'dataobj', None)
+    if dataobj is not None:
+        if hasattr(dataobj, 'nbytes'):
+            return dataobj.nbytes
+        if hasattr(dataobj, 'shape') and hasattr(dataobj, 'dtype'):
+            size = dataobj.dtype.itemsize
+            for n in dataobj.shape:
+                size *= n
+            return size
+    return sys.getsizeof(obj)
+
+
+class IntermediateCache(object):
+    """ In-memory store of the intermediate outputs handed between the python steps.
+
+    The object saved by the step is kept in memory under its output path and written to the disk on the
+    background threads, so the downstream step loads it from memory without reading and decompressing the file.
+    The objects loaded from the disk are also kept. The least recently used objects are evicted when the total
+    size exceeds the budget. With no budget, the objects are written and loaded directly.
+
+    Args:
+        budget:     memory to keep the objects, the size string with unit (e.g. '4G'), the number is regarded as GB
+        n_writers:  the number of background threads to write the objects
+
+    Notes:
+        The object must not be modified after it is saved, as it is shared with the background writer and
+        the downstream steps. The file is written with temporary name first and then renamed, so the partially
+        written file is never seen on the output path.
+        The cache lives in the memory of current process, so the function taking the cache is not sent to the
+        worker pool while the cache is on.
+    """
+    def __init__(self, budget=None, n_writers: int = 2):
+        self._budget = parse_size(budget) or 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._pending = dict()
+        self._executor = ThreadPoolExecutor(max_workers=n_writers) if self._budget else None
+
+    @property
+    def enabled(self):
+        return self._budget > 0
+
+    @property
+    def budget(self):
+        return self._budget
+
+    @property
+    def size(self):
+        """ the bytes of the objects in memory """
+        return self._size
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self._entries
+
+    def load(self, path: str, loader=None):
+        """ return the object of the path from memory, or load it from the disk
+        Args:
+            path:       path of the file
+            loader:     callable taking the path to load the object, nibabel.load if None
+        """
+        key = os.path.abspath(path)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        obj = (loader or _default_loader)(path)
+        self._store(key, obj)
+        return obj
+
+    def save(self, obj, path: str, writer=None):
+        """ keep the object in memory and write it to the path on the background
+        Args:
+            obj:        the object to save, e.g. nibabel image
+            path:       output path
+            writer:     callable taking the object and the path to write it, obj.to_filename if None
+        """
+        writer = writer or _default_writer
+        if not self.enabled:
+            writer(obj, path)
+            return
+        key = os.path.abspath(path)
+        with self._lock:
+            # registered before stored, so the object is not evicted until it is on the disk
+            future = self._executor.submit(self._write, writer, obj, key)
+            self._pending[key] = future
+        self._store(key, obj)
+        future.add_done_callback(lambda f: self._written(key, f))
+
+    def _written(self, key, future):
+        """ forget the finished write, the failed one is kept to be reported by flush """
+        if future.exception() is not None:
+            return
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+            self._shrink()
+
+    @staticmethod
+    def _write(writer, obj, path):
+        dirname, filename = os.path.split(path)
+        # the extension is kept, as the writer may choose the format from it
+        temp_path = os.path.join(dirname, f'.partial-{uuid.uuid4().hex[:8]}-{filename}')
+        try:
+            writer(obj, temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def flush(self):
+        """ wait until all background writes are finished
+        Returns:
+            {path: exception} of the failed writes
+        """
+        with self._lock:
+            pending = list(self._pending.items())
+            self._pending.clear()
+        errors = dict()
+        for path, future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                errors[path] = e
+        return errors
+
+    def _store(self, key, obj):
+        if not self.enabled:
+            return
+        size = _sizeof(obj)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if size > self._budget:
+                return
+            self._entries[key] = (obj, size)
+            self._size += size
+            self._shrink()
+
+    def _shrink(self):
+        """ evict the least recently used objects until the total size is under the budget """
+        for key in list(self._entries.keys()):
+            if self._size <= self._budget:
+                break
+            future = self._pending.get(key)
+            if future is not None and not future.done():
+                # not on the disk yet
+                continue
+            self._size -= self._entries.pop(key)[1]
+
+    def evict(self, path: str = None):
+        """ remove the object of the path from memory, all objects if None """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._size = 0
+            elif os.path.abspath(path) in self._entries:
+                self._size -= self._entries.pop(os.path.abspath(path))[1]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """ return the intermediate cache of the process, which is created from the config at the first call.
+    The cache without budget is returned if 'intermediate_cache' is off, which writes and loads directly.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            cfg = config['Preferences']
+            if cfg.getboolean('intermediate_cache', fallback=False):
+                _cache = IntermediateCache(budget=cfg.get('cache_budget', fallback='4G'),
+                                           n_writers=cfg.getint('cache_writers', fallback=2))
+            else:
+                _cache = IntermediateCache()
+    return _cache
@@ -0,0 +1,149 @@
+import os
+import sys
+import gzip
+import shutil
+import threading
+from collections import OrderedDict
+
+# the suffix of the file being compressed, which is skipped by the Bucket
+PARTIAL_SUFFIX = '.partial'
+
+
+def _lower_priority():
+    """ set the lowest priority to the calling thread, the priority is per thread only on linux """
+    if not sys.platform.startswith('linux') or not hasattr(threading, 'get_native_id'):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except OSError:
+        pass
+
+
+class DeferredCompressor(object):
+    """ Background stage to compress the uncompressed NIfTI files of the finished steps.
+
+    On the uncompressed working format, the steps write '.nii' so the intermediates are not compressed on every
+    write and decompressed on every read. Each finished step is queued with its folders, and its '.nii' files
+    are compressed into '.nii.gz' once the step and all steps taking it as input are finished. The files are
+    compressed one by one on single thread with the lowest priority.
+
+    Args:
+        is_waiting: callable taking the step code, True if the step is waiting or running
+        level:      gzip compression level
+
+    Notes:
+        The consumer must be added before it resolves its inputs. Each file is compressed into the partial file
+        without the lock, and replaced only if the step is still ready after it, so adding the consumer only
+        waits for the replacement. The partial file is discarded if the consumer is added while compressing,
+        and the rest of the files of the step are left uncompressed until the consumer is finished.
+    """
+    def __init__(self, is_waiting, level: int = 6):
+        self._is_waiting = is_waiting
+        self._level = level
+        self._consumers = dict()
+        self._queued = OrderedDict()
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._thread = None
+        self._compressed = 0
+
+    @property
+    def queued(self):
+        """ the step codes waiting to be compressed """
+        return list(self._queued.keys())
+
+    @property
+    def compressed(self):
+        """ the number of the files compressed """
+        return self._compressed
+
+    def add_consumer(self, step_code: str, consumer: str):
+        """ defer the compression of the step until the consumer is finished
+        Args:
+            step_code:  the step code of the input
+            consumer:   the step code taking the outputs of the step as input
+        """
+        with self._lock:
+            self._consumers.setdefault(step_code, set()).add(consumer)
+
+    def queue(self, step_code: str, paths: list):
+        """ queue the folders of the finished step, and check the steps queued before
+        Args:
+            step_code:  the step code of the finished step
+            paths:      the folders of the step to compress, e.g. the step folder and its temporary folder
+        """
+        with self._lock:
+            self._queued[step_code] = [path for path in paths if path is not None]
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._updated.notify_all()
+
+    def _is_ready(self, step_code):
+        return not any([self._is_waiting(code) for code in [step_code] + list(self._consumers.get(step_code, []))])
+
+    def _run(self):
+        _lower_priority()
+        while True:
+            with self._lock:
+                ready = [code for code in self._queued.keys() if self._is_ready(code)]
+                while not len(ready):
+                    # woken up when the other step is finished
+                    self._updated.wait()
+                    ready = [code for code in self._queued.keys() if self._is_ready(code)]
+                step_code = ready[0]
+                paths = self._queued.pop(step_code)
+            if not self._compress_step(step_code, paths):
+                with self._lock:
+                    # the consumer is added, so checked again when it is finished
+                    self._queued.setdefault(step_code, paths)
+
+    def _compress_step(self, step_code, paths):
+        """ compress the '.nii' files in the folders, False if it is stopped by the consumer added """
+        for path in paths:
+            for root, _, files in os.walk(path):
+                for f in sorted(files):
+                    if not f.endswith('.nii'):
+                        continue
+                    with self._lock:
+                        if not self._is_ready(step_code):
+                            return False
+                    target = os.path.join(root, f)
+                    partial = self._compress(target)
+                    if partial is None:
+                        continue
+                    with self._lock:
+                        if not self._is_ready(step_code):
+                            # the consumer is added while compressing, so it reads the uncompressed file
+                            self._discard(partial)
+                            return False
+                        self._replace(target, partial)
+        return True
+
+    def _compress(self, path):
+        """ compress the file into the partial file next to it, None if it is failed """
+        partial = f'{path}.gz{PARTIAL_SUFFIX}'
+        try:
+            with open(path, 'rb') as src, gzip.open(partial, 'wb', compresslevel=self._level) as dst:
+                shutil.copyfileobj(src, dst, 2 ** 20)
+            shutil.copystat(path, partial)
+        except OSError:
+            # removed or not readable, left as it is
+            self._discard(partial)
+            return None
+        return partial
+
+    def _replace(self, path, partial):
+        """ replace the uncompressed file with the compressed one """
+        try:
+            os.replace(partial, f'{path}.gz')
+            os.unlink(path)
+            self._compressed += 1
+        except OSError:
+            self._discard(partial)
+
+    @staticmethod
+    def _discard(partial):
+        if os.path.exists(partial):
+            os.unlink(partial)
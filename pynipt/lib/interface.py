@@ -1,7 +1,18 @@
 import time
+import shutil
+import warnings
+import hashlib
+import pandas as pd
+from collections import OrderedDict
+from statistics import median
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Optional, Union, Callable
 from .processor import Processor
-from paralexe import Manager, FuncManager, Scheduler
+from .scheduler import Manager, FuncManager, Scheduler, get_worker_pool
+from .batch import BatchWorker, BatchScheduler
+from .aio import AsyncWorker, AsyncScheduler
+from .workqueue import WorkQueue
+from .cache import get_cache
 from ..config import config
 from ..utils import *
 from ..errors import *
@@ -17,6 +28,7 @@ class InterfaceBase:
         # private
         self._path = None
         self._type = None
+        self._mode = None
         pass
 
     def _parse_info_from_processor(self, processor):
@@ -48,6 +60,22 @@ class InterfaceBase:
         self._daemons = dict()
         self._mngs = None
         self._errterm = None
+        self._resources = dict(mem=None, cpus=None)
+        self._failfast = dict()
+        self._fuse = False
+        self._threads_per_worker = None
+        self._affinity = None
+        self._speculative = False
+        self._skipped_outputs = []
+        self._plan = None
+        self._input_sizes = []
+        self._worker_estimates = None   # estimated seconds for each worker, None if no record
+        self._duration_record = None
+        self._duration_loaded = False
+        self._started = None
+        self._created_dirs = set()   # directories known to exist, to prevent the duplicated access
+        self._arg_table = OrderedDict()     # {label: [value for each worker]}
+        self._num_workers = 0
         self._refresh_rate = config['Preferences'].getfloat('daemon_refresh_rate')
         self._timeout = config['Preferences'].getint('timeout')
 
@@ -201,134 +229,36 @@ class InterfaceHandler(InterfaceBase):
                     self.logging('warn', exc_msg, method=method_name)
 
             if self._input_method == 0:
+                dset = self._query_dataset(input_path, mask, filter_dict)
+                keys = self._group_keys(dset)
                 if idx is None:
                     # point to point matching between input and output
-                    if self._bucket.params[0] is not None:
-                        if input_path in self._bucket.params[0].datatypes:
-                            dset = self._bucket(0, datatypes=input_path, **filter_dict)
-                        else:
-                            if mask is True:
-                                dset = self._bucket(3, datatypes=input_path, **filter_dict)
-                            else:
-                                dset = self._bucket(1, pipelines=self._label, steps=input_path, **filter_dict)
-                    elif self._bucket.params[0] is None:
-                        if mask is True:
-                            dset = self._bucket(3, datatypes=input_path, **filter_dict)
-                        else:
-                            dset = self._bucket(1, pipelines=self._label, steps=input_path, **filter_dict)
                     if len(dset) > 0:
                         if num_input_set == 0:
-                            if self._multi_session is True:
-                                self._input_ref = {i: (finfo.Subject, finfo.Session) for i, finfo in dset}
-                            else:
-                                self._input_ref = {i: (finfo.Subject, None) for i, finfo in dset}
-                        if relpath:
-                            self._input_set[label] = [os.path.relpath(finfo.Abspath) for i, finfo in dset]
-                        else:
-                            self._input_set[label] = [finfo.Abspath for i, finfo in dset]
+                            self._input_ref = dict(enumerate(self._parse_refs(dset, keys)))
+                        self._input_set[label] = self._parse_abspaths(dset, relpath)
                 else:
-                    self._input_set[label] = list()
                     if isinstance(idx, int):
-                        if input_path in self._bucket.params[0].datatypes:
-                            for sub in self._bucket.params[0].subjects:
-                                if self._multi_session:
-                                    for ses in self._bucket.params[0].sessions:
-                                        dset = self._bucket(0, datatypes=input_path,
-                                                            subjects=sub, sessions=ses,
-                                                            **filter_dict)
-                                        if len(dset) > 0:
-                                            self._input_ref[len(self._input_set[label])] = (
-                                                dset[idx].Subject, dset[idx].Session)
-                                            if relpath:
-                                                self._input_set[label].append(os.path.relpath(dset[idx].Abspath))
-                                            else:
-                                                self._input_set[label].append(dset[idx].Abspath)
-                                else:
-                                    dset = self._bucket(0, datatypes=input_path,
-                                                        subjects=sub, **filter_dict)
-                                    if len(dset) > 0:
-                                        self._input_ref[len(self._input_set[label])] = (
-                                            dset[idx].Subject, None)
-                                        if relpath:
-                                            self._input_set[label].append(os.path.relpath(dset[idx].Abspath))
-                                        else:
-                                            self._input_set[label].append(dset[idx].Abspath)
-                        else:
-                            if mask is True:
-                                for sub in self._bucket.params[3].subjects:
-                                    if self._multi_session:
-                                        for ses in self._bucket.params[3].sessions:
-                                            dset = self._bucket(3, datatypes=input_path,
-                                                                subjects=sub, sessions=ses,
-                                                                **filter_dict)
-                                            if len(dset) > 0:
-                                                self._input_ref[len(self._input_set[label])] = (
-                                                    dset[idx].Subject, dset[idx].Session)
-                                                if relpath:
-                                                    self._input_set[label].append(os.path.relpath(dset[idx].Abspath))
-                                                else:
-                                                    self._input_set[label].append(dset[idx].Abspath)
-                                    else:
-                                        dset = self._bucket(3, datatypes=input_path,
-                                                            subjects=sub, **filter_dict)
-                                        if len(dset) > 0:
-                                            self._input_ref[len(self._input_set[label])] = (
-                                                dset[idx].Subject, None)
-                                            if relpath:
-                                                self._input_set[label].append(os.path.relpath(dset[idx].Abspath))
-                                            else:
-                                                self._input_set[label].append(dset[idx].Abspath)
-                            else:
-                                for sub in self._bucket.params[1].subjects:
-                                    if self._multi_session:
-                                        for ses in self._bucket.params[1].sessions:
-                                            dset = self._bucket(1, pipelines=self._label,
-                                                                steps=input_path,
-                                                                subjects=sub, sessions=ses,
-                                                                **filter_dict)
-                                            if len(dset) > 0:
-                                                self._input_ref[len(self._input_set[label])] = (
-                                                    dset[idx].Subject, dset[idx].Session)
-                                                if relpath:
-                                                    self._input_set[label].append(os.path.relpath(dset[idx].Abspath))
-                                                else:
-                                                    self._input_set[label].append(dset[idx].Abspath)
-                                    else:
-                                        dset = self._bucket(1, pipelines=self._label,
-                                                            steps=input_path,
-                                                            subjects=sub,
-                                                            **filter_dict)
-                                        if len(dset) > 0:
-                                            self._input_ref[len(self._input_set[label])] = (
-                                                dset[idx].Subject, None)
-                                            if relpath:
-                                                self._input_set[label].append(os.path.relpath(dset[idx].Abspath))
-                                            else:
-                                                self._input_set[label].append(dset[idx].Abspath)
+                        # pick the indexed file for each subject (and session) at once
+                        picked = self._pick_by_group(dset, idx, keys)
+                        num_skipped = (dset.groupby(keys).ngroups if len(dset) else 0) - len(picked)
+                        if num_skipped > 0:
+                            self.logging('debug', '[{}]-{} group(s) do not have the file at idx={}, '
+                                                  'so skipped.'.format(self.step_code, num_skipped, idx),
+                                         method=method_name)
+                        self._input_ref.update(enumerate(self._parse_refs(picked, keys)))
+                        self._input_set[label] = self._parse_abspaths(picked, relpath)
                     else:
                         self.logging('warn', 'invalid index for input data',
                                      method=method_name)
 
             elif self._input_method == 1:
                 # peer to point
-                if input_path in self._bucket.params[0].datatypes:
-                    dset = self._bucket(0, datatypes=input_path, **filter_dict)
-                else:
-                    if mask is True:
-                        dset = self._bucket(3, datatypes=input_path, **filter_dict)
-                    else:
-                        dset = self._bucket(1, pipelines=self._label, steps=input_path,
-                                            **filter_dict)
+                dset = self._query_dataset(input_path, mask, filter_dict)
                 if num_input_set == 0:
                     self._input_ref = dict()
-                if self._multi_session:
-                    self._input_ref[label] = [(finfo.Subject, finfo.Session) for i, finfo in dset]
-                else:
-                    self._input_ref[label] = [(finfo.Subject, None) for i, finfo in dset]
-                if relpath:
-                    list_of_inputs = [os.path.relpath(finfo.Abspath) for i, finfo in dset]
-                else:
-                    list_of_inputs = [finfo.Abspath for i, finfo in dset]
+                self._input_ref[label] = self._parse_refs(dset, self._group_keys(dset))
+                list_of_inputs = self._parse_abspaths(dset, relpath)
                 spacer = ' '
                 if join_modifier is not None:
                     if isinstance(join_modifier, dict):
@@ -384,62 +314,26 @@ class InterfaceHandler(InterfaceBase):
                 exc_msg = 'static_input is only allowed only for group_method=False'
                 self.logging('warn', exc_msg, method=method_name)
             else:
-                self._input_set[label] = list()
-                for i, f_abspath in enumerate(self._input_set[self._main_input]):
-                    subj, sess = self._input_ref[i]
-                    if self._bucket.params[0] is not None:
-                        if input_path in self._bucket.params[0].datatypes:
-                            if sess is None:
-                                dset = self._bucket(0, datatypes=input_path,
-                                                    subjects=subj,
-                                                    **filter_dict)
-                            else:
-                                dset = self._bucket(0, datatypes=input_path,
-                                                    subjects=subj, sessions=sess,
-                                                    **filter_dict)
-                        else:
-                            if mask is True:
-                                if sess is None:
-                                    dset = self._bucket(3, datatypes=input_path,
-                                                        subjects=subj,
-                                                        **filter_dict)
-                                else:
-                                    dset = self._bucket(3, datatypes=input_path,
-                                                        subjects=subj, sessions=sess,
-                                                        **filter_dict)
-                            else:
-                                if sess is None:
-                                    dset = self._bucket(1, pipelines=self._label, steps=input_path,
-                                                        subjects=subj,
-                                                        **filter_dict)
-                                else:
-                                    dset = self._bucket(1, pipelines=self._label, steps=input_path,
-                                                        subjects=subj, sessions=sess,
-                                                        **filter_dict)
-                    else:
-                        if mask is True:
-                            if sess is None:
-                                dset = self._bucket(3, datatypes=input_path,
-                                                    subjects=subj,
-                                                    **filter_dict)
-                            else:
-                                dset = self._bucket(3, datatypes=input_path,
-                                                    subjects=subj, sessions=sess,
-                                                    **filter_dict)
-                        else:
-                            if sess is None:
-                                dset = self._bucket(1, pipelines=self._label, steps=input_path,
-                                                    subjects=subj,
-                                                    **filter_dict)
-                            else:
-                                dset = self._bucket(1, pipelines=self._label, steps=input_path,
-                                                    subjects=subj, sessions=sess,
-                                                    **filter_dict)
-                    # TODO: below code will pick the indexed file. it could be list of files in case of python?
-                    if relpath:
-                        self._input_set[label].append(os.path.relpath(dset[idx].Abspath))
-                    else:
-                        self._input_set[label].append(dset[idx].Abspath)
+                # join the indexed file of each subject (and session) to the main input at once
+                dset = self._query_dataset(input_path, mask, filter_dict)
+                refs = pd.DataFrame([self._input_ref[i] for i in range(len(self._input_set[self._main_input]))],
+                                    columns=['Subject', 'Session'])
+                keys = ['Subject']
+                if 'Session' in dset.columns and refs['Session'].notna().any():
+                    keys.append('Session')
+                if len(dset) > 0:
+                    picked = self._pick_by_group(dset, idx, keys)[keys + ['Abspath']]
+                else:
+                    picked = pd.DataFrame(columns=keys + ['Abspath'])
+                joined = refs.merge(picked, on=keys, how='left')
+                unmatched = joined['Abspath'].isna()
+                if unmatched.any():
+                    missing = joined[unmatched][keys].to_records(index=False).tolist()
+                    self.logging('debug', '[{}]-no static input found for {}, '
+                                          'so skipped.'.format(self.step_code, missing),
+                                 method=method_name)
+                    self._drop_workers([i for i, u in enumerate(unmatched) if u])
+                self._input_set[label] = self._parse_abspaths(joined[~unmatched], relpath)
             self._report_status(run_order)
 
     def set_errterm(self, error_term: str or list):
@@ -532,11 +426,11 @@ class InterfaceHandler(InterfaceBase):
                     else:
                         output_path = self.msi.path.join(self._path, subj, sess)
 
-                    filename = check_modifier(os.path.basename(f_abspath))
+                    filename = self._working_name(check_modifier(os.path.basename(f_abspath)))
                     self._output_set[label].append((output_path, filename))
 
             elif self._input_method == 1:
-                filename = check_modifier(modifier)
+                filename = self._working_name(check_modifier(modifier))
                 self._output_set[label].append((self._path, filename))
 
             else:
@@ -566,7 +460,7 @@ class InterfaceHandler(InterfaceBase):
                                 fn = '{}.{}'.format(fn_woext, ext)
                             else:
                                 fn = '{}.{}'.format(fn_woext, old_ext)
-                            self._output_filter.append((p, fn))
+                            self._output_filter.append((p, self._working_name(fn)))
                     elif self._input_method == 1:  # input_method=1 has only one master output
                         if isinstance(v[0], tuple) and len(v[0]) == 2:
                             p, fn = v[0]
@@ -579,7 +473,7 @@ class InterfaceHandler(InterfaceBase):
                                 fn = '{}.{}'.format(fn_woext, ext)
                             else:
                                 fn = '{}.{}'.format(fn_woext, old_ext)
-                            self._output_filter.append((p, fn))
+                            self._output_filter.append((p, self._working_name(fn)))
                         else:
                             exc_msg = '[{}]-unexpected error, ' \
                                       'this error can be caused by incorrect input_method.'.format(self.step_code)
@@ -630,7 +524,7 @@ class InterfaceHandler(InterfaceBase):
                         output_path = self.msi.path.join(temp_path, step_path, subj)
                     else:
                         output_path = self.msi.path.join(temp_path, step_path, subj, sess)
-                    filename = os.path.basename(f_abspath)
+                    filename = self._working_name(os.path.basename(f_abspath), temporary=True)
                     self._temporary_set[label].append((output_path, filename))
 
             self._report_status(run_order)
@@ -691,6 +585,57 @@ class InterfaceHandler(InterfaceBase):
             else:
                 raise InvalidApproach('Use set_cmd instead.')
 
+    def _query_dataset(self, input_path, mask, filter_dict):
+        """ return the DataFrame of dataset matched with input_path from Data, Mask or Processing dataclass """
+        if self._bucket.params[0] is not None and input_path in self._bucket.params[0].datatypes:
+            dset = self._bucket(0, datatypes=input_path, **filter_dict)
+        elif mask is True:
+            dset = self._bucket(3, datatypes=input_path, **filter_dict)
+        else:
+            dset = self._bucket(1, pipelines=self._label, steps=input_path, **filter_dict)
+        return dset.df
+
+    def _group_keys(self, dset):
+        """ the columns to identify the group of files which belong to the same worker """
+        if self._multi_session and 'Session' in dset.columns:
+            return ['Subject', 'Session']
+        return ['Subject']
+
+    @staticmethod
+    def _pick_by_group(dset, idx, keys):
+        """ pick idx-th file of each group, the groups are sorted by keys """
+        if len(dset) == 0:
+            return dset
+        picked = dset[dset.groupby(keys, sort=False).cumcount() == idx]
+        return picked.sort_values(by=keys, kind='mergesort')
+
+    @staticmethod
+    def _parse_refs(dset, keys):
+        """ return the list of (subject, session) of the dataset, session is None if not used """
+        if len(dset) == 0:
+            return []
+        sessions = dset['Session'] if 'Session' in keys else [None] * len(dset)
+        return list(zip(dset['Subject'], sessions))
+
+    @staticmethod
+    def _parse_abspaths(dset, relpath):
+        if len(dset) == 0:
+            return []
+        abspaths = list(dset['Abspath'])
+        if relpath:
+            return [os.path.relpath(p) for p in abspaths]
+        return abspaths
+
+    def _drop_workers(self, indices):
+        """ remove the workers at the indices from the input references and all per-worker arguments """
+        num_workers = len(self._input_set[self._main_input])
+        kept = [i for i in range(num_workers) if i not in set(indices)]
+        for arg_set in [self._input_set, self._output_set, self._var_set, self._temporary_set]:
+            for label, value in arg_set.items():
+                if isinstance(value, list) and len(value) == num_workers:
+                    arg_set[label] = [value[i] for i in kept]
+        self._input_ref = dict(enumerate([self._input_ref[i] for i in kept]))
+
     def _inspect_label(self, label, method_name=None):
 
         inspect_items = [self._input_set, self._output_set, self._var_set, self._temporary_set]
@@ -709,27 +654,62 @@ class InterfaceHandler(InterfaceBase):
         p = re.compile(r"{0}[^{0}{1}]+{1}".format(raw_prefix, raw_suffix))
         return set([obj[len(prefix):-len(suffix)] for obj in p.findall(command)])
 
+    def _working_name(self, filename, temporary=False):
+        """This hidden metrics returns the uncompressed filename of the NIfTI file written into Processing or Temp
+        on the uncompressed working format, otherwise the filename as it is.
+        """
+        if self._procobj.working_format == 'nii' and (temporary or self._mode == 'processing'):
+            if filename.endswith('.nii.gz'):
+                return nifti_counterpart(filename)
+        return filename
+
+    def _fuse_commands(self):
+        """This hidden metrics fuses all command templates into single shell script, so the commands for
+        each subject run in one shell without waiting for the other subjects.
+        The script stops at the first failed command, as the remaining sub-steps are not executed
+        when any worker failed.
+        """
+        commands = [cmd for _, cmd in sorted(self._cmd_set.items())]
+        return {0: '\n'.join(['set -e'] + commands)}
+
     @staticmethod
     def _parse_func_kwargs(func):
         n_args = func.__code__.co_argcount
-        return [kw for kw in func.__code__.co_varnames[:n_args] if kw not in ['stdout', 'stderr']]
+        return [kw for kw in func.__code__.co_varnames[:n_args] if kw not in ['stdout', 'stderr', 'cache']]
+
+    def _check_outputs(self):
+        """This hidden metrics returns the list of booleans whether each file in output filter exists.
+        Each output directory is listed only once, and the directories are listed in parallel.
+        The compressed and uncompressed NIfTI files are regarded as the same output.
+        """
+        msi = self.msi
+        targets = [msi.path.split(msi.path.join(path, fname)) for path, fname in self._output_filter]
+        dirs = sorted(set([path for path, _ in targets]))
+
+        def listdir(path):
+            try:
+                with msi.scandir(path) as entries:
+                    return path, set([entry.name for entry in entries])
+            except (FileNotFoundError, NotADirectoryError):
+                return path, set()
+
+        with ThreadPoolExecutor(max_workers=max(min(32, len(dirs)), 1)) as pool:
+            listed = dict(pool.map(listdir, dirs))
+        return [fname in listed[path] or nifti_counterpart(fname) in listed[path] for path, fname in targets]
 
     def _inspect_output(self):
         """This hidden metrics detects output files that created before
         """
-        msi = self.msi
         method = '_inspect_output'
-        index_for_filter = []
         if len(self._output_filter):
-            for i, (path, fname) in enumerate(self._output_filter):
-                abspath = msi.path.join(path, fname)
-                if msi.path.exists(abspath):
-                    self.logging('debug', 'File exists: [{}]'.format(fname),
-                                 method=f'{method}-[{self.step_code}]')
-                    index_for_filter.append(i)
-            if len(index_for_filter) > 0:
+            exists = self._check_outputs()
+            num_exists = sum(exists)
+            if num_exists > 0:
+                self._skipped_outputs = [fname for (_, fname), e in zip(self._output_filter, exists) if e]
+                self.logging('debug', 'File exists: [{}]'.format(', '.join(self._skipped_outputs)),
+                             method=f'{method}-[{self.step_code}]')
                 self.logging('debug',
-                             f'-Total of {len(index_for_filter)} file(s) are skipped from re-processing.'
+                             f'-Total of {num_exists} file(s) are skipped from re-processing.'
                              'Please remove the file(s) listed above if it needs to be re-processed.',
                              method=f'{method}-[{self.step_code}]')
                 # arg_sets = [self._input_set, self._output_set, self._var_set, self._temporary_set]
@@ -737,9 +717,15 @@ class InterfaceHandler(InterfaceBase):
                 for arg_set in arg_sets:
                     for label, value in arg_set.items():
                         if isinstance(value, list):
-                            arg_set[label] = [v for i, v in enumerate(value) if i not in index_for_filter]
-                        elif isinstance(value, str):
+                            if len(value) != len(exists):
+                                # filtered as before, the values beyond the outputs are dropped
+                                self.logging('debug', f'[{self.step_code}]-{len(value)} value(s) of "{label}" '
+                                                      f'do not match {len(exists)} output(s).',
+                                             method=f'{method}-[{self.step_code}]')
+                            arg_set[label] = [v for v, e in zip(value, exists) if not e]
+                        elif isinstance(value, str) and arg_set is not self._temporary_set:
                             # the group_input case, which has only one input
+                            # (the temporary path set with path_only=True is shared, so kept)
                             arg_set[label] = []
 
             else:
@@ -752,19 +738,16 @@ class InterfaceHandler(InterfaceBase):
     def _inspect_run(self):
         """This hidden metrics will check if the interface was run properly by checking output
         """
-        msi = self.msi
         method = '_inspect_run'
-        index_for_filter = []
         if len(self._output_filter):
-            for i, (path, fname) in enumerate(self._output_filter):
-                abspath = msi.path.join(path, fname)
-                if not msi.path.exists(abspath):
-                    self.logging('debug', 'File does not created: [{}]'.format(fname),
-                                 method=f'{method}-[{self.step_code}]')
-                    index_for_filter.append(i)
-            if len(index_for_filter) > 0:
+            exists = self._check_outputs()
+            num_missing = len(exists) - sum(exists)
+            if num_missing > 0:
+                self.logging('debug', 'File does not created: [{}]'.format(
+                    ', '.join([fname for (_, fname), e in zip(self._output_filter, exists) if not e])),
+                             method=f'{method}-[{self.step_code}]')
                 self.logging('debug',
-                             f'-Total of {len(index_for_filter)} workers are failed.',
+                             f'-Total of {num_missing} workers are failed.',
                              method=f'{method}-[{self.step_code}]')
                 return 1
             else:
@@ -776,6 +759,55 @@ class InterfaceHandler(InterfaceBase):
                          method=f'{method}-[{self.step_code}]')
             return 1
 
+    def _build_arg_table(self):
+        """This metrics builds the argument table of the step once, one column per label and one row per worker.
+        The path tuples are joined, and the values for the shell command are converted to string here,
+        so the managers for each command or function only take the columns for their placeholders.
+        """
+        columns = OrderedDict()
+        for arg_set in [self._input_set, self._output_set, self._var_set, self._temporary_set]:
+            for label, value in arg_set.items():
+                if isinstance(value, list):
+                    if len(value) and isinstance(value[0], tuple):
+                        value = [self.msi.path.join(*v) for v in value]
+                    elif self._type == 'cmd':
+                        value = [str(v) for v in value]
+                elif self._type == 'cmd':
+                    value = str(value)
+                columns[label] = value
+
+        lengths = set([len(v) for v in columns.values() if isinstance(v, list)])
+        if len(lengths) > 1:
+            self.logging('warn', '[{}]-the number of arguments are mismatched: {}'.format(self.step_code,
+                                                                                         sorted(lengths)),
+                         method='_build_arg_table')
+        self._num_workers = lengths.pop() if len(lengths) else 1
+        self._arg_table = OrderedDict()
+        for label, value in columns.items():
+            self._arg_table[label] = value if isinstance(value, list) else [value] * self._num_workers
+        self.logging('debug', '[{}]-argument table for {} worker(s) is built.'.format(self.step_code,
+                                                                                      self._num_workers),
+                     method='_build_arg_table')
+
+    def _make_dirs(self):
+        """This metrics creates all output and temporary directories of the step in one batched pass.
+        """
+        if self._dry_run:
+            return
+        paths = set()
+        for arg_set in [self._output_set, self._temporary_set]:
+            for value in arg_set.values():
+                if isinstance(value, list):
+                    paths.update([v[0] for v in value if isinstance(v, tuple)])
+        for value in self._temporary_set.values():
+            if isinstance(value, str):
+                # the case for the set_temporary has been initiated with path_only=True
+                paths.add(value)
+        new_paths = paths.difference(self._created_dirs)
+        intensive_mkdir(new_paths, interface=self.msi, created=self._created_dirs)
+        self.logging('debug', '[{}]-{} directories are prepared.'.format(self.step_code, len(new_paths)),
+                     method='_make_dirs')
+
     def _call_manager(self):
         """This metrics calls the Manager instance and set the command template with its arguments on it.
         """
@@ -783,36 +815,33 @@ class InterfaceHandler(InterfaceBase):
         if len(self._cmd_set.keys()) == 0:
             self.logging('warn', '[{}]-no command found'.format(self.step_code),
                          method='_call_manager')
-        for j, cmd in sorted(self._cmd_set.items()):
+        self._make_dirs()
+        cmd_set = self._cmd_set
+        if self._fuse and len(cmd_set) > 1:
+            cmd_set = self._fuse_commands()
+            self.logging('debug', '[{}]-{} commands are fused into single script.'.format(self.step_code,
+                                                                                         len(self._cmd_set)),
+                         method='_call_manager')
+        for j, cmd in sorted(cmd_set.items()):
             mng = Manager()
             placeholders = self._parse_placeholder(mng, cmd)
             self.logging('debug', '[{}]-placeholder in command template: [{}].'.format(self.step_code,
                                                                                        list(placeholders)),
                          method='_call_manager')
             mng.set_cmd(cmd)
-            arg_sets = [self._input_set, self._output_set, self._var_set, self._temporary_set]
-            for i, arg_set in enumerate(arg_sets):
-                for ph in placeholders:
-                    for label, value in arg_set.items():
-                        if isinstance(value, list):
-                            if len(value) == 0:
-                                pass
-                            else:
-                                if isinstance(value[0], tuple):
-                                    joined_values = []
-                                    for v in value:
-                                        intensive_mkdir(v[0], interface=self.msi)
-                                        joined_values.append(self.msi.path.join(*v))
-                                    value = joined_values
-                        elif isinstance(value, str):
-                            if i is 3:
-                                # the case for the set_temporary has been initiated with path_only=True
-                                intensive_mkdir(value, interface=self.msi)
-                        if ph in label:
-                            mng.set_arg(label=label, args=value)
-
+            if isinstance(self._schd, BatchScheduler):
+                mng.set_worker_class(BatchWorker)
+            elif isinstance(self._schd, AsyncScheduler):
+                mng.set_worker_class(AsyncWorker)
+            for ph in placeholders:
+                if ph in self._arg_table.keys():
+                    mng.set_arg(label=ph, args=self._arg_table[ph])
+                else:
+                    self.logging('debug', '[{}]-no argument for placeholder [{}].'.format(self.step_code, ph),
+                                 method='_call_manager')
             if self._errterm is not None:
                 mng.set_errterm(self._errterm)
+            mng.set_resources(**self._resources)
             managers.append(mng)
             self.logging('debug', '[{}]-managers instance receives all required information.'.format(self.step_code),
                          method='_call_manager')
@@ -823,6 +852,12 @@ class InterfaceHandler(InterfaceBase):
         if len(self._func_set.keys()) == 0:
             self.logging('warn', '[{}]-no python function found'.format(self.step_code),
                          method='_call_func_manager')
+        self._make_dirs()
+        pool = None
+        cfg = config['Preferences']
+        if cfg.getboolean('worker_pool', fallback=False):
+            preload = [m.strip() for m in cfg.get('preload_modules', fallback='').split(',') if len(m.strip())]
+            pool = get_worker_pool(preload=preload)
 
         for j, func in sorted(self._func_set.items()):
             mng = FuncManager()
@@ -831,29 +866,23 @@ class InterfaceHandler(InterfaceBase):
                                                                              list(func_kwargs)),
                          method='_call_func_manager')
             mng.set_func(func)
-            arg_sets = [self._input_set, self._output_set, self._var_set, self._temporary_set]
-
-            for i, arg_set in enumerate(arg_sets):
-                for kw in func_kwargs:
-                    for label, value in arg_set.items():
-                        # create folder
-                        if isinstance(value, list):
-                            if len(value) == 0:
-                                pass
-                            else:
-                                if isinstance(value[0], tuple):
-                                    joined_values = []
-                                    for v in value:
-                                        intensive_mkdir(v[0], interface=self.msi)
-                                        joined_values.append(self.msi.path.join(*v))
-                                    value = joined_values
-                        elif isinstance(value, str):
-                            if i is 3:
-                                # the case for the set_temporary has been initiated with path_only=True
-                                intensive_mkdir(value, interface=self.msi)
-                        #  arguments to manager
-                        if kw in label:
-                            mng.set_arg(label=label, args=value)
+            for kw in func_kwargs:
+                if kw in self._arg_table.keys():
+                    mng.set_arg(label=kw, args=self._arg_table[kw])
+            mng.set_resources(**self._resources)
+            takes_cache = 'cache' in func.__code__.co_varnames[:func.__code__.co_argcount]
+            if pool is not None and takes_cache and get_cache().enabled:
+                # the worker processes do not share the memory of this process, so the cache would be bypassed
+                warnings.warn(f'[{self.step_code}] {func.__name__} takes the intermediate cache, '
+                              'so it runs on this process instead of the worker pool.')
+                mng.set_pool(None)
+            else:
+                if pool is not None and not FuncManager.is_picklable(func):
+                    self.logging('debug', '[{}]-{} can not be sent to the worker pool, so it runs on the thread. '
+                                          'only the functions defined at the module level can use '
+                                          'the pool.'.format(self.step_code, func.__name__),
+                                 method='_call_func_manager')
+                mng.set_pool(pool)
             managers.append(mng)
             self.logging('debug',
                          '[{}]-func_managers instance receives all required information.'.format(self.step_code),
@@ -886,12 +915,26 @@ class InterfaceBuilder(InterfaceHandler):
         run:                metrics to schedule execution.
 
     """
-    def __init__(self, processor: Processor, n_threads: int = None, relpath: bool = False):
+    def __init__(self, processor: Processor, n_threads: int = None, relpath: bool = False,
+                 autotune: Optional[bool] = None, dry_run: Optional[bool] = None,
+                 backend: Optional[str] = None, work_queue: Optional[bool] = None):
         """
         Args:
             processor:      Processor instance
             n_threads:      number of threads
             relpath:        specify whether you are using relative path instead of absolute path on command
+            autotune:       adjust the number of threads adaptively for each step,
+                            the number of threads chosen is recorded and used for the next run of the step.
+            dry_run:        resolve the inputs, outputs and jobs of the step without creating any folder or
+                            executing the workers, the dry_run of processor is used if None.
+                            The result can be accessed via 'plan' property after run.
+            backend:        'local' to run the workers on the threads of this machine, 'async' to run the
+                            workers of the 'cmd' type step as coroutines on single event loop thread,
+                            'batch' to submit the workers of the 'cmd' type step to the batch scheduler,
+                            'backend' in config if None.
+            work_queue:     claim the workers on the work queue in the project folder, so the sessions running
+                            the same pipeline on the different nodes drain each step together,
+                            'work_queue' in config if None.
         Notes:
             relpath option added in response to the error related to the absolute path on AFNI's 3dttest++
         """
@@ -902,8 +945,22 @@ class InterfaceBuilder(InterfaceHandler):
             self._n_threads = processor.scheduler_param['n_threads']
         else:
             self._n_threads = n_threads
+        if autotune is None:
+            self._autotune = processor.scheduler_param['autotune']
+        else:
+            self._autotune = autotune
+        self._weight = processor.scheduler_param.get('weight', 1)
         self._relpath = relpath
-        self.logging('debug', f'n_threads={n_threads}, relpath={relpath}', method='__init__')
+        self._dry_run = processor.dry_run if dry_run is None else dry_run
+        if backend is None:
+            backend = config['Preferences'].get('backend', fallback='local')
+        if backend not in ['local', 'async', 'batch']:
+            raise InvalidMode(f'[{backend}] is not available backend.')
+        self._backend = backend
+        if work_queue is None:
+            work_queue = config['Preferences'].getboolean('work_queue', fallback=False)
+        self._work_queue = work_queue
+        self.logging('debug', f'n_threads={n_threads}, relpath={relpath}, autotune={autotune}', method='__init__')
         # Initiate scheduler
         self._schd = Scheduler(n_threads=self._n_threads)
 
@@ -931,7 +988,14 @@ class InterfaceBuilder(InterfaceHandler):
         """ return the scheduler object """
         return self._schd
 
+    def is_alive(self):
+        """ True if any daemon of current step is still running """
+        return any([thd.is_alive() for thd in self._daemons.values()])
+
     def _deep_clear(self):
+        if self._schd is not None:
+            # terminate the running commands before the daemons are killed
+            self._schd.cancel()
         if len(self._daemons):
             for i, thd in self._daemons.items():
                 kill_daemon(thd)
@@ -939,7 +1003,12 @@ class InterfaceBuilder(InterfaceHandler):
 
     def init_step(self, title: str, suffix: Optional[str] = None,
                   idx: Optional[int] = None, subcode: Optional[str] = None,
-                  mode='processing', type='cmd'):
+                  mode='processing', type='cmd',
+                  mem: Optional[Union[int, float, str]] = None, cpus: Optional[int] = None,
+                  max_failures: Optional[int] = None, max_failure_rate: Optional[float] = None,
+                  min_finished: Optional[int] = None, fuse: Optional[bool] = None,
+                  threads_per_worker: Optional[int] = None, affinity: Optional[bool] = None,
+                  speculative: Optional[bool] = None):
         """ initiate step directory with unique step code to prevent any conflict on folder naming.
         Notes:
             in case of using same title, please use suffix to distinguish with other, which useful when
@@ -954,11 +1023,46 @@ class InterfaceBuilder(InterfaceHandler):
                             'masking'   - create step directory in mask path
             type:           'cmd'       - use command for processing data
                             'python'    - use python function for processing data
+            mem:            memory required for each worker, number in GB or string with unit (e.g. '512M')
+            cpus:           number of cores required for each worker
+            max_failures:       abort the step when this number of workers failed
+            max_failure_rate:   abort the step when the ratio of failed workers exceeds this value (0 to 1)
+            min_finished:       the number of finished workers required to evaluate max_failure_rate
+            fuse:               fuse all commands of the step into single script for each subject,
+                                'fuse_commands' in config if None
+            threads_per_worker: number of threads exported to each worker (e.g. OMP_NUM_THREADS),
+                                the cores are split across the concurrent workers if None
+            affinity:           pin each worker of the 'cmd' type step to its own set of cores,
+                                'cpu_affinity' in config if None
+            speculative:        launch the duplicate of the straggler worker of the 'cmd' type step,
+                                'speculative' in config if None
+        Notes:
+            If mem or cpus is given, the worker is admitted to run only when the node has enough available
+            memory and idle cores, so the rest of workers wait on the queue. The worker exceeding the given mem
+            is killed by the memory watchdog and requeued with lower concurrency.
+            If the step is aborted by max_failures or max_failure_rate, the remaining workers are not launched
+            and the running commands are killed.
+            If fuse is True, the commands set by set_cmd run in one shell for each subject, instead of
+            being scheduled as separated sub-steps. Do not fuse the commands which need the outputs of
+            the other subjects from the previous command.
         """
         self.reset()
         if type not in ['cmd', 'python']:
             raise InvalidApproach('Invalid step type.')
         self._type = type
+        self._mode = mode
+        if self._backend == 'batch' and type == 'cmd':
+            self._schd = BatchScheduler(n_threads=self._n_threads)
+        elif self._backend == 'async' and type == 'cmd':
+            self._schd = AsyncScheduler(n_threads=self._n_threads)
+        self._resources = dict(mem=mem, cpus=cpus)
+        self._failfast = dict(max_failures=max_failures, max_failure_rate=max_failure_rate,
+                              min_finished=min_finished)
+        self._fuse = config['Preferences'].getboolean('fuse_commands', fallback=False) if fuse is None else fuse
+        self._threads_per_worker = threads_per_worker
+        self._affinity = affinity
+        self._speculative = config['Preferences'].getboolean('speculative', fallback=False) \
+            if speculative is None else speculative
         run_order = self._update_run_order()
         # add current step code to the step list
 
@@ -969,7 +1073,7 @@ class InterfaceBuilder(InterfaceHandler):
         if mode in mode_dict.keys():
             self._path = self._procobj.init_step(title=title, suffix=suffix,
                                                  idx=idx, subcode=subcode,
-                                                 mode=mode)
+                                                 mode=mode, dry_run=self._dry_run)
             if self._relpath:
                 self._path = os.path.relpath(self._path)
                 self.logging('debug', f'using relative path: {self._path}', method=f'init_step-[{self.step_code}]')
@@ -1049,6 +1153,8 @@ class InterfaceBuilder(InterfaceHandler):
         """
         run_order = self._update_run_order()
         # add current step code to the step list
+        if not mask:
+            self._procobj.add_consumer(input_path, self.step_code)
 
         method = 1 if group_input else 0   # convert to legacy parameter
         daemon = self.get_daemon(self._set_input, run_order, label, input_path,
@@ -1072,6 +1178,8 @@ class InterfaceBuilder(InterfaceHandler):
             mask:           True if input is mask file
         """
         run_order = self._update_run_order()
+        if not mask:
+            self._procobj.add_consumer(input_path, self.step_code)
         daemon = self.get_daemon(self._set_static_input, run_order, label, input_path,
                                  filter_dict=filter_dict, idx=idx, mask=mask, relpath=self._relpath)
         self._daemons[run_order] = daemon
@@ -1174,6 +1282,11 @@ class InterfaceBuilder(InterfaceHandler):
             if no input set prior to this metrics, Error will be raised.
         Args:
             func:           function template, the keyword argument on input
+        Notes:
+            If the function has 'cache' argument, the intermediate cache is given to load the inputs and
+            to save the outputs, e.g. 'img = cache.load(input)' and 'cache.save(img, output)'.
+            With 'intermediate_cache' in config, the outputs are kept in memory for the downstream steps
+            and written on the background, otherwise they are written and loaded directly.
         """
         run_order = self._update_run_order()
         # add current step code to the step list
@@ -1185,6 +1298,8 @@ class InterfaceBuilder(InterfaceHandler):
         """ schedule the execution
         Args:
             mode:           set 'python' if you use python function instead of shell command.
+        Notes:
+            On the dry-run, the jobs are resolved and recorded in 'plan' instead of being scheduled.
         """
         # submit job to scheduler
         run_order = self._update_run_order()
@@ -1203,13 +1318,23 @@ class InterfaceBuilder(InterfaceHandler):
             # wait until previous command is finished.
             self._wait_my_turn(run_order, 'running interface command..', method='run')
             # command process start from here
+            self._started = time.time()
             self._inspect_output()
+            self._build_arg_table()
+            self._input_sizes = self._get_input_sizes()
+            record = self._get_duration_record()
+            if record is not None and len(record['samples']):
+                self._worker_estimates = [estimate_duration(record['samples'], size) for size in self._input_sizes]
             if self._type == 'python':
                 self._mngs = self._call_func_manager()
             elif self._type == 'cmd':
                 self._mngs = self._call_manager()
             else:
                 raise InvalidApproach('Invalid step type.')
+            if self._dry_run:
+                self._plan_step()
+                self.clear()
+                return
             for mng in self._mngs:
                 try:
                     mng.schedule(self._schd, label=self.step_code)
@@ -1222,62 +1347,298 @@ class InterfaceBuilder(InterfaceHandler):
                     raise UnexpectedError
             self.logging('debug', 'processing scheduled.'.format(self.step_code),
                          method='run-[{}]'.format(self.step_code))
+            if self._autotune:
+                tuned = self._procobj.load_history('autotune')
+                self._schd.set_autotune(initial=tuned.get(self._history_key, 2))
+            self._schd.set_log_dir(self._worker_log_path)
+            self._schd.set_failfast(**self._failfast)
+            self._schd.set_weight(self._weight)
+            self._schd.set_threads_per_worker(self._threads_per_worker)
+            self._schd.set_costs(self._get_costs())
+            if self._affinity is not None:
+                self._schd.set_affinity(self._affinity)
+            if self._speculative and self._type == 'cmd' and not isinstance(self._schd, BatchScheduler):
+                self._schd.set_speculation(self._duplicate_worker, estimates=self._worker_estimates)
+            if self._work_queue:
+                self._set_workqueue()
             self._schd.submit(mode='background', use_label=True)
             self._schd.join()  # because foreground option cannot check the status
+            self._record_durations()
+            for sub_idx, workers in self._schd.queues.items():
+                for worker in workers.values():
+                    if worker.cores is not None:
+                        self.logging('debug', f'sub-step {sub_idx}, worker{worker.id} is pinned to cores '
+                                              f'{",".join(map(str, worker.cores))}.',
+                                     method='run-[{}]'.format(self.step_code))
+            for (sub_idx, worker_id), count in self._schd.requeued.items():
+                self.logging('debug', f'sub-step {sub_idx}, worker{worker_id} is requeued {count} time(s) '
+                                      f'for exceeding its declared memory.',
+                             method='run-[{}]'.format(self.step_code))
+            for (sub_idx, worker_id), winner in self._schd.speculated.items():
+                self.logging('debug', f'sub-step {sub_idx}, worker{worker_id} is speculated, '
+                                      f'the result of the {winner or "original"} is taken.',
+                             method='run-[{}]'.format(self.step_code))
+            for sub_idx, reason in self._schd.aborted.items():
+                self.logging('debug', f'sub-step {sub_idx} is aborted by fail-fast policy: {reason}.',
+                             method='run-[{}]'.format(self.step_code))
+            if self._type == 'python':
+                # the outputs written on the background must be on the disk before the inspection
+                for path, error in get_cache().flush().items():
+                    self.logging('debug', f'failed to write [{path}]: {error}',
+                                 method='run-[{}]'.format(self.step_code))
             # command process end here
+            if self._autotune and self._schd.tuner is not None:
+                self._procobj.update_history('autotune', **{self._history_key: self._schd.tuner.best})
+                self.logging('debug', f'n_threads={self._schd.tuner.best} is recorded by autotune.',
+                             method='run-[{}]'.format(self.step_code))
 
             inspect_result = self._inspect_run()
             # update dataset bucket
             self.logging('debug', 'updating dataset bucket.', method='run-[{}]'.format(self.step_code))
             self._bucket.update()
 
-            # _parse stdout and stderr
-            self.logging('debug', 'collect STDOUT from workers.', method='run-[{}]'.format(self.step_code))
-
-            for label, workers in self._schd.stdout.items():
-                for j in sorted(workers.keys()):
-                    if re.search('_', label):
-                        _, job_idx = label.split('_')
-                    else:
-                        job_idx = 0
-                    if self._type == 'python':
-                        mode_key = 'Func'
-                        mode_val = self._schd.queues[int(job_idx)][j].func
-                    else:
-                        mode_key = 'CMD'
-                        mode_val = self._schd.queues[int(job_idx)][j].cmd
-                    if workers[j] is None:
-                        self.logging('stdout', f'{mode_key}: {mode_val}\n   None\n')
-                    else:
-                        self.logging('stdout', '{0}: {1}\n  {2}'.format(mode_key, mode_val,
-                                                                        '\n  '.join(workers[j])))
-            self.logging('debug', 'collect STDERR from workers.', method='run-[{}]'.format(self.step_code))
-
-            for label, workers in self._schd.stderr.items():
-                for j in sorted(workers.keys()):
+            # _parse stdout and stderr, the full messages are in the log file of each worker
+            for stream, messages in [('stdout', self._schd.stdout), ('stderr', self._schd.stderr)]:
+                self.logging('debug', f'collect {stream.upper()} from workers.',
+                             method='run-[{}]'.format(self.step_code))
+                for label, workers in messages.items():
                     if re.search('_', label):
                         _, job_idx = label.split('_')
                     else:
                         job_idx = 0
-                    if self._type == 'python':
-                        mode_key = 'Func'
-                        mode_val = self._schd.queues[int(job_idx)][j].func
-                    else:
-                        mode_key = 'CMD'
-                        mode_val = self._schd.queues[int(job_idx)][j].cmd
-                    if workers[j] is None:
-                        self.logging('stderr', f'{mode_key}: {mode_val}\n   None\n')
-                    else:
-                        self.logging('stderr', '{0}: {1}\n  {2}'.format(mode_key, mode_val,
-                                                                        '\n  '.join(workers[j])))
+                    for j in sorted(workers.keys()):
+                        worker = self._schd.queues[int(job_idx)][j]
+                        if self._type == 'python':
+                            mode_key = 'Func'
+                            mode_val = worker.func
+                        else:
+                            mode_key = 'CMD'
+                            mode_val = worker.cmd
+                        log_path = worker.log_path(stream)
+                        if log_path is not None:
+                            mode_val = f'{mode_val}\n  [log: {log_path}]'
+                        if workers[j] is None:
+                            self.logging(stream, f'{mode_key}: {mode_val}\n   None\n')
+                        else:
+                            self.logging(stream, '{0}: {1}\n  {2}'.format(mode_key, mode_val,
+                                                                           '\n  '.join(workers[j])))
 
             if inspect_result:
                 self.logging('warn', 'missing output file(s).', method='run-[{}]'.format(self.step_code))
             # step code update
             self.clear()
+        self._compress_step()
         # update executed folder
         self._procobj.update()
 
+    @property
+    def plan(self):
+        """ the plan of the step resolved on the dry-run, None if the step is not planned """
+        return self._plan
+
+    def _duplicate_worker(self, step_idx, worker):
+        """ hidden metrics to deploy the duplicate of the straggler, which writes its outputs and temporary files
+        into the private location in the temporary folder
+        Returns:
+            the duplicate worker with the callbacks to commit and to discard its outputs,
+            None if the worker can not be duplicated
+        """
+        if self._relpath or step_idx >= len(self._mngs):
+            return None
+        mng = self._mngs[step_idx]
+        args = mng._get_args(worker.id)
+        root = os.path.join(self._procobj.temp_path, os.path.basename(self._path), '.speculative',
+                            f'{step_idx}-worker{worker.id}')
+        outputs = os.path.join(root, 'outputs')
+        overrides = dict()
+        for label, value in args.items():
+            if label in self._output_set.keys():
+                # the outputs outside of the step folder can not be committed
+                if not str(value).startswith(self._path + os.sep):
+                    return None
+                overrides[label] = os.path.join(outputs, os.path.relpath(value, self._path))
+                os.makedirs(os.path.dirname(overrides[label]), exist_ok=True)
+            elif label in self._temporary_set.keys():
+                overrides[label] = os.path.join(root, 'temporary', label, os.path.basename(str(value)))
+                if isinstance(self._temporary_set[label], str):
+                    os.makedirs(overrides[label], exist_ok=True)
+                else:
+                    os.makedirs(os.path.dirname(overrides[label]), exist_ok=True)
+        if not len([label for label in overrides.keys() if label in self._output_set.keys()]):
+            return None
+
+        def discard():
+            shutil.rmtree(root, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(root))
+            except OSError:
+                pass
+
+        def commit():
+            commit_tree(outputs, self._path)
+            discard()
+
+        self.logging('debug', f'sub-step {step_idx}, worker{worker.id} is straggling, the duplicate is launched.',
+                     method='run-[{}]'.format(self.step_code))
+        return mng.deploy_duplicate(worker.id, overrides), commit, discard
+
+    def _compress_step(self):
+        """ hidden metrics to compress the NIfTI outputs of current step on the background,
+        once the steps taking them as input are finished """
+        if self._procobj.compressor is None or self._path is None:
+            return
+        paths = [self.msi.path.join(self._procobj.temp_path, self.msi.path.basename(self._path))]
+        if self._mode == 'processing':
+            paths.insert(0, self._path)
+        self._procobj.compress_step(self.step_code, paths)
+
+    def _set_workqueue(self):
+        """ hidden metrics to share the workers of current step with the other sessions """
+        labels = [label for label in self._output_set.keys()
+                  if label in self._arg_table.keys() and isinstance(self._arg_table[label], list)]
+        if not len(labels):
+            self.logging('debug', 'work queue is not used as the step has no output to identify the workers.',
+                         method='run-[{}]'.format(self.step_code))
+            return
+        # the output paths identify the worker on any session, even if the inputs are listed differently
+        keys = []
+        for i in range(self._num_workers):
+            outputs = '|'.join([str(self._arg_table[label][i]) for label in labels])
+            keys.append(hashlib.sha1(outputs.encode('utf-8')).hexdigest()[:16])
+        queue = WorkQueue(self._queue_path)
+        self._schd.set_workqueue(queue, keys)
+        self.logging('debug', f'{len(keys)} worker(s) are shared on the work queue as [{queue.owner}].',
+                     method='run-[{}]'.format(self.step_code))
+
+    def _plan_step(self):
+        """ hidden metrics to record the jobs of the step without scheduling them """
+        jobs = []
+        for mng in self._mngs:
+            mng.deploy_jobs()
+            jobs.extend([mng._job_repr(worker) for worker in mng.workers.values()])
+        self._plan = dict(title=self.msi.path.basename(self._path)[4:],
+                          type=self._type,
+                          path=self._path,
+                          workers=self._num_workers,
+                          skipped=list(self._skipped_outputs),
+                          outputs={label: self._arg_table[label] for label in self._output_set.keys()
+                                   if label in self._arg_table.keys()},
+                          temporary={label: self._arg_table[label] for label in self._temporary_set.keys()
+                                     if label in self._arg_table.keys()},
+                          jobs=jobs,
+                          eta=self.eta)
+        self._procobj.record_plan(self.step_code, **self._plan)
+        # the following steps take the planned outputs as their inputs
+        planned = [path for values in list(self._plan['outputs'].values()) + list(self._plan['temporary'].values())
+                   if isinstance(values, list) for path in values]
+        self._procobj.bucket.add_planned(planned)
+        self.logging('debug', '{} worker(s) are planned.'.format(self._num_workers),
+                     method='run-[{}]'.format(self.step_code))
+
+    def _get_input_sizes(self):
+        """ hidden metrics to return the total size of the input files for each worker """
+        sizes = [0] * self._num_workers
+        for value in self._input_set.values():
+            if not isinstance(value, list):
+                continue
+            for i, v in enumerate(value[:self._num_workers]):
+                path = self.msi.path.join(*v) if isinstance(v, tuple) else v
+                try:
+                    sizes[i] += self.msi.path.getsize(path)
+                except (OSError, TypeError):
+                    pass
+        return sizes
+
+    def _get_costs(self):
+        """ hidden metrics to return the estimated cost of each worker to launch the larger ones first,
+        the estimated durations are used if available, otherwise the input sizes.
+        None if 'job_order' in config is not 'lpt' or the costs are unknown.
+        """
+        if config['Preferences'].get('job_order', fallback='lpt') != 'lpt':
+            return None
+        if self._worker_estimates is not None:
+            return list(self._worker_estimates)
+        if any([size > 0 for size in self._input_sizes]):
+            return list(self._input_sizes)
+        return None
+
+    def _get_duration_record(self):
+        """ hidden metrics to load the durations of the previous executions of current step,
+        the record is loaded once for each execution, as the progress bar polls the eta """
+        if not self._duration_loaded and self._path is not None:
+            self._duration_record = self._procobj.load_history('durations').get(self._history_key)
+            self._duration_loaded = True
+        return self._duration_record
+
+    def _record_durations(self):
+        """ hidden metrics to record the duration of each succeeded worker with the size of its inputs """
+        samples = []
+        for workers in self._schd.queues.values():
+            for i, worker in workers.items():
+                if worker.status == 'succeeded' and worker.duration is not None:
+                    size = self._input_sizes[i] if i < len(self._input_sizes) else 0
+                    samples.append([size, round(worker.duration, 3)])
+        if not len(samples):
+            return
+        # merged with the record on the file, which may be updated by the other steps or sessions
+        record = dict(samples=samples, elapsed=[round(time.time() - self._started, 3)])
+        updated = self._procobj.update_history('durations', merge=self._merge_durations,
+                                               **{self._history_key: record})
+        self._duration_record = updated[self._history_key]
+
+    @staticmethod
+    def _merge_durations(record, new):
+        record = record or dict(samples=[], elapsed=[])
+        return dict(samples=(record['samples'] + new['samples'])[-500:],
+                    elapsed=(record['elapsed'] + new['elapsed'])[-20:])
+
+    @property
+    def eta(self):
+        """ estimated remaining seconds to finish the step, None if there is no record of previous execution.
+        The workers are estimated from the durations of the previous workers with their input sizes,
+        and the elapsed time of the previous execution is used until the inputs are resolved.
+        """
+        if self.step_code is not None and self.step_code not in self._procobj.waiting_list:
+            return 0.0 if self.step_code in self._procobj.processed_list else None
+        if self._worker_estimates is None:
+            record = self._get_duration_record()
+            if record is None or not len(record['elapsed']):
+                return None
+            return median(record['elapsed'])
+        n_threads = max(min(self._schd.n_threads, self._num_workers), 1)
+        if not self._schd._num_steps:
+            num_substeps = max(len(self._cmd_set) if self._type == 'cmd' else len(self._func_set), 1)
+            if self._fuse:
+                num_substeps = 1
+            return sum(self._worker_estimates) * num_substeps / n_threads
+        remaining = 0
+        for workers in self._schd.queues.values():
+            for i, worker in workers.items():
+                if worker.status not in ['queued', 'running'] or i >= len(self._worker_estimates):
+                    continue
+                estimate = self._worker_estimates[i]
+                if worker.status == 'running' and worker.started is not None:
+                    estimate = max(estimate - (time.time() - worker.started), 0)
+                remaining += estimate
+        return remaining / n_threads
+
+    @property
+    def _worker_log_path(self):
+        """ the folder to stream the messages of the workers of current step """
+        return self.msi.path.join(self._procobj.history_path, 'Workers', self._label,
+                                  self.msi.path.basename(self._path))
+
+    @property
+    def _queue_path(self):
+        """ the folder to store the claims of the workers of current step """
+        return self.msi.path.join(self._procobj.history_path, 'Queue', self._label,
+                                  self.msi.path.basename(self._path))
+
+    @property
+    def _history_key(self):
+        """ the key to store the record of current step """
+        return '{}/{}'.format(self._label, self.msi.path.basename(self._path))
+
     @property
     def waiting_steps(self):
         """ return the step interface on waiting list for debugging """
@@ -1349,9 +1710,8 @@ class InterfaceBuilder(InterfaceHandler):
                 print('[{}]-arguments in given function: [{}].'.format(self.step_code, list(func_kwargs)))
                 mng.set_func(func)
                 for kw in func_kwargs:
-                    for label, value in args.items():
-                        if kw in label:
-                            mng.set_arg(label=label, args=value)
+                    if kw in args.keys():
+                        mng.set_arg(label=kw, args=args[kw])
                 managers.append(mng)
         else:
             while loop:
@@ -1371,9 +1731,8 @@ class InterfaceBuilder(InterfaceHandler):
                                                                            list(placeholders)))
                 mng.set_cmd(cmd)
                 for ph in placeholders:
-                    for label, value in args.items():
-                        if ph in label:
-                            mng.set_arg(label=label, args=value)
+                    if ph in args.keys():
+                        mng.set_arg(label=ph, args=args[ph])
                 managers.append(mng)
         for mng in managers:
             try:
@@ -65,7 +65,11 @@ class Pipeline(object):
         Notes:
             Available kwargs for this class are listed below. The default values are defined at configuration.
             logging (bool): Logging object initiated if the value is True
-            n_threads:
+            n_threads (int): number of threads for each step
+            autotune (bool): adjust the number of threads adaptively for each step
+            weight (float): weight to share the worker budget of the process with the other pipelines
+            working_format (str): 'nii' to write the NIfTI outputs of the steps uncompressed,
+                which are compressed on the background once no step needs them
 
         :param path:    dataset path
         :param logger:  generate log file (default=True)
@@ -80,6 +84,9 @@ class Pipeline(object):
         self._msi                   = self._bucket.msi      #
         self._interface_plugins     = None                  # place holder for interface plugin
         self._n_threads             = None                  # place holder to provide into Interface class
+        self._autotune              = None                  # place holder to provide into Interface class
+        self._weight                = None                  # place holder to provide into Interface class
+        self._working_format        = None                  # place holder to provide into Interface class
         self._pipeline_title        = None                  # place holder for the pipeline title
         self._step_titles           = dict()
         self._plugin                = PluginLoader()
@@ -91,6 +98,11 @@ class Pipeline(object):
         cfg = config['Preferences']
         self._logger    = kwargs['logging']     if 'logging'    in kwargs.keys() else cfg.getboolean('logging')
         self._n_threads = kwargs['n_threads']   if 'n_threads'  in kwargs.keys() else cfg.getint('number_of_threads')
+        self._autotune  = kwargs['autotune']    if 'autotune'   in kwargs.keys() else cfg.getboolean('autotune',
+                                                                                                       fallback=False)
+        self._weight    = kwargs['weight']      if 'weight'     in kwargs.keys() else 1
+        self._working_format = kwargs['working_format'] if 'working_format' in kwargs.keys() \
+            else cfg.get('working_format', fallback='nii.gz')
         self._verbose   = kwargs['verbose']     if 'verbose'    in kwargs.keys() else cfg.getboolean('verbose')
 
         if self._verbose:
@@ -145,7 +157,10 @@ class Pipeline(object):
         self._stored_id = False
         self._interface_plugins = self._plugin.get_interfaces()(self._bucket, title,
                                                                 logger=self._logger,
-                                                                n_threads=self._n_threads)
+                                                                n_threads=self._n_threads,
+                                                                autotune=self._autotune,
+                                                                weight=self._weight,
+                                                                working_format=self._working_format)
         self._pipeline_title = title
         if self._verbose is True:
             print(f'The scratch package [{title}] is initiated.')
@@ -194,7 +209,10 @@ class Pipeline(object):
         self._pipeline_title = self.installed_packages[pkg_id]
         self._interface_plugins = self._plugin.get_interfaces()(self._bucket, self._pipeline_title,
                                                                 logger=self._logger,
-                                                                n_threads=self._n_threads)
+                                                                n_threads=self._n_threads,
+                                                                autotune=self._autotune,
+                                                                weight=self._weight,
+                                                                working_format=self._working_format)
         self._pipeobj = self._plugin.get_pkgs(self._stored_id)
         if hasattr(self._pipeobj, self._pipeline_title):
             selected_pkg = getattr(self._pipeobj, self._pipeline_title)
@@ -255,6 +273,30 @@ class Pipeline(object):
                     return True
         return False
 
+    def eta(self, step_code: Optional[str] = None) -> Optional[float]:
+        """ Estimate the remaining time from the durations of the previous executions
+        Args:
+            step_code: step code, the sum of all queued steps if None
+        Returns:
+            remaining seconds, None if no step has the record of previous execution
+        """
+        if self._interface_plugins is None:
+            return None
+        if step_code is not None:
+            if step_code in self.builders.keys():
+                return self.builders[step_code].eta
+            return None
+        etas = [self.builders[s].eta for s in self.queued_steps if s in self.builders.keys()]
+        etas = [e for e in etas if e is not None]
+        return sum(etas) if len(etas) else None
+
+    @staticmethod
+    def _format_eta(seconds: Optional[float]) -> str:
+        if seconds is None:
+            return 'unknown'
+        from datetime import timedelta
+        return str(timedelta(seconds=int(seconds)))
+
     def check_progression(self, step_code: Union[str, None] = None):
         """Method that can realtime progression of pipeline execution."""
         if self._interface_plugins is not None:
@@ -284,6 +326,7 @@ class Pipeline(object):
                             n_queued -= delta
                             n_finished += delta
                             self._progressbar.update(delta)
+                        self._progressbar.set_postfix_str(f'ETA {self._format_eta(self.eta())}', refresh=False)
                         time.sleep(0.2)
                     self._progressbar.close()
 
@@ -316,11 +359,14 @@ class Pipeline(object):
                             sub_bar.sp(bar_style='danger')
                             break
                         while n_fin_workers < total_workers:
-                            cur_fin_workers = len(schd._succeeded_workers[step])
+                            # the workers run by the other sessions sharing the work queue
+                            cur_fin_workers = len(schd._succeeded_workers[step]) + \
+                                len(schd._skipped_workers.get(step, []))
                             delta = cur_fin_workers - n_fin_workers
                             if delta > 0:
                                 n_fin_workers += delta
                                 sub_bar.update(delta)
+                            sub_bar.set_postfix_str(f'ETA {self._format_eta(self.eta(step_code))}', refresh=False)
                             time.sleep(0.2)
                         if self.is_failed(step_code, idx=step):
                             # change bar color to red if any failed workers were found
@@ -335,13 +381,27 @@ class Pipeline(object):
                 thread.daemon = True
                 thread.start()
 
+    def stop(self, step_code: Optional[str] = None, grace_period: Optional[float] = None):
+        """ Cancel the running step, the queued workers are not launched and the running commands are
+        terminated with SIGTERM, followed by SIGKILL after the grace period.
+        Args:
+            step_code:      the step code to cancel, all running steps if None
+            grace_period:   seconds to wait before SIGKILL, 'cancel_grace_period' in config if None
+        """
+        if step_code is None:
+            step_codes = [s for s, schd in self.schedulers.items() if schd is not None and schd.is_alive()]
+        else:
+            step_codes = [step_code]
+        for s in step_codes:
+            schd = self.schedulers[s] if s in self.schedulers.keys() else None
+            if schd is not None:
+                schd.cancel(grace_period=grace_period)
+            self.interface.logging('debug', f'Step [{s}] is cancelled.')
+
     def _stop(self, step_code):
-        """ Stop thread for scheduler """
-        try:
-            self.interface.logging('debug', 'Pipeline is stopped.')
-            self.schedulers[step_code]._background_binder._tstate_lock.release()
-        except AttributeError:
-            self.interface.logging('debug', 'Pipeline is stopped.')
+        """ Report the failed step found by the progress bar or the summary, which only reads the status,
+        so the remaining workers of the step are left running. Use stop() to cancel the step. """
+        self.interface.logging('debug', f'Pipeline is stopped at the failed step [{step_code}].')
 
     def set_param(self, **kwargs):
         """Set parameters
@@ -375,17 +435,55 @@ class Pipeline(object):
         if pkg in self.installed_packages.values():
             print(getattr(self._pipeobj, pkg).__init__.__doc__)
 
-    def run(self, idx: int, **kwargs):
+    def run(self, idx: int, dry_run: bool = False, **kwargs):
         """ Execute selected pipeline
         Args:
             idx(int): index of available pipeline package
+            dry_run(bool): resolve the inputs, outputs and jobs of each step without creating any folder or
+                           executing the workers, and print out the plan
             **kwargs: key:value pairs of parameters for this pipeline
+        Returns:
+            the plan of the steps, {step_code: plan}, if dry_run is True
         """
         self.set_param(**kwargs)
         selected_pipeline = getattr(self.selected, f'pipe_{self.selected.installed_pipelines[idx]}')
         if self._verbose:
             print(selected_pipeline.__doc__)
-        selected_pipeline()
+        if not dry_run:
+            selected_pipeline()
+            return
+        self.interface.set_dry_run(True)
+        try:
+            selected_pipeline()
+            self._wait_for_plan()
+            print(self.interface.plan_summary())
+            plan = self.interface.plan
+        finally:
+            for step_code in self.interface.waiting_list:
+                # the steps waiting for the inputs produced by the planned steps
+                if step_code in self.builders.keys():
+                    self.builders[step_code]._deep_clear()
+            self.interface.set_dry_run(False)
+        return plan
+
+    def _wait_for_plan(self):
+        """ wait until all steps are planned, or the daemons of the step on turn are finished without planning
+        it, so the following steps are never planned. The timeout applies to the step without its builder. """
+        cfg = config['Preferences']
+        timeout = cfg.getint('timeout')
+        refresh_rate = cfg.getfloat('daemon_refresh_rate')
+        num_waiting = len(self.interface.waiting_list)
+        updated = time.time()
+        while len(self.interface.waiting_list):
+            step_code = self.interface.waiting_list[0]
+            if step_code in self.builders.keys() and not self.builders[step_code].is_alive():
+                break
+            if len(self.interface.waiting_list) != num_waiting:
+                num_waiting = len(self.interface.waiting_list)
+                updated = time.time()
+            elif time.time() - updated > timeout:
+                break
+            time.sleep(refresh_rate)
 
     @property
     def bucket(self):
@@ -423,6 +521,10 @@ class Pipeline(object):
         if schd.is_alive():
             status = 'Running'
             print(f'Status: {status}')
+        elif schd.cancelled:
+            status = 'Cancelled'
+            print(f'Status: {status}')
+            schd.summary()
         else:
             if self.is_failed(step_code):
                 status = 'Failed'
@@ -482,14 +584,11 @@ class Pipeline(object):
         steps = self.builders.keys()
         return {s: self.builders[s].mngs for s in steps}
 
-    def get_builder(self, n_threads=None):
+    def get_builder(self, n_threads=None, autotune=None, dry_run=None):
         """ get interface builder class that linked with current pipeline session """
         if self.interface is not None:
             from .interface import InterfaceBuilder
-            if n_threads is not None:
-                return InterfaceBuilder(self.interface, n_threads=n_threads)
-            else:
-                return InterfaceBuilder(self.interface)
+            return InterfaceBuilder(self.interface, n_threads=n_threads, autotune=autotune, dry_run=dry_run)
         else:
             return None
 
@@ -502,7 +601,8 @@ class Pipeline(object):
             from raw dataset folder
         Args:
             step_code:  if the input is datatype instead of step code, return rawdata bucket
-            ext:        file extension filter
+            ext:        file extension filter, 'nii' and 'nii.gz' match both the uncompressed
+                        and compressed NIfTI files
             regex:      regex pattern for filtering the dataset
         Returns:
             dataset:    pynipt.Bucket object that containing filtered data
@@ -592,20 +692,21 @@ class Pipeline(object):
                 running_step = self.queued_steps[0]
                 if self.schedulers[running_step].is_alive():
                     s.append("- Running:")
-                    s.append(f"\t{running_step}: {self._step_titles[running_step]}")
+                    s.append(f"\t{running_step}: {self._step_titles[running_step]} "
+                             f"(ETA {self._format_eta(self.eta(running_step))})")
                 else:
                     if self.is_failed(running_step):
-                        # if running step is failed, stop the running step and report the issue,
+                        # if running step is failed, report the issue, the summary does not cancel the step
                         s.append("- Issued:")
-                        # below stop command does not stop running thread immediately, need wait until the error
-                        # message shows up, or reset your notebook.
                         self._stop(running_step)
                     else:
                         s.append("- Pending:")
                     s.append(f"\t{running_step}: {self._step_titles[running_step]}")
                 if len(self.queued_steps) > 1:
                     s.append("- Queue:")
-                    s.append("\t{}".format(', '.join(self.queued_steps[1:])))
+                    s.append("\t{}".format(', '.join([f'{step} (ETA {self._format_eta(self.eta(step))})'
+                                                      for step in self.queued_steps[1:]])))
+                s.append(f"- Estimated remaining time: {self._format_eta(self.eta())}")
             output = '\n'.join(s)
             return output
         else:
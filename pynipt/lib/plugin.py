@@ -1,11 +1,39 @@
 import importlib
 import importlib.util as imp_util
 import re
+import sys
 from inspect import getsource
 from shleeh.utils import get_installed_pkg, user_warning
 from ..errors import *
 
 
+# the modules loaded from the plugin files, {module name: file path}
+_file_modules = dict()
+
+
+def load_module_from_file(name: str, file_path: str):
+    """ load the module from the file and register it in sys.modules, so the functions defined at its
+    module level can be pickled by reference, and loaded again on the worker processes from the file.
+    """
+    if name in sys.modules and _file_modules.get(name) == file_path:
+        return sys.modules[name]
+    spec = imp_util.spec_from_file_location(name, file_path)
+    module = imp_util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    _file_modules[name] = file_path
+    return module
+
+
+def get_file_modules():
+    """ return {module name: file path} of the modules loaded from the plugin files """
+    return dict(_file_modules)
+
+
 class PluginParser:
     """ plugin parser, the input must be single file module not whole pipeline package """
     def __init__(self, obj):
@@ -258,8 +286,8 @@ class PluginLoader:
         file_path = os.path.expanduser(file_path)
         if not os.path.isfile(file_path):
             raise FileNotFoundError
-        spec = imp_util.spec_from_file_location(name, file_path)
-        module = imp_util.module_from_spec(spec)
+        # the module name is prefixed not to shadow the installed modules
+        module = load_module_from_file(f'pynipt_plugin_{name}', os.path.abspath(file_path))
         plugin_obj = PluginParser(module)
 
         if plugin_obj.type == 'interface':
@@ -1,10 +1,19 @@
+import os
 import re
+import json
+import uuid
 import logging
 import shutil
+import threading
 from collections import OrderedDict
 from .bucket import BucketBase
+from .compress import DeferredCompressor
 from ..config import config
 from ..errors import *
+try:
+    import fcntl
+except ImportError:     # not available on windows
+    fcntl = None
 
 __dc__ = [config['Dataset structure'][c] for c in ['dataset_path', 'working_path', 'results_path',
                                                    'masking_path', 'temporary_path']]
@@ -61,6 +70,7 @@ class ProcessorBase(object):
         self.msi = bucket.msi
         if isinstance(bucket, BucketBase):
             self._bucket = bucket
+            self._log_path = self.msi.path.join(bucket.path, 'Logs')
             if logger is True:
                 self._init_logger()
                 self.logging('debug', 'The Processor instance is initiated.')
@@ -175,7 +185,6 @@ class ProcessorBase(object):
 
     def _init_logger(self):
         """metrics for initiating logger"""
-        self._log_path = self.msi.path.join(self.bucket.path, 'Logs')
         if not self.msi.path.exists(self._log_path):
             self.msi.mkdir(self._log_path)
 
@@ -371,6 +380,9 @@ class ProcessorBase(object):
         """return a directory name of working step path"""
         if step_code.upper() in self._existing_step_dir.keys():
             return f"{step_code}_{self._existing_step_dir[step_code]}"
+        elif step_code.upper() in self._planned_dirs.keys():
+            # the step planned on the dry-run
+            return f"{step_code}_{self._planned_dirs[step_code]}"
         else:
             exc_msg = 'given step code is not exist.'
             if verbose:
@@ -401,6 +413,9 @@ class ProcessorBase(object):
         """return directory name of marking step path"""
         if step_code.upper() in self._existing_mask_dir.keys():
             return "{}_{}".format(step_code, self._existing_mask_dir[step_code])
+        elif step_code.upper() in self._planned_dirs.keys():
+            # the mask planned on the dry-run
+            return "{}_{}".format(step_code, self._planned_dirs[step_code])
         else:
             exc_msg = 'given mask code is not exist.'
             if verbose:
@@ -436,6 +451,9 @@ class ProcessorHandler(ProcessorBase):
     """
 
     def __init__(self, *args, **kwargs):
+        # the step folders planned on the dry-run, which are not created on the file system
+        self._dry_run = False
+        self._planned_dirs = dict()
         super(ProcessorHandler, self).__init__(*args, **kwargs)
         # self.update()
 
@@ -530,7 +548,7 @@ class ProcessorHandler(ProcessorBase):
             pass
         return step_idx, substep_code
 
-    def init_step(self, title, mode='processing', suffix=None, idx=None, subcode=None):
+    def init_step(self, title, mode='processing', suffix=None, idx=None, subcode=None, dry_run=None):
         """create a new step directory on selected mode
 
         Args:
@@ -539,6 +557,7 @@ class ProcessorHandler(ProcessorBase):
             suffix (str): suffix need to be added to title.
             idx (int): index of the step
             subcode (int or str): the code with 0 or A-Z to indicate sub-step order.
+            dry_run (bool): only plan the step directory without creating it, use the dry_run of processor if None
 
         Returns:
             abspath (str): the absolute path of initiated step.
@@ -546,11 +565,13 @@ class ProcessorHandler(ProcessorBase):
         # prepare all available sub-step codes and executed steps information
         import string
         avail_codes = string.ascii_uppercase
+        dry_run = self._dry_run if dry_run is None else dry_run
 
         if mode in ['processing', 'reporting', 'masking']:
             existing_dir = dict(list(self._existing_step_dir.items())
                                 + list(self._existing_mask_dir.items())
-                                + list(self._existing_report_dir.items()))
+                                + list(self._existing_report_dir.items())
+                                + list(self._planned_dirs.items()))
         else:
             exc_msg = '[{}] is not available mode.'.format(mode)
             self.logging('warn', exc_msg)
@@ -671,12 +692,12 @@ class ProcessorHandler(ProcessorBase):
         if mode is 'processing':
             abspath = self.msi.path.join(self.path, new_step_dir)
         elif mode is 'reporting':
-            if not self.msi.path.exists(self.report_path):
+            if not dry_run and not self.msi.path.exists(self.report_path):
                 self.msi.mkdir(self.report_path)
                 self.logging('debug', f'Folder:[{self.label}] is created on [{__dc__[2]}] class')
             abspath = self.msi.path.join(self.report_path, new_step_dir)
         elif mode is 'masking':
-            if not self.msi.path.exists(self.mask_path):
+            if not dry_run and not self.msi.path.exists(self.mask_path):
                 self.msi.mkdir(self.mask_path)
                 self.logging('debug', f'Folder:[{self.label}] is created on [{__dc__[2]}] class')
             abspath = self.msi.path.join(self.mask_path, new_step_dir)
@@ -685,10 +706,16 @@ class ProcessorHandler(ProcessorBase):
             self.logging('warn', exc_msg)
             raise InvalidMode(exc_msg)
 
-        if not self.msi.path.exists(abspath):
+        if dry_run:
+            if not self.msi.path.exists(abspath):
+                self._planned_dirs[new_step_code] = title
+            self.logging('debug', f'[{new_step_dir}] folder is planned.')
+            return abspath
+        try:
             self.msi.mkdir(abspath)
             self.logging('debug', f'[{new_step_dir}] folder is created.')
-        else:
+        except FileExistsError:
+            # also the case the folder is made by the other session sharing the work queue
             self.logging('debug', f'[{new_step_dir}] folder is already exist.')
         self._parse_existing_subdir()
         return abspath
@@ -797,6 +824,9 @@ class Processor(ProcessorHandler):
         bucket (:obj:'Bucket'):     Bucket instance.
         label (str):                The name of Pipeline package that this class will create.
         logger (bool):              True for logging the whole processes.
+        working_format (str):       'nii' to write the NIfTI outputs uncompressed into Processing and Temp,
+                                    which are compressed on the background once no step needs them,
+                                    'nii.gz' to write them as given. 'working_format' in config if None.
 
 
     Methods:
@@ -811,6 +841,8 @@ class Processor(ProcessorHandler):
         summary:                    print out the summary of processor instance
 
     """
+    _history_lock = threading.Lock()
+
     def __init__(self, *args, **kwargs):
         cfg = config['Preferences']
         if 'n_threads' in kwargs.keys():
@@ -820,7 +852,21 @@ class Processor(ProcessorHandler):
                 self._n_threads = kwargs.pop('n_threads')
         else:
             self._n_threads = cfg.getint('number_of_threads')
+        autotune = kwargs.pop('autotune', None)
+        self._autotune = cfg.getboolean('autotune', fallback=False) if autotune is None else autotune
+        weight = kwargs.pop('weight', None)
+        self._weight = 1 if weight is None else weight
+        working_format = kwargs.pop('working_format', None)
+        if working_format is None:
+            working_format = cfg.get('working_format', fallback='nii.gz')
+        if working_format not in ['nii', 'nii.gz']:
+            raise InvalidMode(f'[{working_format}] is not available working format.')
+        self._working_format = working_format
+        self._compressor = DeferredCompressor(self._is_waiting) if working_format == 'nii' else None
+        dry_run = kwargs.pop('dry_run', False)
         super(Processor, self).__init__(*args, **kwargs)
+        self._dry_run = dry_run
+        self._plan = OrderedDict()
 
         # install default interface in plugin folder
         # to control scheduling issues,
@@ -860,7 +906,156 @@ class Processor(ProcessorHandler):
         """The parameters will be taken by Scheduler class. """
         return dict(queue=self._waiting_list,
                     done=self._processed_list,
-                    n_threads=self._n_threads)
+                    n_threads=self._n_threads,
+                    autotune=self._autotune,
+                    weight=self._weight)
+
+    @property
+    def dry_run(self):
+        return self._dry_run
+
+    @property
+    def working_format(self):
+        """'nii' if the NIfTI outputs are written uncompressed, otherwise 'nii.gz'"""
+        return self._working_format
+
+    @property
+    def compressor(self):
+        """The background stage to compress the finished steps, None if the working format is 'nii.gz'"""
+        return self._compressor
+
+    def _is_waiting(self, step_code):
+        return step_code in self._waiting_list
+
+    def add_consumer(self, input_path: str, step_code: str):
+        """defer the compression of the step given as input until the consumer step is finished.
+        Args:
+            input_path: input of the consumer, the step code or the step directory
+            step_code:  the step code of the consumer
+        """
+        if self._compressor is None:
+            return
+        step_dir = self.msi.path.basename(self.msi.path.normpath(input_path))
+        matched = re.match(r'^(\d{2}[0A-Z])(_|$)', step_dir.upper())
+        if matched is not None and matched.group(1) != step_code:
+            self._compressor.add_consumer(matched.group(1), step_code)
+
+    def compress_step(self, step_code: str, paths: list):
+        """queue the folders of the finished step to compress its NIfTI outputs on the background.
+        Args:
+            step_code:  the step code of the finished step
+            paths:      the folders of the step
+        """
+        if self._compressor is not None:
+            self._compressor.queue(step_code, paths)
+
+    def set_dry_run(self, dry_run: bool):
+        """switch the dry-run mode, the steps initiated on the dry-run are planned without creating
+        the folders or executing the workers. The planned steps are forgotten when the dry-run is switched off.
+        Args:
+            dry_run: True to start the dry-run
+        """
+        if dry_run:
+            self._plan = OrderedDict()
+        else:
+            for step_code in list(self._planned_dirs.keys()) + list(self._plan.keys()):
+                for step_list in [self._waiting_list, self._processed_list]:
+                    if step_code in step_list:
+                        step_list.remove(step_code)
+                if step_code in self._running_obj.keys():
+                    del self._running_obj[step_code]
+            self._planned_dirs = dict()
+            self.bucket.clear_planned()
+            self.bucket.update()
+        self._dry_run = dry_run
+
+    @property
+    def plan(self):
+        """The plan of the steps executed on the dry-run, {step_code: plan} """
+        return self._plan
+
+    def record_plan(self, step_code: str, **items):
+        """record the plan of the step resolved on the dry-run
+        Args:
+            step_code: step code
+            **items: key:value pairs of the plan
+        """
+        self._plan[step_code] = items
+
+    def plan_summary(self) -> str:
+        """The report of the plan, including the number of workers, the skipped outputs and the jobs."""
+        s = ['** Dry-run plan of [{}]:'.format(self.label)]
+        for step_code, plan in self._plan.items():
+            s.append('[{}] {}: {} worker(s), {} output(s) skipped'.format(step_code, plan['title'],
+                                                                       plan['workers'], len(plan['skipped'])))
+            for fname in plan['skipped']:
+                s.append(f'  - skipped: {fname}')
+            for job in plan['jobs']:
+                s.append(f'  {job}')
+        for step_code in self._waiting_list:
+            if step_code not in self._plan.keys():
+                s.append(f'[{step_code}] not planned, the inputs are not available before execution.')
+        return '\n'.join(s)
+
+    @property
+    def history_path(self):
+        """The folder to store the records of the previous execution, which is the folder of the log files. """
+        return self._log_path
+
+    def load_history(self, name: str) -> dict:
+        """load the record of the previous execution
+        Args:
+            name: name of the record
+        Returns:
+            record (dict): empty if no record is found
+        """
+        with self._history_lock:
+            return self._read_history(name)
+
+    def _read_history(self, name):
+        path = self.msi.path.join(self.history_path, f'{name}.json')
+        if not self.msi.path.exists(path):
+            return dict()
+        with open(path, 'r') as f:
+            try:
+                return json.load(f)
+            except ValueError:
+                self.logging('debug', f'The record [{name}] is corrupted, so it is ignored.')
+                return dict()
+
+    def update_history(self, name: str, merge=None, **items):
+        """update the record of the execution with given key:value pairs.
+        The record is locked from the read to the write, with the file lock for the other sessions sharing
+        the folder, and replaced at once, so the concurrent updates are not lost and the readers never see
+        the partially written record.
+
+        Args:
+            name: name of the record
+            merge: callable taking the value in the record (None if not exists) and the given value,
+                   and returning the value to store, the value is replaced if None
+            **items: key:value pairs to be updated
+        Returns:
+            record (dict): the updated record
+        """
+        path = self.msi.path.join(self.history_path, f'{name}.json')
+        with self._history_lock:
+            self.msi.makedirs(self.history_path, exist_ok=True)
+            with open(f'{path}.lock', 'a') as lock:
+                if fcntl is not None:
+                    # released when the file is closed
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                record = self._read_history(name)
+                for key, value in items.items():
+                    record[key] = value if merge is None else merge(record.get(key), value)
+                temp_path = f'{path}.{uuid.uuid4().hex[:8]}.partial'
+                try:
+                    with open(temp_path, 'w') as f:
+                        json.dump(record, f, indent=2)
+                    os.replace(temp_path, path)
+                finally:
+                    if self.msi.path.exists(temp_path):
+                        self.msi.unlink(temp_path)
+        return record
 
     @property
     def get_step_dir(self):
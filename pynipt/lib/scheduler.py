@@ -0,0 +1,1961 @@
+import os
+import re
+import sys
+import glob
+import signal
+import time
+import pickle
+import importlib
+import threading
+import traceback
+import subprocess as sp
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+from collections import OrderedDict, deque
+from statistics import median
+import psutil
+from ..config import config
+from ..errors import *
+from ..utils import parse_size
+from .cache import IntermediateCache, get_cache
+from .plugin import get_file_modules, load_module_from_file
+
+# the variables to limit the thread pools of the multithreaded tools and libraries (AFNI, ANTs, BLAS, ...)
+THREAD_ENV_VARS = ['OMP_NUM_THREADS',
+                   'ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS',
+                   'OPENBLAS_NUM_THREADS',
+                   'MKL_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS',
+                   'BLIS_NUM_THREADS']
+
+
+class Spool(object):
+    """ File-like object to stream the messages into the log file while the job is running.
+    Only the last lines are kept in memory, so the memory does not grow with the verbosity of the job.
+
+    Args:
+        path:       path of the log file, the messages are kept only in memory if None
+        maxlen:     the number of the last lines to keep in memory
+    """
+    def __init__(self, path: str = None, maxlen: int = 100):
+        self._path = path
+        self._tail = deque(maxlen=maxlen)
+        self._buffer = ''
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', buffering=1) if path is not None else None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def lines(self):
+        """ the last lines, None if nothing """
+        return list(self._tail) if len(self._tail) else None
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', errors='replace')
+        with self._lock:
+            if self._file is not None:
+                self._file.write(text)
+            lines = (self._buffer + text).split('\n')
+            self._buffer = lines.pop()
+            self._tail.extend([line for line in lines if len(line)])
+        return len(text)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if len(self._buffer):
+                self._tail.append(self._buffer)
+                self._buffer = ''
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class WorkerBase(object):
+    """ Base class of the Worker, the container of single job and its execution result.
+
+    The messages of the job are streamed into the log files while it is running if the log prefix is given,
+    and only the last lines are kept in memory.
+
+    Attributes:
+        id:             worker id (the order in the queue)
+        output:         list of the last lines printed on stdout, None if nothing
+        error:          list of the last lines printed on stderr, None if nothing
+        returncode:     exit status of the job, None if the job is not executed yet
+        duration:       seconds taken to execute the job, None if the job is not finished
+        resources:      memory (bytes) and cpus the worker declared to use
+        status:         'queued', 'running', 'succeeded', 'failed', 'cancelled' or 'skipped'
+        rss:            the memory of the job at the last sample of the scheduler
+        peak_rss:       the largest memory of the job sampled by the scheduler
+    """
+    def __init__(self, id=None, mem=None, cpus=None):
+        self._id = id
+        self._returncode = None
+        self._pid = None
+        self._status = 'queued'
+        self._resources = dict(mem=parse_size(mem), cpus=cpus)
+        self._log_prefix = None
+        self._tail = 100
+        self._cancelled = False
+        self._started = None
+        self._finished = None
+        self._stdout = Spool()
+        self._stderr = Spool()
+        self._env = dict()
+        self._cores = None
+        self._rss = 0
+        self._peak_rss = 0
+        self._oom_killed = False
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def output(self):
+        return self._stdout.lines
+
+    @property
+    def error(self):
+        return self._stderr.lines
+
+    @property
+    def returncode(self):
+        return self._returncode
+
+    @property
+    def pid(self):
+        return self._pid
+
+    @property
+    def started(self):
+        return self._started
+
+    @property
+    def duration(self):
+        if self._started is None or self._finished is None:
+            return None
+        return self._finished - self._started
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def resources(self):
+        return self._resources
+
+    @property
+    def env(self):
+        return self._env
+
+    @property
+    def cores(self):
+        """ the cores the worker is pinned to, None if not pinned """
+        return self._cores
+
+    @property
+    def rss(self):
+        return self._rss
+
+    @property
+    def peak_rss(self):
+        return self._peak_rss
+
+    @property
+    def oom_killed(self):
+        """ True if the job was killed for exceeding its declared memory """
+        return self._oom_killed
+
+    def sample_rss(self, rss: int = None):
+        """ return the resident memory of the process tree of the job, and keep the peak
+        Args:
+            rss:    the memory sampled together with the other workers, sampled here if None
+        """
+        if rss is None:
+            rss = get_tree_rss(self._pid)
+        self._rss = rss
+        self._peak_rss = max(self._peak_rss, rss)
+        return rss
+
+    def kill_for_memory(self, rss):
+        """ kill the job exceeding its declared memory """
+        if self._status != 'running':
+            return
+        self._oom_killed = True
+        self._stderr.write(f'\nKilled by the memory watchdog: {rss / 1024 ** 2:.0f}MB exceeded the declared '
+                           f'{self._resources["mem"] / 1024 ** 2:.0f}MB.\n')
+        self._kill()
+
+    def adopt(self, other):
+        """ take the result of the other worker which executed the same job """
+        self._status = other.status
+        self._returncode = other.returncode
+        self._finished = other._finished
+        self._stdout = other._stdout
+        self._stderr = other._stderr
+        self._log_prefix = other._log_prefix
+
+    def reset(self):
+        """ reset the finished worker to be executed again """
+        self._returncode = None
+        self._pid = None
+        self._status = 'queued'
+        self._started = None
+        self._finished = None
+        self._stdout = Spool()
+        self._stderr = Spool()
+        self._cores = None
+        self._rss = 0
+        self._peak_rss = 0
+        self._oom_killed = False
+
+    def set_cores(self, cores: list = None):
+        """ pin the job to the given cores, the job is not pinned if None """
+        self._cores = None if cores is None else list(cores)
+
+    def _preexec(self):
+        """ return the function to pin the child process to the cores before the command, None if not pinned.
+        It runs in the child forked from the threaded parent, so it only makes the system call without
+        taking any lock, and the set of cores is prepared before the fork. """
+        if self._cores is None or not hasattr(os, 'sched_setaffinity'):
+            return None
+        cores = frozenset(self._cores)
+        return lambda: os.sched_setaffinity(0, cores)
+
+    def set_env(self, env: dict = None):
+        """ set the environment variables to add for the job, replacing the ones set before """
+        self._env = dict() if env is None else dict(env)
+
+    def _environ(self):
+        """ the environment of the subprocess, None to inherit the current one """
+        if not len(self._env):
+            return None
+        environ = dict(os.environ)
+        environ.update(self._env)
+        return environ
+
+    def set_log(self, prefix: str = None, tail: int = 100):
+        """ set the log files to stream the messages
+        Args:
+            prefix:     path prefix of the log files, '.stdout' and '.stderr' will be added
+            tail:       the number of the last lines to keep in memory
+        """
+        self._log_prefix = prefix
+        self._tail = tail
+
+    def log_path(self, stream: str = 'stdout'):
+        """ return the path of the log file for 'stdout' or 'stderr', None if the log is not spooled """
+        if self._log_prefix is None:
+            return None
+        return f'{self._log_prefix}.{stream}'
+
+    def _open_spools(self):
+        self._stdout = Spool(self.log_path('stdout'), maxlen=self._tail)
+        self._stderr = Spool(self.log_path('stderr'), maxlen=self._tail)
+
+    def _inspect(self):
+        """ return True if the job is failed """
+        return self._returncode != 0
+
+    def cancel(self):
+        """ cancel the worker, the queued worker will not be launched,
+        and the running job is requested to terminate """
+        self._cancelled = True
+        if self._status == 'queued':
+            self._status = 'cancelled'
+        elif self._status == 'running':
+            self._terminate()
+
+    def skip(self):
+        """ mark the queued worker as skipped, as the job is taken by the other session """
+        if self._status == 'queued':
+            self._status = 'skipped'
+
+    def _terminate(self):
+        """ request the running job to terminate, the job running on the thread can not be stopped """
+        pass
+
+    def _kill(self):
+        """ stop the running job, the job running on the thread can not be stopped """
+        pass
+
+    def _execute(self):
+        pass
+
+    def run(self):
+        if self._cancelled:
+            return self._status
+        self._status = 'running'
+        self._started = time.time()
+        self._open_spools()
+        try:
+            self._execute()
+        finally:
+            self._finished = time.time()
+            self._stdout.close()
+            self._stderr.close()
+        if self._cancelled:
+            self._status = 'cancelled'
+        else:
+            self._status = 'failed' if self._inspect() else 'succeeded'
+        return self._status
+
+
+class Worker(WorkerBase):
+    """ Worker to execute single shell command on the subprocess.
+
+    The pipes are read line by line on the threads, and each line is scanned for the error terms as it is
+    streamed. The process group of the command is killed as soon as any error term is found,
+    and the worker is marked as failed without waiting for the command to finish.
+    """
+    def __init__(self, id=None, cmd=None, errterm=None, **kwargs):
+        super(Worker, self).__init__(id=id, **kwargs)
+        self._cmd = cmd
+        self._errterm = compile_errterm(errterm)
+        self._errterm_found = None
+
+    @property
+    def cmd(self):
+        return self._cmd
+
+    @property
+    def errterm_found(self):
+        """ the error term found on the output, None if not found """
+        return self._errterm_found
+
+    def reset(self):
+        super(Worker, self).reset()
+        self._errterm_found = None
+
+    def _inspect(self):
+        return self._returncode != 0 or self._errterm_found is not None
+
+    def _feed(self, line, spool):
+        """ write the line to the spool, and kill the job if any error term is found on the line """
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        spool.write(line)
+        if self._errterm is not None and self._errterm_found is None:
+            matched = self._errterm.search(line)
+            if matched is not None:
+                self._errterm_found = matched.group(0)
+                self._kill()
+
+    def _stream(self, pipe, spool):
+        for line in iter(pipe.readline, b''):
+            self._feed(line, spool)
+        pipe.close()
+
+    def _signal(self, signum):
+        """ send the signal to the process group of the command, so the child processes of the shell get it too """
+        if self._pid is None:
+            return
+        try:
+            os.killpg(self._pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def _kill(self):
+        self._signal(signal.SIGKILL)
+
+    def _execute(self):
+        # new session makes the command the leader of its own process group
+        proc = sp.Popen(self._cmd, shell=True, stdout=sp.PIPE, stderr=sp.PIPE, start_new_session=True,
+                        env=self._environ(), preexec_fn=self._preexec())
+        self._pid = proc.pid
+        if self._cancelled:
+            # cancelled while launching
+            self._terminate()
+        readers = [threading.Thread(target=self._stream, args=(proc.stdout, self._stdout)),
+                   threading.Thread(target=self._stream, args=(proc.stderr, self._stderr))]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+        for reader in readers:
+            reader.join()
+        self._returncode = proc.wait()
+
+
+class FuncWorker(WorkerBase):
+    """ Worker to execute single python function on the thread, or on the persistent worker process
+    if the process pool is given.
+
+    Notes:
+        if the function has 'stdout' and 'stderr' arguments, the file-like objects will be given to stream
+        the messages. The function is regarded as failed if it raises exception or returns non-zero value.
+        On the process pool, the messages are collected in the worker process and written to the log
+        when the function returns. The function is sent to the worker process by reference, so only the
+        functions defined at the module level of the importable module or the plugin file can be given
+        with the process pool. The environment variables of the worker are applied only on the process
+        pool, as the function on the thread shares the environment of current process.
+    """
+    def __init__(self, id=None, func=None, kwargs=None, pool=None, **resources):
+        super(FuncWorker, self).__init__(id=id, **resources)
+        self._func = func
+        self._kwargs = dict() if kwargs is None else kwargs
+        self._pool = pool
+        self._future = None
+
+    def reset(self):
+        super(FuncWorker, self).reset()
+        self._future = None
+
+    @property
+    def func(self):
+        return self._func
+
+    @property
+    def kwargs(self):
+        return self._kwargs
+
+    def _terminate(self):
+        """ the function not started on the process pool can be cancelled """
+        if self._future is not None:
+            self._future.cancel()
+
+    def _execute(self):
+        if self._pool is None:
+            self._returncode = call_func(self._func, self._kwargs, self._stdout, self._stderr)
+            return
+        try:
+            # the function is unpickled after the plugin modules are loaded on the worker process
+            self._future = self._pool.submit(_call_func_on_process, pickle.dumps(self._func), self._kwargs,
+                                             self._env, list(_worker_pool['preload'] or []), get_file_modules())
+            self._returncode, stdout, stderr = self._future.result()
+        except CancelledError:
+            self._returncode = 1
+            return
+        except BrokenProcessPool:
+            # the worker process died, the pool will be created again for the next worker
+            shutdown_worker_pool(wait=False)
+            traceback.print_exception(*sys.exc_info(), file=self._stderr)
+            self._returncode = 1
+            return
+        except Exception:
+            traceback.print_exception(*sys.exc_info(), file=self._stderr)
+            self._returncode = 1
+            return
+        self._stdout.write(stdout)
+        self._stderr.write(stderr)
+
+
+def call_func(func, kwargs, stdout, stderr, cache=None):
+    """ execute the function with the file-like objects for the messages, and return the exit status.
+    The intermediate cache is given if the function has 'cache' argument, see IntermediateCache.
+    """
+    n_args = func.__code__.co_argcount
+    keywords = func.__code__.co_varnames[:n_args]
+    kwargs = dict(kwargs)
+    if 'stdout' in keywords:
+        kwargs['stdout'] = stdout
+    if 'stderr' in keywords:
+        kwargs['stderr'] = stderr
+    if 'cache' in keywords:
+        kwargs['cache'] = get_cache() if cache is None else cache
+    try:
+        returned = func(**kwargs)
+        return int(returned) if isinstance(returned, (bool, int)) else 0
+    except Exception:
+        traceback.print_exception(*sys.exc_info(), file=stderr)
+        return 1
+
+
+def _call_func_on_process(func, kwargs, env=None, preload=None, modules=None):
+    # the modules requested after the pool is created, imported only once for each worker process
+    _preload_modules(preload or [])
+    # the plugin modules are not importable by name, so loaded from their files before the function
+    for name, file_path in (modules or dict()).items():
+        load_module_from_file(name, file_path)
+    if isinstance(func, bytes):
+        func = pickle.loads(func)
+    # the worker process is reused by the next task, so its environment is restored after the function
+    environ = os.environ.copy()
+    if env:
+        # the subprocesses called by the function inherit it
+        os.environ.update(env)
+    stdout, stderr = StringIO(), StringIO()
+    try:
+        # the memory of the worker process is not shared, so the outputs are written before it returns.
+        # the functions taking the cache run on the main process while the cache is on
+        returncode = call_func(func, kwargs, stdout, stderr, cache=IntermediateCache())
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    return returncode, stdout.getvalue(), stderr.getvalue()
+
+
+def _preload_modules(modules):
+    for name in modules:
+        if name in sys.modules:
+            continue
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+_worker_pool = dict(executor=None, preload=None)
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool(preload: list = None, max_workers: int = None):
+    """ return the process pool shared in current session, the pool is created at the first call.
+    The worker processes are kept alive across the steps, so the modules are imported only once for each
+    worker process. The forkserver is used if available, so the preloaded modules are imported once in
+    the server and inherited by the forked workers. The modules requested after the pool is created are added
+    to the preload of the pool, and imported by each worker process at its next task.
+    Only the functions defined at the module level of the importable modules or the plugin files can be
+    executed on the pool, the others (e.g. the closures) are executed on the threads.
+
+    Args:
+        preload:        list of module names to import in advance
+        max_workers:    the number of worker processes, the number of logical cores if None
+    Returns:
+        ProcessPoolExecutor
+    """
+    preload = [] if preload is None else list(preload)
+    with _worker_pool_lock:
+        if _worker_pool['executor'] is None:
+            if 'forkserver' in mp.get_all_start_methods():
+                context = mp.get_context('forkserver')
+                context.set_forkserver_preload(preload)
+            else:
+                context = mp.get_context('spawn')
+            max_workers = psutil.cpu_count() if max_workers is None else max_workers
+            _worker_pool['executor'] = ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                                           initializer=_preload_modules, initargs=(preload,))
+            _worker_pool['preload'] = preload
+        else:
+            _worker_pool['preload'] += [m for m in preload if m not in _worker_pool['preload']]
+        return _worker_pool['executor']
+
+
+def shutdown_worker_pool(wait: bool = True):
+    """ terminate the worker processes of the shared process pool """
+    with _worker_pool_lock:
+        executor = _worker_pool['executor']
+        _worker_pool['executor'] = None
+        _worker_pool['preload'] = None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+class ManagerBase(object):
+    """ Base class of the Manager, which deploys the workers from a template and its arguments.
+
+    Notes:
+        The list-type argument is distributed to the workers in order, so all list-type arguments must have
+        same length. The other type of argument is shared by all workers.
+    """
+    def __init__(self):
+        self._args = OrderedDict()
+        self._errterm = None
+        self._resources = dict(mem=None, cpus=None)
+        self._workers = OrderedDict()
+        self._schd = None
+        self._step_idx = None
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def args(self):
+        return self._args
+
+    def set_arg(self, label: str, args):
+        self._args[label] = args
+
+    def set_errterm(self, errterm):
+        self._errterm = errterm
+
+    def set_resources(self, mem=None, cpus=None):
+        """ declare the memory and the number of cores each worker requires.
+        Args:
+            mem:        memory as the size string with unit (e.g. '512M', '12G'), the number without unit
+                        is regarded as GB (e.g. 0.5 for 512M), see parse_size
+            cpus:       number of cores
+        """
+        self._resources = dict(mem=mem, cpus=cpus)
+
+    def _num_workers(self):
+        lengths = set([len(v) for v in self._args.values() if isinstance(v, list)])
+        if len(lengths) > 1:
+            raise InvalidInputArg(f'The length of the arguments are mismatched: {sorted(lengths)}')
+        return lengths.pop() if len(lengths) else 1
+
+    def _get_args(self, i):
+        """ return the arguments for i-th worker """
+        return {label: value[i] if isinstance(value, list) else value for label, value in self._args.items()}
+
+    def _prepare(self):
+        """ prepare the template to be shared by all workers """
+        pass
+
+    def _deploy(self, i, args=None):
+        pass
+
+    def deploy_duplicate(self, i, overrides: dict):
+        """ deploy another worker for the i-th job with some arguments replaced,
+        e.g. to write its outputs into the other location """
+        args = self._get_args(i)
+        args.update(overrides)
+        return self._deploy(i, args)
+
+    def deploy_jobs(self):
+        self._workers = OrderedDict()
+        self._prepare()
+        for i in range(self._num_workers()):
+            self._workers[i] = self._deploy(i)
+
+    def schedule(self, scheduler, label: str = None):
+        """ deploy workers and place them on the queue of the scheduler """
+        self.deploy_jobs()
+        self._schd = scheduler
+        self._step_idx = scheduler.queue(self._workers, label=label)
+
+    def audit(self):
+        """ print out the status of workers, the error messages are printed for the failed workers """
+        for i, worker in self._workers.items():
+            print(f'WorkerID-{i}: {worker.status}')
+            if worker.status == 'failed':
+                print(f'  {self._job_repr(worker)}')
+                for stream, lines in [('stdout', worker.output), ('stderr', worker.error)]:
+                    if worker.log_path(stream) is not None:
+                        print(f'  [{stream}: {worker.log_path(stream)}]')
+                    if lines is not None:
+                        print('  {}'.format('\n  '.join(lines)))
+
+    @staticmethod
+    def _job_repr(worker):
+        return ''
+
+
+class Manager(ManagerBase):
+    """ Manager for the shell command workers.
+    The command template takes arguments with the decorator, e.g. 'cp *[input] *[output]'.
+    """
+    def __init__(self):
+        super(Manager, self).__init__()
+        self._decorator = ['*[', ']']
+        self._cmd = None
+        self._pattern = None
+        self._errterm_pattern = None
+        self._worker_class = Worker
+
+    @property
+    def decorator(self):
+        return self._decorator
+
+    @property
+    def cmd(self):
+        return self._cmd
+
+    def set_cmd(self, cmd: str):
+        self._cmd = cmd
+
+    def set_worker_class(self, worker_class):
+        """ set the class of the workers to deploy, which takes the same arguments as Worker """
+        self._worker_class = worker_class
+
+    def _prepare(self):
+        prefix, suffix = [re.escape(d) for d in self._decorator]
+        labels = '|'.join([re.escape(label) for label in self._args.keys()])
+        self._pattern = re.compile(f'{prefix}({labels}){suffix}') if len(labels) else None
+        self._errterm_pattern = compile_errterm(self._errterm)
+
+    def _deploy(self, i, args=None):
+        cmd = self._cmd
+        if self._pattern is not None:
+            args = self._get_args(i) if args is None else args
+            cmd = self._pattern.sub(lambda m: str(args[m.group(1)]), cmd)
+        return self._worker_class(id=i, cmd=cmd, errterm=self._errterm_pattern, **self._resources)
+
+    @staticmethod
+    def _job_repr(worker):
+        if worker.errterm_found is not None:
+            return f'CMD: {worker.cmd}\n  [aborted by error term: {worker.errterm_found}]'
+        return f'CMD: {worker.cmd}'
+
+
+class FuncManager(ManagerBase):
+    """ Manager for the python function workers.
+    The arguments are given to the function as keyword arguments.
+    """
+    def __init__(self):
+        super(FuncManager, self).__init__()
+        self._func = None
+        self._pool = None
+        self._use_pool = False
+
+    @property
+    def func(self):
+        return self._func
+
+    def set_func(self, func):
+        self._func = func
+
+    def set_pool(self, pool):
+        """ execute the function on the process pool instead of the thread """
+        self._pool = pool
+
+    @staticmethod
+    def is_picklable(func, args=None):
+        """ True if the function and the arguments can be sent to the worker processes, the closures and
+        the functions of the modules not importable by name can not be.
+        """
+        try:
+            pickle.dumps((func, args))
+        except Exception:
+            return False
+        return True
+
+    def _prepare(self):
+        # the function is executed on the thread if it can not be sent
+        self._use_pool = self._pool is not None and self.is_picklable(self._func, self._args)
+
+    @property
+    def use_pool(self):
+        return self._use_pool
+
+    def _deploy(self, i, args=None):
+        pool = self._pool if self._use_pool else None
+        kwargs = self._get_args(i) if args is None else args
+        return FuncWorker(id=i, func=self._func, kwargs=kwargs, pool=pool, **self._resources)
+
+    @staticmethod
+    def _job_repr(worker):
+        return f'Func: {worker.func.__name__}({worker.kwargs})'
+
+
+class AutoTuner(object):
+    """ Adaptive controller of the number of concurrent workers.
+
+    Starting with a small pool, the concurrency grows one by one while the throughput (finished workers per
+    second) keeps improving, and it goes back to the best one when the throughput stops improving.
+    The concurrency shrinks whenever psutil shows the node is saturated by CPU utilization,
+    iowait or lack of memory headroom.
+
+    Args:
+        initial:            initial number of concurrent workers
+        maximum:            upper bound of concurrent workers, the number of logical cores if None
+        tolerance:          the ratio of throughput gain to be regarded as improvement
+        cpu_ceiling:        CPU utilization (%) to be regarded as saturation
+        iowait_ceiling:     iowait (%) to be regarded as saturation
+        mem_floor:          available memory (%) to be regarded as saturation
+    """
+    def __init__(self, initial: int = 2, maximum: int = None, tolerance: float = 0.05,
+                 cpu_ceiling: float = 90, iowait_ceiling: float = 20, mem_floor: float = 10):
+        self._maximum = psutil.cpu_count() if maximum is None else maximum
+        self._n_threads = max(min(initial, self._maximum), 1)
+        self._tolerance = tolerance
+        self._ceilings = dict(cpu=cpu_ceiling, iowait=iowait_ceiling, mem=mem_floor)
+        self._best = (self._n_threads, 0)
+        self._previous = None
+        self._converged = False
+        psutil.cpu_times_percent(interval=None)   # initiate the reference of cpu time sampling
+
+    @property
+    def n_threads(self):
+        return self._n_threads
+
+    @property
+    def maximum(self):
+        return self._maximum
+
+    @property
+    def best(self):
+        """ the number of concurrent workers showed the best throughput """
+        return self._best[0]
+
+    def limit(self, maximum: int):
+        """ lower the upper bound of the concurrency """
+        self._maximum = max(min(self._maximum, maximum), 1)
+        self._n_threads = min(self._n_threads, self._maximum)
+
+    def restore(self, maximum: int, n_threads: int):
+        """ raise the upper bound lowered by limit, and continue from the given concurrency """
+        self._maximum = max(maximum, 1)
+        self._n_threads = max(min(n_threads, self._maximum), 1)
+
+    def is_saturated(self):
+        cpu_times = psutil.cpu_times_percent(interval=None)
+        cpu = 100 - cpu_times.idle
+        iowait = getattr(cpu_times, 'iowait', 0.0)
+        mem = psutil.virtual_memory().available / psutil.virtual_memory().total * 100
+        return cpu > self._ceilings['cpu'] or iowait > self._ceilings['iowait'] or mem < self._ceilings['mem']
+
+    def update(self, throughput: float) -> int:
+        """ update the concurrency from the throughput measured on current concurrency
+        Args:
+            throughput:     the number of workers finished per second
+        Returns:
+            the number of concurrent workers to be used
+        """
+        n_threads = self._n_threads
+        if throughput > self._best[1] * (1 + self._tolerance):
+            self._best = (n_threads, throughput)
+        if self.is_saturated():
+            self._n_threads = max(n_threads - 1, 1)
+        elif not self._converged:
+            previous = self._previous
+            # the growth is judged only against the lower concurrency measured right before,
+            # so the concurrency lowered by the saturation grows again
+            if previous is None or previous[0] >= n_threads or throughput > previous[1] * (1 + self._tolerance):
+                self._n_threads = min(n_threads + 1, self._maximum)
+            else:
+                self._n_threads = self.best
+                self._converged = True
+        self._previous = (n_threads, throughput)
+        return self._n_threads
+
+
+class FailFast(object):
+    """ Policy to abort the step showing high failure rate.
+
+    Args:
+        max_failures:       abort when the number of failed workers reaches this number
+        max_rate:           abort when the ratio of failed workers exceeds this value (0 to 1)
+        min_finished:       the number of finished workers required before the ratio is evaluated,
+                            so the step is evaluated from its first workers
+    """
+    def __init__(self, max_failures: int = None, max_rate: float = None, min_finished: int = None):
+        self._max_failures = max_failures
+        self._max_rate = max_rate
+        self._min_finished = 1 if min_finished is None else min_finished
+
+    def check(self, finished: int, failed: int):
+        """ return the reason if the step needs to be aborted, None otherwise """
+        if self._max_failures is not None and failed >= self._max_failures:
+            return f'{failed} worker(s) failed'
+        if self._max_rate is not None and finished >= self._min_finished:
+            if failed / finished > self._max_rate:
+                return f'{failed} of {finished} finished worker(s) failed'
+        return None
+
+
+class Speculation(object):
+    """ The duplicate launched for the straggler worker, with the callbacks to commit its outputs into the real
+    location or to discard them. 'winner' is 'original' or 'duplicate' once any of them succeeded.
+    """
+    def __init__(self, worker, duplicate, commit, discard):
+        self.worker = worker
+        self.duplicate = duplicate
+        self.commit = commit
+        self.discard = discard
+        self.winner = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+
+def parse_cpulist(cpulist):
+    """ convert the cpu list of sysfs (e.g. '0-3,8-11') into the set of core ids """
+    cores = set()
+    for item in cpulist.strip().split(','):
+        if not len(item):
+            continue
+        start, _, end = item.partition('-')
+        cores.update(range(int(start), int(end or start) + 1))
+    return cores
+
+
+def get_numa_nodes():
+    """ return the list of the cores of each NUMA node, only the cores allowed for current process are listed.
+    All cores are regarded as single node if the topology is not available.
+    """
+    try:
+        allowed = set(psutil.Process().cpu_affinity())
+    except (AttributeError, NotImplementedError, psutil.Error):
+        allowed = set(range(psutil.cpu_count() or 1))
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'),
+                       key=lambda p: int(re.sub(r'\D', '', os.path.basename(os.path.dirname(p))))):
+        try:
+            with open(path, 'r') as f:
+                cores = parse_cpulist(f.read()) & allowed
+        except (OSError, ValueError):
+            continue
+        if len(cores):
+            nodes.append(sorted(cores))
+    covered = set([c for cores in nodes for c in cores])
+    if covered != allowed:
+        nodes = [sorted(allowed)]
+    return nodes
+
+
+class CoreAllocator(object):
+    """ Allocator of the disjoint sets of cores for the pinned workers, shared by all schedulers in the process.
+
+    The cores are taken from single NUMA node if any node has enough free cores, the node with the fewest
+    free cores among them is chosen, so the larger free nodes are kept for the larger workers.
+    Otherwise the cores are spread over the nodes with the most free cores.
+
+    Args:
+        nodes:  list of the cores of each NUMA node, detected from sysfs if None
+    """
+    def __init__(self, nodes: list = None):
+        self._nodes = get_numa_nodes() if nodes is None else [sorted(cores) for cores in nodes]
+        self._free = [list(cores) for cores in self._nodes]
+        self._node_of = dict([(c, i) for i, cores in enumerate(self._nodes) for c in cores])
+        self._lock = threading.Lock()
+
+    @property
+    def nodes(self):
+        return self._nodes
+
+    @property
+    def n_free(self):
+        return sum([len(free) for free in self._free])
+
+    def allocate(self, n_cores: int):
+        """ take the cores, None if not enough cores are free. The request larger than the node
+        is reduced to all cores of the node. """
+        with self._lock:
+            n_cores = max(min(n_cores, len(self._node_of)), 1)
+            fits = [i for i, free in enumerate(self._free) if len(free) >= n_cores]
+            if len(fits):
+                i = min(fits, key=lambda idx: len(self._free[idx]))
+                cores, self._free[i] = self._free[i][:n_cores], self._free[i][n_cores:]
+                return cores
+            if sum([len(free) for free in self._free]) < n_cores:
+                return None
+            cores = []
+            for i in sorted(range(len(self._free)), key=lambda idx: -len(self._free[idx])):
+                taken = self._free[i][:n_cores - len(cores)]
+                self._free[i] = self._free[i][len(taken):]
+                cores.extend(taken)
+            return sorted(cores)
+
+    def release(self, cores: list):
+        with self._lock:
+            for c in cores:
+                free = self._free[self._node_of[c]]
+                if c not in free:
+                    free.append(c)
+            for free in self._free:
+                free.sort()
+
+
+_allocator = None
+
+
+def get_core_allocator():
+    """ return the core allocator of the process, created at the first call """
+    global _allocator
+    with _budget_lock:
+        if _allocator is None:
+            _allocator = CoreAllocator()
+    return _allocator
+
+
+class WorkerBudget(object):
+    """ Budget of concurrent workers shared by all schedulers in the process.
+
+    Every worker launched by any scheduler takes a slot from the budget, so the total concurrency never exceeds
+    the capacity however many pipelines and steps are running. Each running scheduler is entitled to the share
+    of the capacity proportional to its weight. A scheduler can take more than its share while the slots are
+    free, but not while another scheduler below its share is waiting for a slot.
+
+    Args:
+        capacity:   the number of concurrent workers in the process, unlimited if None
+    """
+    # the denied request older than this is not regarded as waiting anymore
+    _wait_expiry = 1.0
+
+    def __init__(self, capacity: int = None):
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._weights = dict()
+        self._in_use = dict()
+        self._waiting = dict()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def set_capacity(self, capacity: int = None):
+        with self._lock:
+            self._capacity = capacity
+
+    @property
+    def in_use(self):
+        return sum(self._in_use.values())
+
+    def register(self, scheduler, weight: float = 1):
+        """ add the scheduler to share the budget """
+        with self._lock:
+            self._weights[scheduler] = weight
+            self._in_use.setdefault(scheduler, 0)
+
+    def unregister(self, scheduler):
+        with self._lock:
+            self._weights.pop(scheduler, None)
+            self._waiting.pop(scheduler, None)
+            if not self._in_use.get(scheduler, 0):
+                self._in_use.pop(scheduler, None)
+
+    def _share(self, scheduler):
+        total = sum(self._weights.values())
+        return self._capacity * self._weights.get(scheduler, 1) / max(total, 1e-6)
+
+    def acquire(self, scheduler) -> bool:
+        """ take a slot for the worker of the scheduler, False if the budget does not allow """
+        with self._lock:
+            if self._capacity is not None:
+                if sum(self._in_use.values()) >= self._capacity:
+                    self._waiting[scheduler] = time.time()
+                    return False
+                if self._in_use.get(scheduler, 0) >= self._share(scheduler):
+                    now = time.time()
+                    for other, since in self._waiting.items():
+                        if other is not scheduler and now - since < self._wait_expiry and \
+                                self._in_use.get(other, 0) < self._share(other):
+                            self._waiting[scheduler] = now
+                            return False
+            self._in_use[scheduler] = self._in_use.get(scheduler, 0) + 1
+            self._waiting.pop(scheduler, None)
+            return True
+
+    def release(self, scheduler):
+        """ return the slot taken by the worker of the scheduler """
+        with self._lock:
+            if self._in_use.get(scheduler, 0) > 0:
+                self._in_use[scheduler] -= 1
+            if not self._in_use.get(scheduler, 1) and scheduler not in self._weights:
+                self._in_use.pop(scheduler, None)
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_budget():
+    """ return the worker budget of the process, which is created from 'worker_budget' in config at the first call.
+    The budget is unlimited if the value is empty or 0, so the schedulers run up to their own 'n_threads',
+    and the number of logical cores is used if the value is 'auto'.
+    """
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            value = config['Preferences'].get('worker_budget', fallback='').strip()
+            if value.lower() == 'auto':
+                capacity = psutil.cpu_count()
+            else:
+                capacity = int(value or 0) or None
+            _budget = WorkerBudget(capacity)
+    return _budget
+
+
+class Scheduler(object):
+    """ Scheduler to execute the queued workers on the threads.
+
+    Each queue is executed as a sub-step, the next sub-step will start after all workers in previous sub-step
+    are finished, and remaining sub-steps are regarded as incomplete if any worker failed.
+
+    The workers are admitted to run up to 'n_threads' at the same time. For the workers declared memory and/or
+    cpus, the admission is further delayed until psutil shows enough available memory and idle cores on the node,
+    so the rest of workers are waiting on the queue. The memory of the running workers is sampled once per
+    refresh interval on the monitor thread, and the admission reads the last sample.
+
+    If the autotune is set, 'n_threads' is adjusted by the AutoTuner every time the workers
+    as many as current concurrency are finished.
+
+    If the fail-fast policy is set, the step is aborted as soon as the failed workers violate the policy,
+    the remaining workers are not launched and the running commands are killed.
+
+    The cancel method stops launching the queued workers, and terminates the process groups of the running
+    commands with SIGTERM, followed by SIGKILL for the ones still alive after the grace period.
+
+    The cores of the node are split across the concurrent workers, and the number of threads for each worker is
+    exported as OMP_NUM_THREADS and the variables in THREAD_ENV_VARS, so the multithreaded tools do not
+    oversubscribe the node. The declared cpus of the worker or set_threads_per_worker overrides the split.
+
+    If the affinity is set, each command worker is pinned to its own set of cores as many as its threads,
+    which are preferably taken from single NUMA node and returned when the worker exits. The worker waits
+    on the queue until the cores are available. The functions are not pinned.
+
+    If the memory watchdog is on, the last sample of the running workers is checked at every watchdog
+    interval. The launches are paused while the memory used on the node is above the ceiling, and the worker
+    exceeding its declared memory is killed and requeued after the other workers of the sub-step, with the
+    concurrency halved. The concurrency grows back one by one once the memory used is below the ceiling by
+    the margin.
+
+    If the speculation is set, the duplicate of the straggler, running longer than the multiple of the median
+    duration of the finished workers in the sub-step (or of its estimated duration), is launched on the free slot
+    once no worker is waiting on the queue. Whichever copy succeeds first is taken, and the other is killed.
+    The duplicate writes its outputs into the private location, which is committed only if it wins.
+
+    If the costs are set, the workers of each sub-step are launched from the one with the largest cost
+    (longest processing time first), so the large jobs do not stretch the tail of the sub-step.
+
+    The workers also take their slots from the worker budget of the process, which is shared with the other
+    schedulers with the weight of each scheduler, see WorkerBudget.
+
+    If the log directory is set, the messages of each worker are streamed into its own log files,
+    and 'stdout' and 'stderr' only keep the last lines of each worker.
+
+    If the work queue is set, the workers are drained together with the other sessions sharing the queue.
+    A worker index is claimed whenever a slot is free, the claimed one runs all sub-steps on this session,
+    and the scheduler keeps claiming until every index is finished by any session.
+    The workers run by the other sessions are marked as skipped, and the claimed worker whose claim is taken
+    by the other session is cancelled with its remaining sub-steps.
+    """
+    # the percentage below the memory ceiling to restore the concurrency lowered by the requeue
+    _restore_margin = 10
+
+    def __init__(self, n_threads: int = None, refresh_rate: float = None):
+        cfg = config['Preferences']
+        self._n_threads = cfg.getint('number_of_threads') if n_threads is None else n_threads
+        self._refresh_rate = cfg.getfloat('daemon_refresh_rate') if refresh_rate is None else refresh_rate
+        self._lock = threading.Lock()
+        self._use_label = False
+        self._background_binder = None
+        self._submitted = False
+        self._log_dir = None
+        self._tail = cfg.getint('log_tail_lines', fallback=100)
+
+        self._queues = OrderedDict()
+        self._labels = dict()
+        self._num_steps = 0
+        self._stdout = OrderedDict()
+        self._stderr = OrderedDict()
+        self._succeeded_workers = dict()
+        self._failed_workers = dict()
+        self._failed_steps = []
+        self._incomplete_steps = []
+        self._failfast = None
+        self._aborted_steps = dict()
+        self._cancelled = False
+        self._cancelled_workers = dict()
+        self._grace_period = cfg.getfloat('cancel_grace_period', fallback=10)
+        self._skipped_workers = dict()
+        self._budget = get_budget()
+        self._weight = 1
+        self._propagate_threads = cfg.getboolean('propagate_threads', fallback=True)
+        self._threads_per_worker = None
+        self._affinity = cfg.getboolean('cpu_affinity', fallback=False)
+
+        # memory watchdog
+        self._watchdog = cfg.getboolean('memory_watchdog', fallback=False)
+        self._watchdog_interval = cfg.getfloat('watchdog_interval', fallback=1)
+        self._mem_ceiling = cfg.getfloat('memory_ceiling', fallback=90)
+        self._max_requeue = cfg.getint('max_requeue', fallback=1)
+        self._monitor_stop = threading.Event()
+        self._paused = False
+        self._requeued = dict()
+        self._requeue_counts = dict()
+        # the concurrency and the maximum of the autotune before the requeue lowered them
+        self._lowered = None
+
+        # the estimated cost of each worker index, to launch the larger ones first
+        self._costs = None
+
+        # speculative execution of the stragglers
+        self._speculation = None
+        self._speculations = dict()
+
+        # the queue shared with the other sessions, and its key for each worker index
+        self._workqueue = None
+        self._queue_keys = None
+        self._claimed = set()
+        self._lost = set()
+
+        # the workers running on the node, {(step_idx, worker_id): worker}
+        self._running = dict()
+
+        # adaptive concurrency, measured only while all slots are busy
+        self._tuner = None
+        self._tuning_window = dict(since=None, clock=0.0, busy=0.0, finished=0.0, started=dict())
+
+    def __repr__(self):
+        status = 'Submitted' if self._submitted else 'Queued'
+        return f'Deployed Workers:[{sum([len(q) for q in self._queues.values()])}]::{status}'
+
+    @property
+    def n_threads(self):
+        return self._n_threads
+
+    @property
+    def tuner(self):
+        return self._tuner
+
+    def set_autotune(self, initial: int = 2, maximum: int = None):
+        """ enable adaptive concurrency, starting from the given number of workers """
+        self._tuner = AutoTuner(initial=initial, maximum=maximum)
+        self._n_threads = self._tuner.n_threads
+
+    def set_log_dir(self, path: str, tail: int = None):
+        """ stream the messages of the workers into the log files in the given folder
+        Args:
+            path:       folder to store the log files, created if not exists
+            tail:       the number of the last lines to keep in memory for each worker
+        """
+        os.makedirs(path, exist_ok=True)
+        self._log_dir = path
+        if tail is not None:
+            self._tail = tail
+
+    @property
+    def log_dir(self):
+        return self._log_dir
+
+    def set_failfast(self, max_failures: int = None, max_failure_rate: float = None, min_finished: int = None):
+        """ abort the sub-step showing high failure rate, see FailFast for the arguments """
+        if max_failures is None and max_failure_rate is None:
+            self._failfast = None
+        else:
+            self._failfast = FailFast(max_failures=max_failures, max_rate=max_failure_rate,
+                                      min_finished=min_finished)
+
+    def set_threads_per_worker(self, n_threads: int = None):
+        """ set the number of threads exported to each worker, the cores are split across
+        the concurrent workers if None """
+        self._threads_per_worker = n_threads
+
+    def set_affinity(self, enabled: bool = True):
+        """ pin each command worker to its own set of cores """
+        self._affinity = enabled
+
+    def _worker_threads(self, step_idx, worker):
+        """ the number of threads for the worker, the cores are split across the concurrent workers
+        unless the worker declared its cpus """
+        n_threads = self._threads_per_worker or worker.resources['cpus']
+        if n_threads is None:
+            concurrency = min(self._n_threads, len(self._queues[step_idx]))
+            if self._budget.capacity is not None:
+                concurrency = min(concurrency, self._budget.capacity)
+            n_threads = (psutil.cpu_count() or 1) // max(concurrency, 1)
+        return max(int(n_threads), 1)
+
+    def _thread_env(self, step_idx, worker):
+        """ the environment variables to limit the threads of the worker """
+        if worker.cores is not None:
+            n_threads = len(worker.cores)
+        elif self._threads_per_worker is None and not self._propagate_threads:
+            return dict()
+        else:
+            n_threads = self._worker_threads(step_idx, worker)
+        return dict([(var, str(n_threads)) for var in THREAD_ENV_VARS])
+
+    def set_watchdog(self, enabled: bool = True, ceiling: float = None, max_requeue: int = None):
+        """ set the memory watchdog
+        Args:
+            enabled:        sample the memory of the workers while running
+            ceiling:        the percentage of the memory used on the node to pause the launches
+            max_requeue:    the number of times a worker killed for its memory can be requeued
+        """
+        self._watchdog = enabled
+        if ceiling is not None:
+            self._mem_ceiling = ceiling
+        if max_requeue is not None:
+            self._max_requeue = max_requeue
+
+    def set_costs(self, costs: list = None):
+        """ set the estimated cost (e.g. duration or input size) of each worker index,
+        the workers are launched in the order of the indices if None """
+        self._costs = costs
+
+    def _cost(self, worker_id):
+        if self._costs is None or not isinstance(worker_id, int) or worker_id >= len(self._costs):
+            return 0
+        return self._costs[worker_id] or 0
+
+    def _ordered(self, workers):
+        """ sort the workers from the largest cost, the workers of same cost keep their order """
+        if self._costs is None:
+            return workers
+        return OrderedDict(sorted(workers.items(), key=lambda item: -self._cost(item[0])))
+
+    def set_speculation(self, factory, multiplier: float = None, min_finished: int = None, estimates: list = None):
+        """ launch the duplicates of the straggler workers
+        Args:
+            factory:        callable taking (step_idx, worker), which returns the duplicate worker with the callbacks
+                            to commit and to discard its outputs, or None if the worker can not be duplicated
+            multiplier:     the worker running longer than this multiple of the median duration is a straggler
+            min_finished:   the number of succeeded workers in the sub-step to use their median duration
+            estimates:      the estimated duration of each worker, used until enough workers are finished
+        """
+        cfg = config['Preferences']
+        if factory is None:
+            self._speculation = None
+            return
+        self._speculation = dict(factory=factory,
+                                 multiplier=cfg.getfloat('speculation_multiplier', fallback=2)
+                                 if multiplier is None else multiplier,
+                                 min_finished=cfg.getint('speculation_min_finished', fallback=3)
+                                 if min_finished is None else min_finished,
+                                 estimates=estimates)
+
+    @property
+    def speculated(self):
+        """ the winner of each speculation, {(step_idx, worker_id): 'original', 'duplicate' or None} """
+        return dict([(key, spec.winner) for key, spec in self._speculations.items() if spec is not None])
+
+    @property
+    def paused(self):
+        """ True if the launches are paused by the memory watchdog """
+        return self._paused
+
+    @property
+    def requeued(self):
+        """ the number of times each worker was requeued, {(step_idx, worker_id): count} """
+        return self._requeue_counts
+
+    def set_weight(self, weight: float = 1):
+        """ set the weight to share the worker budget with the other schedulers """
+        self._weight = weight
+
+    @property
+    def weight(self):
+        return self._weight
+
+    def set_workqueue(self, workqueue, keys: list):
+        """ drain the sub-steps together with the other sessions sharing the work queue
+        Args:
+            workqueue:  WorkQueue object
+            keys:       the key to claim for each worker index
+        """
+        self._workqueue = workqueue
+        self._queue_keys = keys
+        workqueue.set_lost_handler(self._lose)
+
+    def _lose(self, key):
+        """ cancel the worker whose claim is taken by the other session, which runs it instead """
+        worker_id = self._queue_keys.index(key)
+        with self._lock:
+            self._lost.add(worker_id)
+        for workers in self._queues.values():
+            if worker_id in workers:
+                workers[worker_id].cancel()
+
+    @property
+    def workqueue(self):
+        return self._workqueue
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self, grace_period: float = None):
+        """ cancel the submitted sub-steps, the method returns after the running workers are stopped
+        Args:
+            grace_period:   seconds to wait after SIGTERM before SIGKILL is sent
+        """
+        grace_period = self._grace_period if grace_period is None else grace_period
+        with self._lock:
+            self._cancelled = True
+            running = list(self._running.values())
+        for worker in running:
+            worker.cancel()
+        deadline = time.time() + grace_period
+        while time.time() < deadline and any([w.status == 'running' for w in running]):
+            time.sleep(self._refresh_rate)
+        for worker in running:
+            if worker.status == 'running':
+                worker._kill()
+        self.join()
+
+    @property
+    def aborted(self):
+        """ the reason of the aborted sub-steps, {step_idx: reason} """
+        return self._aborted_steps
+
+    @property
+    def queues(self):
+        return self._queues
+
+    @property
+    def stdout(self):
+        return self._stdout
+
+    @property
+    def stderr(self):
+        return self._stderr
+
+    def summary(self):
+        for step_idx, workers in self._queues.items():
+            print(f'Sub-step {step_idx}:')
+            if step_idx in self._aborted_steps:
+                print(f'  Aborted: {self._aborted_steps[step_idx]}')
+            elif self._cancelled and step_idx in self._incomplete_steps:
+                print('  Cancelled')
+            requeued = [wid for (idx, wid) in self._requeue_counts.keys() if idx == step_idx]
+            if len(requeued):
+                print(f'  Requeued for memory: WorkerID-{", ".join(map(str, requeued))}')
+            if len(self._skipped_workers[step_idx]):
+                print(f'  Skipped: {len(self._skipped_workers[step_idx])} worker(s) run by the other sessions')
+            for worker_id, worker in workers.items():
+                print(f'  WorkerID-{worker_id}: {worker.status}')
+
+    def queue(self, workers: dict, label: str = None) -> int:
+        """ place workers on the queue as a new sub-step
+        Args:
+            workers:    the worker objects, {worker_id: worker}
+            label:      label of the queue
+        Returns:
+            index of the sub-step
+        """
+        step_idx = self._num_steps
+        self._queues[step_idx] = OrderedDict(workers)
+        self._labels[step_idx] = label
+        self._succeeded_workers[step_idx] = []
+        self._failed_workers[step_idx] = []
+        self._cancelled_workers[step_idx] = []
+        self._skipped_workers[step_idx] = []
+        self._requeued[step_idx] = []
+        self._num_steps += 1
+        return step_idx
+
+    def submit(self, mode: str = 'foreground', use_label: bool = False):
+        """ execute all queued sub-steps
+        Args:
+            mode:       'foreground' or 'background'
+            use_label:  use label of the queue as the key of stdout and stderr
+        """
+        self._use_label = use_label
+        self._submitted = True
+        if mode == 'background':
+            self._background_binder = threading.Thread(target=self._run_steps)
+            self._background_binder.daemon = True
+            self._background_binder.start()
+        elif mode == 'foreground':
+            self._run_steps()
+        else:
+            raise InvalidMode(f'[{mode}] is not available mode.')
+
+    def join(self):
+        if self._background_binder is not None:
+            self._background_binder.join()
+
+    def is_alive(self):
+        if self._background_binder is not None:
+            return self._background_binder.is_alive()
+        return False
+
+    def _get_key(self, step_idx):
+        label = self._labels[step_idx]
+        if self._use_label and label is not None:
+            return f'{label}_{step_idx}'
+        return step_idx
+
+    def _run_steps(self):
+        self._tuning_window = dict(since=None, clock=0.0, busy=0.0, finished=0.0, started=dict())
+        self._budget.register(self, self._weight)
+        monitor = None
+        declared = any([w.resources['mem'] is not None for q in self._queues.values() for w in q.values()])
+        if self._watchdog or self._speculation is not None or declared:
+            self._monitor_stop.clear()
+            monitor = threading.Thread(target=self._monitor)
+            monitor.daemon = True
+            monitor.start()
+        try:
+            if self._workqueue is not None:
+                self._drain()
+            else:
+                self._run_queues()
+        finally:
+            self._budget.unregister(self)
+            if monitor is not None:
+                self._monitor_stop.set()
+                monitor.join()
+                self._paused = False
+
+    def _monitor(self):
+        """ sample the memory of the running workers at every refresh interval, and watch the memory and
+        the stragglers at every watchdog interval until the sub-steps are finished """
+        watched = time.time()
+        while not self._monitor_stop.wait(min(self._refresh_rate, self._watchdog_interval)):
+            self._sample()
+            if time.time() - watched < self._watchdog_interval:
+                continue
+            watched = time.time()
+            if self._watchdog:
+                self._watch()
+            if self._speculation is not None:
+                self._speculate()
+
+    def _sample(self):
+        """ sample the memory of the process trees of the running workers together, which is read by
+        the admission and the watchdog instead of scanning the process table for each of them """
+        with self._lock:
+            running = list(self._running.values())
+        if not self._watchdog and not any([w.resources['mem'] is not None for w in running]):
+            return
+        rss_map = get_tree_rss_map([worker.pid for worker in running])
+        for worker in running:
+            worker.sample_rss(rss_map[worker.pid])
+
+    def _watch(self):
+        """ check the memory of the node and the running workers at the last sample, and restore
+        the concurrency lowered by the requeue one by one once the memory used on the node is below
+        the ceiling by the margin """
+        vm = psutil.virtual_memory()
+        used = 100 - vm.available / vm.total * 100
+        self._paused = used >= self._mem_ceiling
+        with self._lock:
+            running = list(self._running.values())
+        killed = False
+        for worker in running:
+            mem = worker.resources['mem']
+            if mem is not None and worker.rss > mem:
+                worker.kill_for_memory(worker.rss)
+                killed = True
+        if not killed and self._lowered is not None and used < self._mem_ceiling - self._restore_margin:
+            with self._lock:
+                n_threads, maximum = self._lowered
+                self._n_threads = min(self._n_threads + 1, n_threads)
+                if self._n_threads >= n_threads:
+                    self._lowered = None
+                if self._tuner is not None:
+                    self._tuner.restore(maximum if self._lowered is None else self._n_threads, self._n_threads)
+
+    def _straggling(self, step_idx, worker):
+        """ True if the worker runs longer than the multiple of the median or its estimated duration """
+        policy = self._speculation
+        workers = self._queues[step_idx]
+        durations = [workers[i].duration for i in self._succeeded_workers[step_idx]
+                     if i in workers and workers[i].duration is not None]
+        if len(durations) >= policy['min_finished']:
+            expected = median(durations)
+        elif policy['estimates'] is not None and worker.id < len(policy['estimates']):
+            expected = policy['estimates'][worker.id]
+        else:
+            return False
+        return time.time() - worker.started > expected * policy['multiplier']
+
+    def _speculate(self):
+        """ launch the duplicates of the stragglers on the free slots """
+        with self._lock:
+            for (step_idx, worker_id), worker in list(self._running.items()):
+                if isinstance(worker_id, tuple) or (step_idx, worker_id) in self._speculations:
+                    continue
+                if self._cancelled or step_idx in self._aborted_steps:
+                    return
+                if worker.status != 'running' or worker.started is None:
+                    continue
+                if any([w.status == 'queued' for w in self._queues[step_idx].values()]):
+                    # the slots are for the workers on the queue first
+                    continue
+                if not self._straggling(step_idx, worker):
+                    continue
+                if len(self._running) >= self._n_threads or not self._budget.acquire(self):
+                    return
+                duplicated = self._speculation['factory'](step_idx, worker)
+                if duplicated is None:
+                    self._speculations[(step_idx, worker_id)] = None
+                    self._budget.release(self)
+                    continue
+                spec = Speculation(worker, *duplicated)
+                self._speculations[(step_idx, worker_id)] = spec
+                self._running[(step_idx, (worker_id, 'speculative'))] = spec.duplicate
+                spec.thread = threading.Thread(target=self._execute_duplicate, args=(step_idx, spec))
+                spec.thread.daemon = True
+                spec.thread.start()
+
+    def _execute_duplicate(self, step_idx, spec):
+        duplicate = spec.duplicate
+        self._set_worker_log(step_idx, duplicate, suffix='-speculative')
+        duplicate.set_env(self._thread_env(step_idx, duplicate))
+        try:
+            status = duplicate.run()
+        except Exception:
+            status = 'failed'
+        finally:
+            with self._lock:
+                if self._running.pop((step_idx, (duplicate.id, 'speculative')), None) is not None:
+                    self._budget.release(self)
+        with spec.lock:
+            if spec.winner is None and status == 'succeeded':
+                spec.winner = 'duplicate'
+        if spec.winner == 'duplicate':
+            spec.worker.cancel()
+            spec.worker._kill()
+
+    def _settle(self, step_idx, worker, status):
+        """ decide the result of the worker raced with its duplicate, which is called after the worker exits
+        Returns:
+            the status to be collected
+        """
+        with self._lock:
+            spec = self._speculations.get((step_idx, worker.id))
+        if spec is None:
+            return status
+        with spec.lock:
+            if spec.winner is None and status == 'succeeded':
+                spec.winner = 'original'
+        if spec.winner == 'original':
+            spec.duplicate.cancel()
+            spec.duplicate._kill()
+        spec.thread.join()
+        if spec.winner == 'duplicate':
+            try:
+                spec.commit()
+            except Exception:
+                traceback.print_exception(*sys.exc_info(), file=spec.duplicate._stderr)
+                spec.discard()
+                return 'failed'
+            worker.adopt(spec.duplicate)
+            return worker.status
+        spec.discard()
+        return status
+
+    def _requeue(self, step_idx, worker):
+        """ requeue the worker killed by the watchdog with lower concurrency
+        Returns:
+            False if the worker can not be requeued
+        """
+        if not worker.oom_killed or self._cancelled or step_idx in self._aborted_steps:
+            return False
+        key = (step_idx, worker.id)
+        with self._lock:
+            count = self._requeue_counts.get(key, 0)
+            if count >= self._max_requeue:
+                return False
+            self._requeue_counts[key] = count + 1
+            if self._lowered is None:
+                self._lowered = (self._n_threads, None if self._tuner is None else self._tuner.maximum)
+            self._n_threads = max(self._n_threads // 2, 1)
+            if self._tuner is not None:
+                self._tuner.limit(self._n_threads)
+            worker.reset()
+            self._requeued[step_idx].append(worker)
+        return True
+
+    def _pop_requeued(self, step_idx, worker_ids=None):
+        """ return the workers requeued during the sub-step, only the given workers if worker_ids is set """
+        with self._lock:
+            requeued = self._requeued[step_idx]
+            if worker_ids is not None:
+                requeued = [w for w in requeued if w.id in worker_ids]
+            workers = OrderedDict([(w.id, w) for w in requeued])
+            self._requeued[step_idx] = [w for w in self._requeued[step_idx] if w.id not in workers]
+        return workers
+
+    def _run_queues(self):
+        for step_idx, workers in self._queues.items():
+            if len(self._failed_steps) or self._cancelled:
+                if self._cancelled:
+                    for worker in workers.values():
+                        worker.cancel()
+                self._incomplete_steps.append(step_idx)
+                continue
+            self._run_step(step_idx, workers)
+            if len(self._failed_workers[step_idx]):
+                self._failed_steps.append(step_idx)
+            elif self._cancelled:
+                self._incomplete_steps.append(step_idx)
+
+    def _drain(self):
+        """ claim and run the workers until all of them are finished by any session.
+        A worker is claimed whenever a slot is free, and runs all sub-steps on its own lane,
+        so the rest are left for the other sessions """
+        queue, keys = self._workqueue, self._queue_keys
+        pending = set(range(len(keys)))
+        lanes = dict()
+        while len(pending) and not self._cancelled:
+            lanes = dict([(i, lane) for i, lane in lanes.items() if lane.is_alive()])
+            claimed = None
+            if len(lanes) < self._n_threads:
+                for i in sorted(pending, key=lambda idx: (-self._cost(idx), idx)):
+                    if queue.claim(keys[i]):
+                        claimed = i
+                        break
+            if claimed is not None:
+                pending.discard(claimed)
+                self._claimed.add(claimed)
+                lane = threading.Thread(target=self._run_claimed, args=([claimed], ))
+                lane.daemon = True
+                lane.start()
+                lanes[claimed] = lane
+                continue
+            # no free slot, or the rest are running on the other sessions until they finish or their claims expire
+            time.sleep(self._refresh_rate)
+            pending = set([i for i in pending if not queue.is_finished(keys[i])])
+        for lane in lanes.values():
+            lane.join()
+        if not self._cancelled:
+            queue.close()
+        for step_idx, workers in self._queues.items():
+            for worker_id, worker in workers.items():
+                if worker_id in self._claimed:
+                    continue
+                if self._cancelled:
+                    worker.cancel()
+                else:
+                    worker.skip()
+                    self._skipped_workers[step_idx].append(worker_id)
+
+    def _run_claimed(self, claimed):
+        """ run all sub-steps for the claimed worker indices, then release the claims """
+        failed = False
+        for step_idx, workers in self._queues.items():
+            subset = OrderedDict([(i, workers[i]) for i in claimed if i in workers])
+            if any([i in self._lost for i in claimed]):
+                # the rest are run by the other session
+                for worker in subset.values():
+                    worker.cancel()
+                continue
+            if failed or self._cancelled:
+                if self._cancelled:
+                    for worker in subset.values():
+                        worker.cancel()
+                with self._lock:
+                    if step_idx not in self._incomplete_steps:
+                        self._incomplete_steps.append(step_idx)
+                continue
+            self._run_step(step_idx, subset)
+            if any([i in self._failed_workers[step_idx] for i in subset.keys()]):
+                failed = True
+                with self._lock:
+                    if step_idx not in self._failed_steps:
+                        self._failed_steps.append(step_idx)
+        for i in claimed:
+            statuses = [workers[i].status for workers in self._queues.values() if i in workers]
+            if self._cancelled and 'failed' not in statuses:
+                # leave it for the other sessions
+                self._workqueue.release(self._queue_keys[i])
+            else:
+                self._workqueue.release(self._queue_keys[i], done=all([s == 'succeeded' for s in statuses]))
+
+    def _run_step(self, step_idx, workers):
+        key = self._get_key(step_idx)
+        # kept across the rounds of the work queue
+        self._stdout.setdefault(key, dict())
+        self._stderr.setdefault(key, dict())
+        threads = []
+        workers = self._ordered(workers)
+        worker_ids = set(workers.keys())
+        while len(workers):
+            for worker_id, worker in workers.items():
+                if not self._admit(step_idx, worker):
+                    # cancelled or aborted, the workers not launched yet are not going to run
+                    for w in workers.values():
+                        if w.status == 'queued':
+                            w.cancel()
+                    break
+                thread = threading.Thread(target=self._execute, args=(step_idx, worker))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            workers = self._pop_requeued(step_idx, worker_ids)
+
+    def _execute(self, step_idx, worker):
+        self._prepare_worker(step_idx, worker)
+        try:
+            status = worker.run()
+        except Exception:
+            status = 'failed'
+        finally:
+            self._release(step_idx, worker)
+        status = self._settle(step_idx, worker, status)
+        self._collect(step_idx, worker, status)
+
+    def _prepare_worker(self, step_idx, worker):
+        """ set the log files and environment of the worker right before its launch """
+        self._set_worker_log(step_idx, worker)
+        worker.set_env(self._thread_env(step_idx, worker))
+
+    def _set_worker_log(self, step_idx, worker, suffix=''):
+        prefix = None
+        if self._log_dir is not None:
+            prefix = os.path.join(self._log_dir, f'{self._get_key(step_idx)}-worker{worker.id}{suffix}')
+        worker.set_log(prefix, tail=self._tail)
+
+    def _release(self, step_idx, worker):
+        with self._lock:
+            if self._running.pop((step_idx, worker.id), None) is not None:
+                self._track_saturation((step_idx, worker.id), finished=True)
+                self._budget.release(self)
+                if worker.cores is not None:
+                    get_core_allocator().release(worker.cores)
+
+    def _collect(self, step_idx, worker, status):
+        """ record the result of the finished worker """
+        if status == 'failed' and self._requeue(step_idx, worker):
+            return
+        key = self._get_key(step_idx)
+        self._stdout[key][worker.id] = worker.output
+        self._stderr[key][worker.id] = worker.error
+        if status == 'succeeded':
+            self._succeeded_workers[step_idx].append(worker.id)
+        elif status == 'cancelled':
+            self._cancelled_workers[step_idx].append(worker.id)
+        else:
+            self._failed_workers[step_idx].append(worker.id)
+            if self._failfast is not None:
+                self._check_failfast(step_idx)
+        if self._tuner is not None:
+            self._tune()
+
+    def _track_saturation(self, key, finished=False):
+        """ accumulate the time all slots are busy, which is called under the lock whenever the running workers
+        change. The idle time waiting for the admission and the tail of the sub-step are not counted,
+        and each finished worker is credited by the fraction of its run time with all slots busy,
+        so the throughput reflects the concurrency only.
+        Args:
+            key:        (step_idx, worker_id) of the worker admitted or finished
+            finished:   True if the worker is finished
+        """
+        window = self._tuning_window
+        now = self._tick_saturation()
+        if finished:
+            started, clock = window['started'].pop(key, (now, window['clock']))
+            if now > started:
+                window['finished'] += (window['clock'] - clock) / (now - started)
+        else:
+            window['started'][key] = (now, window['clock'])
+        window['since'] = now if len(self._running) == self._n_threads else None
+
+    def _tick_saturation(self):
+        """ add the time since the last change to the busy time if all slots were busy """
+        window = self._tuning_window
+        now = time.time()
+        if window['since'] is not None:
+            window['clock'] += now - window['since']
+            window['busy'] += now - window['since']
+        return now
+
+    def _tune(self):
+        """ update the concurrency when a round of workers finished with all slots busy """
+        with self._lock:
+            window = self._tuning_window
+            if window['finished'] >= self._n_threads and window['busy'] > 0:
+                self._n_threads = self._tuner.update(window['finished'] / window['busy'])
+                now = self._tick_saturation()
+                window['busy'] = 0.0
+                window['finished'] = 0.0
+                # the window starts again once the running workers match the new concurrency
+                window['since'] = now if len(self._running) == self._n_threads else None
+
+    def _check_failfast(self, step_idx):
+        with self._lock:
+            if step_idx in self._aborted_steps:
+                return
+            n_failed = len(self._failed_workers[step_idx])
+            n_finished = len(self._succeeded_workers[step_idx]) + n_failed
+            reason = self._failfast.check(n_finished, n_failed)
+            if reason is None:
+                return
+            self._aborted_steps[step_idx] = reason
+            running = [w for (idx, _), w in self._running.items() if idx == step_idx]
+        for worker in running:
+            worker._kill()
+
+    def _admit(self, step_idx, worker):
+        """ wait until the worker can be admitted, then reserve its slot
+        Returns:
+            False if the sub-step is aborted while waiting
+        """
+        while True:
+            with self._lock:
+                if step_idx in self._aborted_steps or self._cancelled:
+                    return False
+                if self._is_admissible(step_idx, worker):
+                    self._running[(step_idx, worker.id)] = worker
+                    self._track_saturation((step_idx, worker.id))
+                    return True
+            time.sleep(self._refresh_rate)
+
+    def _is_admissible(self, step_idx, worker):
+        """ check the number of running workers and resources available on the node,
+        then take the slot from the worker budget and the cores to pin """
+        if len(self._running) >= self._n_threads:
+            return False
+        if self._paused and len(self._running):
+            return False
+        # the idle scheduler skips the resource check, otherwise an oversized request never runs
+        if len(self._running) and not self._has_resources(worker):
+            return False
+        cores = None
+        if self._affinity and isinstance(worker, Worker):
+            cores = get_core_allocator().allocate(self._worker_threads(step_idx, worker))
+            if cores is None:
+                return False
+        if not self._budget.acquire(self):
+            if cores is not None:
+                get_core_allocator().release(cores)
+            return False
+        worker.set_cores(cores)
+        return True
+
+    def _has_resources(self, worker):
+        """ check the memory and cores available on the node for the worker """
+        mem, cpus = worker.resources['mem'], worker.resources['cpus']
+        if mem is not None:
+            if psutil.virtual_memory().available - self._pending_memory() < mem:
+                return False
+        if cpus is not None:
+            n_cores = psutil.cpu_count()
+            reserved = sum([w.resources['cpus'] or 1 for w in self._running.values()])
+            idle = n_cores * (100 - psutil.cpu_percent(interval=None)) / 100
+            if min(n_cores - reserved, idle) < cpus:
+                return False
+        return True
+
+    def _pending_memory(self):
+        """ memory declared by running workers, but not allocated yet at the last sample """
+        return sum([max(w.resources['mem'] - w.rss, 0) for w in self._running.values()
+                    if w.resources['mem'] is not None])
+
+
+def compile_errterm(errterm):
+    """ compile the error terms into single pattern, so each line is scanned once for all terms
+    Args:
+        errterm:    a term, list of terms or compiled pattern
+    Returns:
+        compiled pattern, None if no term is given
+    """
+    if errterm is None or hasattr(errterm, 'search'):
+        return errterm
+    if isinstance(errterm, str):
+        errterm = [errterm]
+    terms = [term for term in errterm if len(term)]
+    if not len(terms):
+        return None
+    # the longer term first, so the most specific term is reported when terms overlap
+    return re.compile('|'.join([re.escape(term) for term in sorted(set(terms), key=len, reverse=True)]))
+
+
+def get_tree_rss(pid):
+    """ return the sum of resident memory of the process and its children """
+    return get_tree_rss_map([pid])[pid]
+
+
+def get_tree_rss_map(pids: list) -> dict:
+    """ return the sum of resident memory of each process and its children, {pid: rss}.
+    The process table is scanned once for all trees, and the memory is read only for the processes in the trees.
+    """
+    procs, children = dict(), dict()
+    if any([pid is not None for pid in pids]):
+        for proc in psutil.process_iter(['ppid']):
+            procs[proc.pid] = proc
+            children.setdefault(proc.info['ppid'], []).append(proc.pid)
+    rss_map = dict()
+    for pid in pids:
+        rss, stack = 0, [] if pid is None else [pid]
+        while len(stack):
+            cur = stack.pop()
+            if cur in procs:
+                try:
+                    rss += procs[cur].memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            stack.extend(children.get(cur, []))
+        rss_map[pid] = rss
+    return rss_map
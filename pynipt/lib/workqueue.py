@@ -0,0 +1,238 @@
+import os
+import time
+import uuid
+import socket
+import threading
+from ..config import config
+
+
+class WorkQueue(object):
+    """ File-lock based work queue on the shared file system, so several sessions on the different nodes
+    can drain the same step without running the same worker twice.
+
+    Each key (the unit of work, e.g. a subject of a step) is claimed by creating '<key>.claim' exclusively,
+    which is atomic on the shared file system. The claims held by the session are touched at every
+    heartbeat, and the claim not touched for the expiry time is regarded as the claim of a dead session,
+    so it can be reclaimed by the others. The finished key is marked with '<key>.done' or '<key>.failed'.
+
+    The markers written before the queue is opened by the first session of the execution are ignored, so the keys
+    finished or failed on the previous execution are processed again, while the session joining later honours
+    the markers of the others. The opening time is kept in the '.opened' file, which is written by the session
+    finding the queue idle (no live claim), and removed once all keys are finished.
+    If the heartbeat finds the claim is taken by the other session (e.g. this session was frozen longer than
+    the expiry time), the key is regarded as lost, and the handler given by set_lost_handler is called.
+
+    Args:
+        path:       folder to store the claims, which must be on the file system shared by all sessions
+        heartbeat:  seconds between the heartbeats, 'queue_heartbeat' in config if None
+        expire:     seconds without heartbeat to regard the claim as dead, four heartbeats if None
+        since:      the markers older than this timestamp are ignored, the opening time of the queue if None
+    """
+    def __init__(self, path: str, heartbeat: float = None, expire: float = None, since: float = None):
+        if heartbeat is None:
+            heartbeat = config['Preferences'].getfloat('queue_heartbeat', fallback=30)
+        self._path = path
+        self._heartbeat = heartbeat
+        self._expire = heartbeat * 4 if expire is None else expire
+        self._owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._claims = set()
+        self._lost = set()
+        self._on_lost = None
+        self._lock = threading.Lock()
+        self._beater = None
+        os.makedirs(path, exist_ok=True)
+        self._since = self._open() if since is None else since
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def owner(self):
+        return self._owner
+
+    @property
+    def heartbeat(self):
+        return self._heartbeat
+
+    @property
+    def since(self):
+        return self._since
+
+    @property
+    def claims(self):
+        """ the keys claimed by current session """
+        return set(self._claims)
+
+    @property
+    def lost(self):
+        """ the keys claimed by current session, but taken by the other session """
+        return set(self._lost)
+
+    def set_lost_handler(self, handler):
+        """ set the callable taking the key, which is called on the heartbeat thread when the key is lost """
+        self._on_lost = handler
+
+    def _file(self, key, ext):
+        return os.path.join(self._path, f'{key}.{ext}')
+
+    def _is_idle(self):
+        """ True if no session holds the live claim """
+        now = time.time()
+        for f in os.listdir(self._path):
+            if not f.endswith('.claim'):
+                continue
+            try:
+                if now - os.path.getmtime(os.path.join(self._path, f)) < self._expire:
+                    return False
+            except FileNotFoundError:
+                pass
+        return True
+
+    def _open(self):
+        """ return the opening time of the queue, the queue is opened again if it is idle for the expiry time """
+        path = os.path.join(self._path, '.opened')
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    opened = os.path.getmtime(path)
+                except FileNotFoundError:
+                    continue
+                if time.time() - opened < self._expire or not self._is_idle():
+                    return opened
+                # left by the execution not finished, e.g. all sessions were killed
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(self._owner)
+            return os.path.getmtime(path)
+        return time.time()
+
+    def close(self):
+        """ remove the opening time once all keys are finished, unless the other session still holds the claim,
+        so the next execution opens the queue again """
+        if self._is_idle():
+            try:
+                os.unlink(os.path.join(self._path, '.opened'))
+            except FileNotFoundError:
+                pass
+
+    def _owns(self, key):
+        """ True if the claim of the key is held by current session """
+        try:
+            with open(self._file(key, 'claim'), 'r') as f:
+                return f.read() == self._owner
+        except FileNotFoundError:
+            return False
+
+    def is_finished(self, key: str) -> bool:
+        """ True if the key is marked as done or failed by any session """
+        for ext in ['done', 'failed']:
+            try:
+                if os.path.getmtime(self._file(key, ext)) >= self._since:
+                    return True
+            except FileNotFoundError:
+                pass
+        return False
+
+    def claim(self, key: str) -> bool:
+        """ claim the key, True if the key is claimed by current session """
+        if self.is_finished(key):
+            return False
+        path = self._file(key, 'claim')
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._reclaim(path):
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(self._owner)
+            if self.is_finished(key):
+                # finished by the other session right before the claim
+                os.unlink(path)
+                return False
+            with self._lock:
+                self._claims.add(key)
+                self._start_heartbeat()
+            return True
+        return False
+
+    def _reclaim(self, path):
+        """ remove the claim of the dead session, True if the claim is removed """
+        stale = f'{path}.{uuid.uuid4().hex[:8]}.stale'
+        try:
+            if time.time() - os.path.getmtime(path) < self._expire:
+                return False
+            os.rename(path, stale)
+        except FileNotFoundError:
+            # released by the owner
+            return True
+        if time.time() - os.path.getmtime(stale) < self._expire:
+            # the claim was renewed right before it was moved, so put it back
+            try:
+                os.link(stale, path)
+            except FileExistsError:
+                pass
+            os.unlink(stale)
+            return False
+        os.unlink(stale)
+        return True
+
+    def release(self, key: str, done: bool = None):
+        """ release the claim of the key
+        Args:
+            key:    the key claimed by current session
+            done:   True to mark the key as done, False to mark it as failed,
+                    None to leave the key for the other sessions
+        """
+        with self._lock:
+            self._claims.discard(key)
+            if key in self._lost:
+                # the key is taken by the other session, which marks it
+                self._lost.discard(key)
+                return
+        if done is not None:
+            with open(self._file(key, 'done' if done else 'failed'), 'w') as f:
+                f.write(self._owner)
+        if self._owns(key):
+            try:
+                os.unlink(self._file(key, 'claim'))
+            except FileNotFoundError:
+                pass
+
+    def _start_heartbeat(self):
+        if self._beater is None or not self._beater.is_alive():
+            self._beater = threading.Thread(target=self._beat)
+            self._beater.daemon = True
+            self._beater.start()
+
+    def _beat(self):
+        while True:
+            time.sleep(self._heartbeat)
+            with self._lock:
+                keys = list(self._claims)
+                if not len(keys):
+                    self._beater = None
+                    return
+            for key in keys:
+                if self._owns(key):
+                    try:
+                        os.utime(self._file(key, 'claim'))
+                        continue
+                    except FileNotFoundError:
+                        pass
+                with self._lock:
+                    if key not in self._claims:
+                        # released while beating
+                        continue
+                    self._claims.discard(key)
+                    self._lost.add(key)
+                if self._on_lost is not None:
+                    self._on_lost(key)
@@ -1,31 +1,69 @@
 import os
+import shutil
+from statistics import median
 from shleeh.utils import *
 
 
-def intensive_mkdir(abspaths, interface=None):
+def intensive_mkdir(abspaths, interface=None, created=None):
     """Intensive mkdir, make all parent paths if it not exists.
+    The duplicated paths are made once, and the paths in 'created' are regarded as existing without
+    accessing the file system, so that each directory costs single 'exists' call at most.
+
+    Args:
+        abspaths: a path or list of paths
+        interface: the module to access file system, os if None
+        created: set of paths known to exist, the paths made here will be added
     """
     if interface is None:
         interface = os
     if isinstance(abspaths, str):
         abspaths = [abspaths]
-    elif isinstance(abspaths, list):
+    elif isinstance(abspaths, (list, set, tuple)):
         pass
     else:
         raise Exception
-    for abspath in abspaths:
-        subpaths = []
-        target_path, subpath = interface.path.split(abspath)
-        subpaths.append(subpath)
-        while not interface.path.exists(target_path):
-            target_path, subpath = interface.path.split(target_path)
-            subpaths.append(subpath)
-        subpaths = subpaths[::-1]
+    if created is None:
+        created = set()
+    # parents come earlier than its children after sorting
+    for abspath in sorted(set(abspaths)):
+        missing = []
+        target_path = abspath
+        while target_path and target_path not in created and not interface.path.exists(target_path):
+            missing.append(target_path)
+            parent_path = interface.path.dirname(target_path)
+            if parent_path == target_path:
+                break
+            target_path = parent_path
+        for path in reversed(missing):
+            try:
+                interface.mkdir(path)
+            except FileExistsError:
+                # made by other thread
+                pass
+        created.add(abspath)
+        created.update(missing)
+    return created
+
 
-        for subpath in subpaths:
-            target_path = interface.path.join(target_path, subpath)
-            if not interface.path.exists(target_path):
-                interface.mkdir(target_path)
+def commit_tree(src, dst):
+    """Move all files in the src folder into the same relative location in the dst folder.
+    Each file is replaced atomically if both folders are on the same file system, otherwise it is copied
+    next to the destination first and then renamed.
+
+    Args:
+        src: the folder containing the files to commit
+        dst: the destination folder
+    """
+    for root, _, files in os.walk(src):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target_root, exist_ok=True)
+        for f in files:
+            target = os.path.join(target_root, f)
+            try:
+                os.replace(os.path.join(root, f), target)
+            except OSError:
+                shutil.copy2(os.path.join(root, f), f'{target}.partial')
+                os.replace(f'{target}.partial', target)
 
 
 def remove_ext(filename):
@@ -49,6 +87,26 @@ def change_ext(filename, ext):
         return '{}.{}'.format(remove_ext(filename), ext)
 
 
+def nifti_counterpart(filename):
+    """Return the compressed filename of the uncompressed NIfTI file and vice versa,
+    None if the file is not NIfTI.
+    """
+    if filename.endswith('.nii.gz'):
+        return filename[:-3]
+    elif filename.endswith('.nii'):
+        return '{}.gz'.format(filename)
+    return None
+
+
+def logical_name(filename):
+    """Return the filename (or the extension) regarding the uncompressed NIfTI file as the compressed one,
+    so '.nii' and '.nii.gz' are compared as the same logical file.
+    """
+    if filename.endswith('.nii') or filename == 'nii':
+        return '{}.gz'.format(filename)
+    return filename
+
+
 def change_fname(filename, find, replace):
     # pattern = re.compile(r'^(.*){}(.*)$'.format(find))
     # return pattern.sub(r'\1{}\2'.format(replace), filename)
@@ -64,3 +122,35 @@ def get_list_addons():
         pkg_name = re.match(p_plugin, p.project_name).group('name')
         added[pkg_name] = os.path.basename(p.module_path)
     return added
+
+
+def estimate_duration(samples, size=0):
+    """Estimate the duration of a job from the samples of previous jobs.
+    The duration is regarded as proportional to the size of the inputs if the size is known,
+    otherwise the median of the durations is used.
+
+    Args:
+        samples: list of [input size, duration]
+        size: input size of the job to be estimated
+    """
+    rates = [duration / s for s, duration in samples if s > 0]
+    if size > 0 and len(rates):
+        return size * median(rates)
+    return median([duration for _, duration in samples])
+
+
+def parse_size(size):
+    """Convert the size string with unit (e.g. '512M', '12G') into bytes.
+    The number without unit is regarded as GB, None is returned as it is.
+    """
+    if size is None:
+        return None
+    if isinstance(size, (int, float)):
+        return int(size * 1024 ** 3)
+    units = dict(K=1024, M=1024 ** 2, G=1024 ** 3, T=1024 ** 4)
+    matched = re.match(r'^\s*(?P<value>[0-9.]+)\s*(?P<unit>[KMGT]?)B?\s*$', str(size).upper())
+    if matched is None:
+        raise ValueError(f'Invalid size: {size}')
+    value = float(matched.group('value'))
+    unit = matched.group('unit')
+    return int(value * units[unit]) if unit else int(value * units['G'])
@@ -0,0 +1,56 @@
+import time
+import threading
+import pytest
+from pynipt.lib import aio
+from pynipt.lib.scheduler import Manager, get_budget
+from pynipt.lib.aio import AsyncWorker, AsyncScheduler
+
+
+def run_async(cmd, args, n_threads=2, errterm=None):
+    mng = Manager()
+    mng.set_worker_class(AsyncWorker)
+    mng.set_cmd(cmd)
+    for label, value in args.items():
+        mng.set_arg(label, value)
+    if errterm is not None:
+        mng.set_errterm(errterm)
+    schd = AsyncScheduler(n_threads=n_threads, refresh_rate=0.01)
+    mng.schedule(schd)
+    schd.submit()
+    return mng
+
+
+def test_async_status_and_messages():
+    mng = run_async('echo out-*[v]; echo err-*[v] >&2; exit *[c]', dict(v=['a', 'b'], c=[0, 3]))
+    workers = list(mng.workers.values())
+    assert [w.status for w in workers] == ['succeeded', 'failed']
+    assert workers[1].returncode == 3
+    assert [w.output for w in workers] == [['out-a'], ['out-b']]
+    assert [w.error for w in workers] == [['err-a'], ['err-b']]
+
+
+def test_async_errterm_kills():
+    mng = run_async('echo *[msg]; sleep 5', dict(msg=['fine', 'ERROR: broken']), errterm='ERROR')
+    worker = mng.workers[1]
+    assert [w.status for w in mng.workers.values()] == ['succeeded', 'failed']
+    assert worker.duration < 5
+
+
+@pytest.mark.skipif(not aio._use_pidfd, reason='pidfd is not available')
+def test_async_children_without_thread_each(monkeypatch):
+    monkeypatch.setattr(get_budget(), '_capacity', None)
+    peak, stop = [0], threading.Event()
+
+    def count():
+        while not stop.is_set():
+            peak[0] = max(peak[0], threading.active_count())
+            time.sleep(0.01)
+    counter = threading.Thread(target=count)
+    counter.start()
+    try:
+        mng = run_async('sleep 0.5; echo *[v]', dict(v=list(range(20))), n_threads=20)
+    finally:
+        stop.set()
+        counter.join()
+    assert set([w.status for w in mng.workers.values()]) == {'succeeded'}
+    assert peak[0] < 10
@@ -0,0 +1,87 @@
+import os
+import time
+from pynipt.lib.scheduler import Manager
+from pynipt.lib.batch import LOCAL_SUBMITTER, BatchWorker, BatchScheduler
+
+
+def make_worker(cmd, prefix):
+    worker = BatchWorker(id=0, cmd=cmd, submitter=LOCAL_SUBMITTER, poll_interval=0.01)
+    worker.set_log(str(prefix))
+    return worker
+
+
+def wait(worker, timeout=10):
+    deadline = time.time() + timeout
+    while not worker.poll() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def is_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_submit_and_poll_exit_file(tmp_path):
+    worker = make_worker('echo out; echo err >&2; exit 3', tmp_path / 'worker0')
+    assert worker.submit() == 'running'
+    assert worker.job_id.isdigit()
+    wait(worker)
+    assert worker.status == 'failed'
+    assert worker.returncode == 3
+    assert open(worker.exit_path).read().strip() == '3'
+    assert worker.output == ['out']
+    assert worker.error == ['err']
+
+
+def test_exit_path_with_space(tmp_path):
+    folder = tmp_path / 'with space'
+    folder.mkdir()
+    worker = make_worker('echo fine', folder / 'worker0')
+    worker.submit()
+    wait(worker)
+    assert worker.status == 'succeeded'
+    assert os.path.exists(worker.exit_path)
+
+
+def test_cancel_terminates_job(tmp_path):
+    worker = make_worker('sleep 30', tmp_path / 'worker0')
+    worker.submit()
+    job_id = worker.job_id
+    assert is_alive(job_id)
+    worker.cancel()
+    assert worker.status == 'cancelled'
+    deadline = time.time() + 5
+    while is_alive(job_id) and time.time() < deadline:
+        time.sleep(0.01)
+    assert not is_alive(job_id)
+
+
+def test_scheduler_removes_script_folder():
+    mng = Manager()
+    mng.set_worker_class(BatchWorker)
+    mng.set_cmd('echo *[value]')
+    mng.set_arg('value', ['a', 'b'])
+    schd = BatchScheduler(n_threads=2, refresh_rate=0.01, poll_interval=0.01)
+    mng.schedule(schd)
+    schd.submit()
+    assert [w.status for w in mng.workers.values()] == ['succeeded'] * 2
+    assert [w.output for w in mng.workers.values()] == [['a'], ['b']]
+    folders = set([os.path.dirname(w.script_path) for w in mng.workers.values()])
+    assert len(folders) == 1
+    assert not os.path.exists(folders.pop())
+
+
+def test_failed_poll_is_unknown():
+    schd = BatchScheduler(poll_interval=0.01)
+    worker = make_worker('true', '/nonexistent/worker0')
+    worker._job_id = '1'
+    schd._submitter = dict(schd._submitter, poll='echo 2; exit 1')
+    assert schd._poll_jobs([worker]) is None
+    schd._submitter = dict(schd._submitter, poll='echo 2')
+    assert schd._poll_jobs([worker]) == {'2'}
+    schd._poll_codes = [0, 1]
+    schd._submitter = dict(schd._submitter, poll='exit 1')
+    assert schd._poll_jobs([worker]) == set()
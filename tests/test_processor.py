@@ -0,0 +1,44 @@
+import os
+import json
+import threading
+import multiprocessing as mp
+from pynipt.lib.processor import Processor
+from pynipt.lib.interface import InterfaceBuilder
+
+
+def make_processor(path):
+    proc = Processor.__new__(Processor)
+    proc.msi = os
+    proc._log_path = str(path)
+    proc._logger = None
+    return proc
+
+
+def record_durations(path, key, n):
+    proc = make_processor(path)
+    for i in range(n):
+        proc.update_history('durations', merge=InterfaceBuilder._merge_durations,
+                            **{key: dict(samples=[[0, i]], elapsed=[i])})
+
+
+def test_update_history_keeps_concurrent_updates(tmp_path):
+    threads = [threading.Thread(target=record_durations, args=(tmp_path, 'step', 25)) for _ in range(2)]
+    procs = [mp.get_context('fork').Process(target=record_durations, args=(tmp_path, 'step', 25))
+             for _ in range(2)]
+    # forked before the threads take the lock
+    for job in procs + threads:
+        job.start()
+    for job in threads + procs:
+        job.join()
+    assert all(p.exitcode == 0 for p in procs)
+    record = make_processor(tmp_path).load_history('durations')['step']
+    assert len(record['samples']) == 100
+    assert [f for f in os.listdir(tmp_path) if f.endswith('.partial')] == []
+
+
+def test_update_history_replaces_without_merge(tmp_path):
+    proc = make_processor(tmp_path)
+    proc.update_history('autotune', a=2, b=3)
+    assert proc.update_history('autotune', a=4) == dict(a=4, b=3)
+    with open(tmp_path / 'autotune.json') as f:
+        assert json.load(f) == dict(a=4, b=3)
@@ -0,0 +1,238 @@
+import os
+import subprocess as sp
+from pynipt.lib.scheduler import Manager, FuncManager, Scheduler, Worker, get_tree_rss_map
+
+
+def run_cmd(cmd, args=None, errterm=None, n_threads=2, mode='foreground'):
+    mng = Manager()
+    mng.set_cmd(cmd)
+    for label, value in (args or dict()).items():
+        mng.set_arg(label, value)
+    if errterm is not None:
+        mng.set_errterm(errterm)
+    schd = Scheduler(n_threads=n_threads, refresh_rate=0.01)
+    mng.schedule(schd)
+    schd.submit(mode=mode)
+    schd.join()
+    return mng, schd
+
+
+def run_func(func, args=None, n_threads=2):
+    mng = FuncManager()
+    mng.set_func(func)
+    for label, value in (args or dict()).items():
+        mng.set_arg(label, value)
+    schd = Scheduler(n_threads=n_threads, refresh_rate=0.01)
+    mng.schedule(schd)
+    schd.submit()
+    return mng, schd
+
+
+def statuses(mng):
+    return [w.status for w in mng.workers.values()]
+
+
+def test_cmd_submit_and_join(tmp_path):
+    outputs = [str(tmp_path / f'out{i}') for i in range(4)]
+    mng, schd = run_cmd('echo *[value] > *[output]', dict(value=list('abcd'), output=outputs), mode='background')
+    assert not schd.is_alive()
+    assert statuses(mng) == ['succeeded'] * 4
+    assert [open(o).read().strip() for o in outputs] == list('abcd')
+
+
+def test_cmd_captures_stdout_and_stderr():
+    mng, schd = run_cmd('echo out-*[value]; echo err-*[value] >&2', dict(value=['x', 'y']))
+    assert [w.output for w in mng.workers.values()] == [['out-x'], ['out-y']]
+    assert [w.error for w in mng.workers.values()] == [['err-x'], ['err-y']]
+    assert schd.stdout[0] == {0: ['out-x'], 1: ['out-y']}
+    assert schd.stderr[0] == {0: ['err-x'], 1: ['err-y']}
+
+
+def test_cmd_failure_status():
+    mng, schd = run_cmd('exit *[code]', dict(code=[0, 3]))
+    assert statuses(mng) == ['succeeded', 'failed']
+    assert mng.workers[1].returncode == 3
+
+
+def test_cmd_errterm_kills_and_fails():
+    mng, schd = run_cmd('echo *[msg]; sleep 5', dict(msg=['fine', 'ERROR: broken']), errterm='ERROR')
+    worker = mng.workers[1]
+    assert statuses(mng) == ['succeeded', 'failed']
+    assert worker.errterm_found == 'ERROR'
+    assert worker.duration < 5
+
+
+def test_failed_substep_leaves_next_incomplete():
+    mng = Manager()
+    mng.set_cmd('exit 1')
+    schd = Scheduler(n_threads=1, refresh_rate=0.01)
+    mng.schedule(schd)
+    nxt = Manager()
+    nxt.set_cmd('echo never')
+    nxt.schedule(schd)
+    schd.submit()
+    assert statuses(mng) == ['failed']
+    assert statuses(nxt) == ['queued']
+
+
+def _add(a, b, stdout):
+    stdout.write(f'{a + b}\n')
+
+
+def _fail(value, stderr):
+    stderr.write(f'bad {value}\n')
+    return value
+
+
+def _raise(value):
+    raise ValueError(value)
+
+
+def test_func_submit_and_capture():
+    mng, schd = run_func(_add, dict(a=[1, 2, 3], b=10))
+    assert statuses(mng) == ['succeeded'] * 3
+    assert [w.output for w in mng.workers.values()] == [['11'], ['12'], ['13']]
+
+
+def test_func_failure_status():
+    mng, _ = run_func(_fail, dict(value=[0, 2]))
+    assert statuses(mng) == ['succeeded', 'failed']
+    assert mng.workers[1].error == ['bad 2']
+
+
+def test_func_exception_is_failure():
+    mng, _ = run_func(_raise, dict(value=['boom']))
+    worker = mng.workers[0]
+    assert statuses(mng) == ['failed']
+    assert worker.returncode == 1
+    assert any('ValueError: boom' in line for line in worker.error)
+
+
+
+def test_failfast_cancels_unlaunched_workers():
+    mng = Manager()
+    mng.set_cmd('exit *[code]')
+    mng.set_arg('code', [1, 1, 0, 0])
+    schd = Scheduler(n_threads=1, refresh_rate=0.01)
+    schd.set_failfast(max_failures=2)
+    mng.schedule(schd)
+    schd.submit()
+    assert statuses(mng) == ['failed', 'failed', 'cancelled', 'cancelled']
+
+
+def test_workqueue_sessions_run_each_worker_once(tmp_path):
+    from pynipt.lib.workqueue import WorkQueue
+    log = tmp_path / 'log'
+    keys = [f'key{i}' for i in range(6)]
+    sessions = []
+    for _ in range(2):
+        mng = Manager()
+        mng.set_cmd('echo *[value] >> ' + str(log) + '; sleep 0.2')
+        mng.set_arg('value', keys)
+        schd = Scheduler(n_threads=2, refresh_rate=0.01)
+        schd.set_workqueue(WorkQueue(str(tmp_path / 'queue'), heartbeat=1), keys)
+        mng.schedule(schd)
+        schd.submit(mode='background')
+        sessions.append((mng, schd))
+    for _, schd in sessions:
+        schd.join()
+    assert sorted(open(log).read().split()) == keys
+    for mng, _ in sessions:
+        assert set(statuses(mng)) <= {'succeeded', 'skipped'}
+
+
+def test_tree_rss_map_sums_children():
+    proc = sp.Popen(['/bin/sh', '-c', 'sleep 5 & sleep 5'])
+    try:
+        rss_map = get_tree_rss_map([proc.pid, os.getpid(), None])
+        assert rss_map[None] == 0
+        assert rss_map[proc.pid] > 0
+        # the tree of this process includes the shell and its children
+        assert rss_map[os.getpid()] > rss_map[proc.pid]
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_watchdog_restores_concurrency_after_requeue():
+    schd = Scheduler(n_threads=4, refresh_rate=0.01)
+    schd.set_watchdog(True, ceiling=200)
+    worker = Worker(id=0, cmd='true')
+    worker._oom_killed = True
+    schd._requeued[0] = []
+    assert schd._requeue(0, worker)
+    assert schd.n_threads == 2
+    schd._watch()
+    assert schd.n_threads == 3
+    schd._watch()
+    schd._watch()
+    assert schd.n_threads == 4
+
+
+PLUGIN_SOURCE = '''
+import os
+
+
+def report_pid(value, stdout):
+    stdout.write(f'{value}:{os.getpid()}\\n')
+'''
+
+
+def test_plugin_function_runs_on_worker_pool(tmp_path):
+    from pynipt.lib.plugin import load_module_from_file
+    from pynipt.lib.scheduler import get_worker_pool, shutdown_worker_pool
+    plugin_path = tmp_path / 'myplug.py'
+    plugin_path.write_text(PLUGIN_SOURCE)
+    module = load_module_from_file('pynipt_plugin_myplug', str(plugin_path))
+    try:
+        mng = FuncManager()
+        mng.set_func(module.report_pid)
+        mng.set_arg('value', ['a', 'b'])
+        mng.set_pool(get_worker_pool(max_workers=1))
+        schd = Scheduler(n_threads=2, refresh_rate=0.01)
+        mng.schedule(schd)
+        schd.submit()
+        assert mng.use_pool
+        assert statuses(mng) == ['succeeded'] * 2
+        outputs = [w.output[0].split(':') for w in mng.workers.values()]
+        assert [value for value, _ in outputs] == ['a', 'b']
+        assert all(int(pid) != os.getpid() for _, pid in outputs)
+    finally:
+        shutdown_worker_pool()
+
+
+def test_closure_runs_on_thread():
+    def local(value, stdout):
+        stdout.write(f'{os.getpid()}\n')
+    mng = FuncManager()
+    mng.set_func(local)
+    mng.set_arg('value', [1])
+    mng.set_pool(object())
+    schd = Scheduler(n_threads=1, refresh_rate=0.01)
+    mng.schedule(schd)
+    schd.submit()
+    assert not mng.use_pool
+    assert mng.workers[0].output == [str(os.getpid())]
+
+
+def test_admission_reads_sampled_memory(monkeypatch):
+    import psutil
+    schd = Scheduler(n_threads=4, refresh_rate=0.01)
+    running = Worker(id=0, cmd='true', mem='1G')
+    running.sample_rss(256 * 1024 ** 2)
+    schd._running[(0, 0)] = running
+    assert schd._pending_memory() == 768 * 1024 ** 2
+
+    def scan(*args, **kwargs):
+        raise AssertionError('the process table is scanned on the admission')
+    monkeypatch.setattr(psutil, 'process_iter', scan)
+    assert schd._has_resources(Worker(id=1, cmd='true', mem='1M'))
+
+
+def test_budget_is_unlimited_unless_set(monkeypatch):
+    import psutil
+    from pynipt.lib import scheduler
+    for value, capacity in [('', None), ('0', None), ('3', 3), ('auto', psutil.cpu_count())]:
+        monkeypatch.setattr(scheduler, '_budget', None)
+        monkeypatch.setitem(scheduler.config['Preferences'], 'worker_budget', value)
+        assert scheduler.get_budget().capacity == capacity
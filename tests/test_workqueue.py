@@ -0,0 +1,46 @@
+import os
+import time
+from pynipt.lib.workqueue import WorkQueue
+
+
+def test_late_session_honours_markers(tmp_path):
+    first = WorkQueue(str(tmp_path), heartbeat=1)
+    assert first.claim('a') and first.claim('b')
+    first.release('a', done=True)
+    time.sleep(0.05)
+    # joins while the first session still holds the claim of 'b'
+    late = WorkQueue(str(tmp_path), heartbeat=1)
+    assert late.since == first.since
+    assert late.is_finished('a')
+    assert not late.claim('a')
+    assert not late.claim('b')
+    first.release('b', done=False)
+    first.close()
+    # the next execution opens the queue again, so the markers of the previous one are ignored
+    time.sleep(0.05)
+    nxt = WorkQueue(str(tmp_path), heartbeat=1)
+    assert nxt.since > first.since
+    assert not nxt.is_finished('b')
+    assert nxt.claim('b')
+    nxt.release('b', done=True)
+
+
+def test_lost_claim_is_reported(tmp_path):
+    lost = []
+    queue = WorkQueue(str(tmp_path), heartbeat=0.05)
+    queue.set_lost_handler(lost.append)
+    assert queue.claim('a')
+    # the other session reclaimed it while this one was frozen
+    other = WorkQueue(str(tmp_path), heartbeat=10)
+    os.unlink(os.path.join(str(tmp_path), 'a.claim'))
+    assert other.claim('a')
+    deadline = time.time() + 5
+    while not len(lost) and time.time() < deadline:
+        time.sleep(0.01)
+    assert lost == ['a']
+    assert queue.lost == {'a'}
+    # the claim of the other session is left untouched
+    queue.release('a', done=True)
+    assert os.path.exists(os.path.join(str(tmp_path), 'a.claim'))
+    assert not os.path.exists(os.path.join(str(tmp_path), 'a.done'))
+    other.release('a', done=True)